@@ -1,15 +1,12 @@
 
 import os
 import sys
-import argparse
 import logging
 
+from . import __version__
 from .import loader
 
 from .program import Program, Namespace
-from .repl import Repl
-
-import faulthandler; faulthandler.enable()
 from .exception import TokenError, format_generic
 
 def parse_args(argv):
@@ -20,6 +17,12 @@ def parse_args(argv):
     args.evaluate = None
     args.module = None
     args.node = None
+    args.cache = True
+    args.cache_dir = None
+    args.lazy = False
+    args.import_time = False
+    args.prefetch = False
+    args.profile_compile = False
 
     opts1 = {
         "-n": ("node", str),
@@ -30,6 +33,7 @@ def parse_args(argv):
         "--node": ("node", str),
         "--module": ("module", str),
         "--evaluate": ("evaluate", str),
+        "--cache-dir": ("cache_dir", str),
     }
 
     while argvalues:
@@ -37,13 +41,30 @@ def parse_args(argv):
 
         if arg == "-h" or arg == '--help':
             sys.stdout.write("Usage:\n")
-            sys.stdout.write("  %s [-v] -[V] [-h|--help] [-n|--node] [-m|--module [-e|--evaluate]\n" % program)
+            sys.stdout.write("  %s [-v] -[V] [-h|--help] [-n|--node] [-m|--module [-e|--evaluate] [--no-cache] [--cache-dir DIR] [--lazy-import] [--import-time] [--prefetch] [--profile-compile]\n" % program)
+            sys.stdout.write("  %s compileall [-j N] [-f] [-q] path...\n" % program)
+            sys.stdout.write("  %s bundle [-o app.ezip] [-p path] [--no-source] app.es\n" % program)
             sys.exit(1)
 
         elif arg == "-V":
-            sys.stdout.write("ekanscrypt 0.0.0\n")
+            sys.stdout.write("ekanscrypt %s\n" % __version__)
             sys.exit(1)
 
+        elif arg == "--no-cache":
+            args.cache = False
+
+        elif arg == "--lazy-import":
+            args.lazy = True
+
+        elif arg == "--import-time":
+            args.import_time = True
+
+        elif arg == "--prefetch":
+            args.prefetch = True
+
+        elif arg == "--profile-compile":
+            args.profile_compile = True
+
         elif arg.startswith("-v"):
             args.verbose += len(arg[1:])
 
@@ -67,6 +88,16 @@ def parse_args(argv):
 
 def main():
 
+    import faulthandler; faulthandler.enable()
+
+    # sub commands
+    if len(sys.argv) > 1 and sys.argv[1] == "compileall":
+        from .compileall import main as compileall_main
+        sys.exit(compileall_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "bundle":
+        from .bundle import main as bundle_main
+        sys.exit(bundle_main(sys.argv[2:]))
+
     log_parser = logging.getLogger("ekanscrypt.parser")
     log_proc = logging.getLogger("ekanscrypt.proc")
 
@@ -86,12 +117,22 @@ def main():
         log_parser.setLevel(logging.ERROR)
         log_proc.setLevel(logging.ERROR)
 
-    program = Program()
+    if args.lazy:
+        loader.EkanscryptFinder.set_lazy(True)
+
+    program = Program(cache_dir=args.cache_dir)
+    if not args.cache:
+        program.cache.enabled = False
+
+    profile = None
+    if args.profile_compile:
+        from .instrument import CompileProfile
+        profile = CompileProfile()
 
     if args.evaluate:
         path = "<string>"
         text = args.evaluate
-        unit = program.compile_text(path, text)
+        unit = program.compile_text(path, text, profile=profile)
         unit.function_body()
     elif args.module:
 
@@ -121,11 +162,23 @@ def main():
             if args.positional[0] == "-":
                 text = sys.stdin.read()
                 path = "<string>"
-                unit = program.compile_text(path, text)
+                unit = program.compile_text(path, text, profile=profile)
+            elif args.positional[0].endswith(".ezip"):
+                from .bundle import load_bundle
+                path = args.positional[0]
+                text = None
+                unit = load_bundle(path)
             else:
                 path = args.positional[0]
                 text = None
-                unit = program.compile(path)
+                unit = program.compile(path, profile=profile)
+
+            if args.prefetch:
+                # compile the modules imported by the script in parallel
+                from .imports import prefetch
+                report = prefetch(unit.function_body.__code__)
+                if args.import_time:
+                    report.write()
 
             exports = unit.function_body()
 
@@ -144,8 +197,18 @@ def main():
             format_generic(*sys.exc_info())
 
     else:
+        from .repl import Repl
         repl = Repl()
         repl.main()
 
+    if profile is not None:
+        profile.write(sys.stderr)
+
+    if args.import_time:
+        loader.import_report()
+
+    if args.verbose > 1:
+        sys.stderr.write("compile cache: %(hits)d hits, %(misses)d misses, %(errors)d errors\n" % program.cache.stats())
+
 if __name__ == '__main__':
     main()
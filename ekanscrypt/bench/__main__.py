@@ -0,0 +1,38 @@
+#! cd ../.. && python3 -m ekanscrypt.bench
+
+"""
+run a benchmark
+
+    python -m ekanscrypt.bench <name> [args...]
+"""
+
+import sys
+import importlib
+
+BENCHMARKS = {
+    "startup": "interpreter startup time and imports",
+    "scaling": "compiler time and memory for growing inputs",
+    "runtime": "ekanscrypt programs compared with equivalent python",
+    "quality": "bytecode generated by ekanscrypt compared with python",
+    "pipeline": "throughput of process pipelines in MB/s",
+    "text": "lines per second through text nodes",
+}
+
+def usage():
+    sys.stdout.write("usage: python -m ekanscrypt.bench <name> [args...]\n\n")
+    for name, description in BENCHMARKS.items():
+        sys.stdout.write("  %-10s %s\n" % (name, description))
+
+def main():
+
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        usage()
+        return 1
+
+    name = sys.argv[1]
+    mod = importlib.import_module("ekanscrypt.bench." + name)
+    sys.argv = [sys.argv[0] + " " + name] + sys.argv[2:]
+    return mod.main()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+#! cd ../.. && python3 -m ekanscrypt.bench.pipeline
+
+"""
+measure the throughput of process pipelines
+
+    python -m ekanscrypt.bench pipeline [-s MB] [-b BYTES...] [-o] [--copy] [case...]
+
+a file of the given size is pushed through pipelines built from shell
+commands and python nodes. The output of the last stage is consumed by
+communicate and counted, or written to a file with -o. Each case is run
+once for every read size so that the cost of small reads can be
+compared with large reads. The work cases run cpu bound python stages
+on threads and pwork runs them in child processes. --copy disables moving data inside the
+kernel, to compare with copying the output through python.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+class _Counter(object):
+    """ a file like object which counts the bytes written to it """
+
+    def __init__(self):
+        super(_Counter, self).__init__()
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return len(data)
+
+def _passthrough(bufsize):
+    from ..objects.proc import EkanscryptProcNode
+
+    def callback(stream):
+        buf = stream.stdin.read(bufsize)
+        while buf:
+            stream.stdout.write(buf)
+            buf = stream.stdin.read(bufsize)
+    return EkanscryptProcNode(callback)
+
+def _source(path, bufsize):
+    from ..objects.proc import EkanscryptProcNode
+
+    def callback(stream):
+        with open(path, "rb") as rf:
+            buf = rf.read(bufsize)
+            while buf:
+                stream.stdout.write(buf)
+                buf = rf.read(bufsize)
+    return EkanscryptProcNode(callback)
+
+def _count_words(stream):
+    # cpu bound work holding the GIL, used to compare threads and processes
+    buf = stream.stdin.read(65536)
+    while buf:
+        words = 0
+        for line in buf.split(b"\n"):
+            words += len(line.split(b"a"))
+        stream.stdout.write(buf)
+        buf = stream.stdin.read(65536)
+
+def _work(process):
+    from ..objects.proc import EkanscryptProcNode, EkanscryptProcessNode
+    if process:
+        return EkanscryptProcessNode(_count_words)
+    return EkanscryptProcNode(_count_words)
+
+def _cat(path="-"):
+    from ..objects.proc import EkanscryptProc
+    return EkanscryptProc("cat", path)
+
+def _gzip(path, bufsize):
+    from ..objects.proc import EkanscryptProc
+
+    # the redirect gives the output file to gzip, communicate has no output
+    redirect = EkanscryptProc.Redirect(1, 1, path + ".gz")
+    return EkanscryptProc("gzip", "-1", "-c", redirect)(_cat(path)())
+
+# name -> function(path, bufsize) returning the last stage of a pipeline
+CASES = {
+    "cat": lambda path, bufsize: _cat(path)(),
+    "node": lambda path, bufsize: _source(path, bufsize)(),
+    "cat|node": lambda path, bufsize: _passthrough(bufsize)(_cat(path)()),
+    "node|cat": lambda path, bufsize: _cat()(_source(path, bufsize)()),
+    "cat|node|cat": lambda path, bufsize: _cat()(_passthrough(bufsize)(_cat(path)())),
+    "cat|gzip>out": _gzip,
+    "cat|work|work": lambda path, bufsize: _work(False)(_work(False)(_cat(path)())),
+    "cat|pwork|pwork": lambda path, bufsize: _work(True)(_work(True)(_cat(path)())),
+}
+
+def make_file(path, size):
+    """ write size bytes of text lines to path """
+    line = b"".join(bytes([97 + i % 26]) for i in range(79)) + b"\n"
+    block = line * (65536 // len(line) + 1)
+    with open(path, "wb") as wf:
+        remaining = size
+        while remaining > 0:
+            wf.write(block[:remaining])
+            remaining -= len(block)
+
+def run_case(name, path, bufsize, output=None, zero_copy=True):
+    """
+    run one pipeline, returns the number of bytes output and seconds.
+    the throughput is relative to the size of the input
+
+    output: path to write the output of the pipeline to
+    zero_copy: allow communicate to move the output inside the kernel
+    """
+    from ..objects.proc import EkanscryptProc
+
+    size = os.path.getsize(path)
+    t0 = time.perf_counter()
+    default, EkanscryptProc.zero_copy = EkanscryptProc.zero_copy, zero_copy
+    try:
+        pipeline = CASES[name](path, bufsize)
+        if output:
+            with open(output, "wb") as stdout:
+                returncode = EkanscryptProc.communicate(pipeline, stdout=stdout, bufsize=bufsize)
+            count = os.path.getsize(output)
+        else:
+            stdout = _Counter()
+            returncode = EkanscryptProc.communicate(pipeline, stdout=stdout, bufsize=bufsize)
+            count = stdout.count
+    finally:
+        EkanscryptProc.zero_copy = default
+    elapsed = time.perf_counter() - t0
+
+    if returncode != 0:
+        raise RuntimeError("%s: pipeline failed: %s" % (name, returncode))
+
+    return {
+        "name": name,
+        "bufsize": bufsize,
+        "bytes": count,
+        "seconds": elapsed,
+        "throughput": size / elapsed / 1e6,
+    }
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog="python -m ekanscrypt.bench pipeline",
+        description="measure the throughput of process pipelines")
+    parser.add_argument("cases", nargs="*",
+        help="cases to run: %s (default: all)" % ", ".join(CASES))
+    parser.add_argument("-s", "--size", type=int, default=64,
+        help="megabytes to send through each pipeline")
+    parser.add_argument("-b", "--bufsize", type=int, nargs="+",
+        default=[1024, 65536], help="read sizes to compare")
+    parser.add_argument("-o", "--output", action="store_true",
+        help="write the output of each pipeline to a file")
+    parser.add_argument("--copy", action="store_true",
+        help="copy the output through python instead of using splice")
+    args = parser.parse_args(argv)
+
+    names = args.cases or list(CASES)
+    for name in names:
+        if name not in CASES:
+            parser.error("unknown case: %s" % name)
+
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "data")
+        make_file(path, args.size * 1000000)
+        output = os.path.join(root, "output") if args.output else None
+
+        sys.stdout.write("%-16s %10s %10s %10s\n" % (
+            "case", "bufsize", "time [s]", "MB/s"))
+        for name in names:
+            for bufsize in args.bufsize:
+                result = run_case(name, path, bufsize, output, not args.copy)
+                sys.stdout.write("%-16s %10d %10.3f %10.1f\n" % (name,
+                    bufsize, result["seconds"], result["throughput"]))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
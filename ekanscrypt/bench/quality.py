@@ -0,0 +1,311 @@
+#! cd ../.. && python3 -m ekanscrypt.bench.quality
+
+"""
+report the quality of the bytecode generated by the compiler
+
+    python -m ekanscrypt.bench quality [--json] [--dump] [workload...]
+    python -m ekanscrypt.bench quality [--python FILE] FILE.es
+
+for each code object the number of instructions, NOP and EXTENDED_ARG
+instructions, redundant load/store pairs, the maximum stack size and
+the size of the consts, names and varnames tables are counted.
+
+the same counts are made for the code CPython generates for an
+equivalent python function, and the difference is reported. By default
+the workloads of the runtime benchmark are used, a .es file can be
+compared with a python file which defines functions of the same name.
+
+functions are matched by the name they are assigned to, relative to
+the outermost function. A function found on one side only is an error.
+with --json the report can be saved, and passed to --baseline to show
+how the generated code changed between commits.
+"""
+
+import sys
+import dis
+import json
+import argparse
+
+from bytecode import ConcreteBytecode
+
+METRICS = ["instrs", "nops", "redundant", "stack", "extended_args",
+    "consts", "names", "varnames"]
+
+# short column names for the text report
+_COLUMNS = ["instrs", "nops", "redund", "stack", "extarg",
+    "consts", "names", "vars"]
+
+_LOAD_STORE = {
+    "LOAD_FAST": "STORE_FAST",
+    "LOAD_NAME": "STORE_NAME",
+    "LOAD_GLOBAL": "STORE_GLOBAL",
+    "LOAD_DEREF": "STORE_DEREF",
+}
+_STORE_LOAD = {v: k for k, v in _LOAD_STORE.items()}
+
+def redundant_pairs(instrs):
+    """
+    count pairs of adjacent instructions which do no useful work
+
+        store_load: STORE_X n; LOAD_X n   (DUP_TOP; STORE_X n)
+        load_store: LOAD_X n; STORE_X n   (nothing)
+        load_pop:   LOAD_X; POP_TOP       (nothing)
+    """
+
+    counts = {"store_load": 0, "load_store": 0, "load_pop": 0}
+    for a, b in zip(instrs, instrs[1:]):
+        if b.name == _STORE_LOAD.get(a.name) and a.arg == b.arg:
+            counts["store_load"] += 1
+        elif b.name == _LOAD_STORE.get(a.name) and a.arg == b.arg:
+            counts["load_store"] += 1
+        elif a.name.startswith("LOAD_") and b.name == "POP_TOP":
+            counts["load_pop"] += 1
+    return counts
+
+def code_metrics(code):
+    """ return a dictionary of metrics for a single code object """
+
+    # EXTENDED_ARG is folded into the following instruction by default
+    instrs = list(ConcreteBytecode.from_code(code))
+    extended = sum(1 for instr in ConcreteBytecode.from_code(code, extended_arg=True)
+        if instr.name == "EXTENDED_ARG")
+
+    pairs = redundant_pairs(instrs)
+
+    metrics = {
+        "instrs": len(instrs),
+        "nops": sum(1 for instr in instrs if instr.name == "NOP"),
+        "redundant": sum(pairs.values()),
+        "stack": code.co_stacksize,
+        "extended_args": extended,
+        "consts": len(code.co_consts),
+        "names": len(code.co_names),
+        "varnames": len(code.co_varnames),
+    }
+    metrics.update(pairs)
+    return metrics
+
+_STORES = ("STORE_FAST", "STORE_NAME", "STORE_GLOBAL", "STORE_DEREF")
+
+def assigned_names(code):
+    """
+    return {nested code object: name} for the functions of code which
+    are stored to a variable right after they are made, 'f = () => {}'
+    in ekanscrypt and 'def f():' in python
+    """
+
+    names = {}
+    pending = made = None
+    for instr in dis.get_instructions(code):
+        if made is not None and instr.opname in _STORES:
+            names[made] = instr.argval
+        made = None
+        if instr.opname == "LOAD_CONST" and hasattr(instr.argval, "co_code"):
+            pending = instr.argval
+        elif instr.opname == "MAKE_FUNCTION":
+            made, pending = pending, None
+    return names
+
+def _function_name(code):
+    # ekanscrypt names functions '<module>.lambda.<name>', anonymous
+    # functions 'Anonymous_<line>_<column>_<depth>'
+    name = code.co_name.rsplit(".", 1)[-1]
+    if name.startswith("Anonymous_"):
+        return "<lambda>"
+    return name
+
+def code_objects(code, key=""):
+    """
+    yield (key, code) for code and every code object nested in it.
+
+    the key is the dotted path of function names below the outermost
+    code object. A function is named by the variable it is assigned
+    to, or by its own name when it is not assigned, so that the keys
+    of ekanscrypt and python match.
+    """
+
+    yield key, code
+
+    names = assigned_names(code)
+    seen = {}
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            name = names.get(const) or _function_name(const)
+            seen[name] = seen.get(name, 0) + 1
+            if seen[name] > 1:
+                # anonymous functions share a name
+                name = "%s#%d" % (name, seen[name])
+            yield from code_objects(const, key + "." + name if key else name)
+
+def compare(es_code, py_code=None):
+    """
+    return a list of rows, one for each function in the code objects.
+    each row has a name, and the metrics for ekanscrypt and python
+    (None when py_code is not given).
+
+    raises ValueError if a function exists on one side only.
+    """
+
+    es = dict(code_objects(es_code))
+    py = dict(code_objects(py_code)) if py_code is not None else {}
+
+    if py_code is not None:
+        unpaired = ["%s (%s)" % (key or "<root>", side)
+            for side, a, b in (("ekanscrypt", es, py), ("python", py, es))
+            for key in a if key not in b]
+        if unpaired:
+            raise ValueError("unpaired functions: %s" % ", ".join(unpaired))
+
+    rows = []
+    for key in es:
+        rows.append({
+            "name": key or "<root>",
+            "ekanscrypt": code_metrics(es[key]),
+            "python": code_metrics(py[key]) if py_code is not None else None,
+        })
+    return rows
+
+def load_workload(name):
+    """ return the (ekanscrypt, python) code objects for a runtime workload """
+    from .runtime import load
+
+    es_function, py_function = load(name)
+    return es_function.__code__, py_function.__code__
+
+def load_files(es_path, py_path=None):
+    """ return the (ekanscrypt, python) module code objects of two files """
+    from ..program import Program
+
+    es_code = Program().compile(es_path).function_body.__code__
+
+    py_code = None
+    if py_path is not None:
+        with open(py_path, "r") as rf:
+            py_code = compile(rf.read(), py_path, "exec")
+
+    return es_code, py_code
+
+def dump(title, code):
+    """ print the instructions of every code object using _dump_bytecode """
+    from ..bytecode import _dump_bytecode
+
+    for key, child in code_objects(code):
+        print("%s %s" % (title, key or "<root>"))
+        _dump_bytecode(ConcreteBytecode.from_code(child))
+        print("")
+
+def _cells(metrics):
+    if metrics is None:
+        return " ".join("%6s" % "-" for _ in METRICS)
+    return " ".join("%6d" % metrics[key] for key in METRICS)
+
+def _diff(a, b):
+    if a is None or b is None:
+        return " ".join("%6s" % "" for _ in METRICS)
+    return " ".join("%+6d" % (a[key] - b[key]) for key in METRICS)
+
+def write_report(reports, stream):
+    """ write a table of each function, python and the difference """
+
+    stream.write("%-24s %-6s %s\n" % ("function", "",
+        " ".join("%6s" % c for c in _COLUMNS)))
+    for title, rows in reports.items():
+        stream.write("%s\n" % title)
+        for row in rows:
+            es, py = row["ekanscrypt"], row["python"]
+            stream.write("  %-22s %-6s %s\n" % (row["name"], "ekans", _cells(es)))
+            if py is not None:
+                stream.write("  %-22s %-6s %s\n" % ("", "python", _cells(py)))
+                if es is not None:
+                    stream.write("  %-22s %-6s %s\n" % ("", "diff", _diff(es, py)))
+
+def write_changes(reports, baseline, stream):
+    """
+    compare the ekanscrypt metrics with a previous report.
+    returns the number of functions with more instructions than before
+    """
+
+    regressions = 0
+    for title, rows in reports.items():
+        previous = {row["name"]: row["ekanscrypt"] for row in baseline.get(title, [])}
+        for row in rows:
+            es, old = row["ekanscrypt"], previous.get(row["name"])
+            if es is None or old is None:
+                continue
+            changed = [key for key in METRICS if es[key] != old.get(key, es[key])]
+            if not changed:
+                continue
+            if es["instrs"] > old.get("instrs", es["instrs"]):
+                regressions += 1
+            stream.write("%s %s: %s\n" % (title, row["name"], ", ".join(
+                "%s %d -> %d" % (key, old[key], es[key]) for key in changed)))
+
+    if not regressions:
+        stream.write("no functions grew compared to the baseline\n")
+    return regressions
+
+def main(argv=None):
+
+    from .runtime import WORKLOADS
+
+    parser = argparse.ArgumentParser(prog="python -m ekanscrypt.bench quality",
+        description="compare the bytecode generated by ekanscrypt with python")
+    parser.add_argument("inputs", nargs="*",
+        help="workloads: %s (default: all), or a .es file" % ", ".join(WORKLOADS))
+    parser.add_argument("--python", default=None,
+        help="a python file with functions equivalent to the .es file")
+    parser.add_argument("--json", action="store_true",
+        help="write the report as json")
+    parser.add_argument("--dump", action="store_true",
+        help="print the instructions of each code object")
+    parser.add_argument("--baseline", default=None,
+        help="a report previously written with --json, to show what changed")
+    parser.add_argument("--check", action="store_true",
+        help="with --baseline, exit with status 1 if any function grew")
+    args = parser.parse_args(argv)
+
+    names = args.inputs or list(WORKLOADS)
+
+    pairs = {}
+    for name in names:
+        if name.endswith(".es"):
+            pairs[name] = load_files(name, args.python)
+        elif name in WORKLOADS:
+            pairs[name] = load_workload(name)
+        else:
+            parser.error("unknown workload: %s" % name)
+
+    reports = {}
+    for title, (es, py) in pairs.items():
+        try:
+            reports[title] = compare(es, py)
+        except ValueError as e:
+            sys.stderr.write("%s: %s\n" % (title, e))
+            return 1
+
+    if args.dump:
+        for title, (es, py) in pairs.items():
+            dump("ekans %s" % title, es)
+            if py is not None:
+                dump("python %s" % title, py)
+
+    if args.json:
+        json.dump(reports, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        write_report(reports, sys.stdout)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as rf:
+            baseline = json.load(rf)
+        # keep stdout parsable when writing json
+        stream = sys.stderr if args.json else sys.stdout
+        stream.write("\n")
+        regressions = write_changes(reports, baseline, stream)
+        if args.check and regressions:
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,401 @@
+#! cd ../.. && python3 -m ekanscrypt.bench.runtime
+
+"""
+compare the run time of ekanscrypt programs with equivalent python
+
+    python -m ekanscrypt.bench runtime [-r N] [-w N] [workload...]
+
+each workload is a function written in ekanscrypt, based on a program
+in samples/, and the same function written by hand in python. Both are
+called with the same arguments and must return the same result. Each
+is run a few times to warm up, then timed repeatedly. The ratio of
+the median times shows where the generated bytecode is slower (> 1.0)
+or faster (< 1.0) than the bytecode produced by CPython.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+import statistics
+
+# ---------------------------------------------------------------------------
+# fibonachi.es
+
+ES_FIB = """
+fib(n) => {
+    if (n < 2) {
+        return n
+    }
+    return fib(n - 1) + fib(n - 2)
+}
+"""
+
+def py_fib(n):
+    if n < 2:
+        return n
+    return py_fib(n - 1) + py_fib(n - 2)
+
+# ---------------------------------------------------------------------------
+# mergesort.es
+
+ES_MERGESORT = """
+merge(left, right) => {
+    result = [];
+    while left && right {
+        if left[0] <= right[0] {
+            result.append(left.pop(0));
+        } else {
+            result.append(right.pop(0));
+        }
+    }
+    while left {
+        result.append(left.pop(0));
+    }
+    while right {
+        result.append(right.pop(0));
+    }
+    return result;
+}
+
+mergesort(lst) => {
+    if len(lst) <= 1 {
+        return lst;
+    }
+
+    m = len(lst)//2;
+    left = lst[:m];
+    right = lst[m:];
+
+    left = mergesort(left)
+    right = mergesort(right)
+    return merge(left, right);
+}
+"""
+
+def py_merge(left, right):
+    result = []
+    while left and right:
+        if left[0] <= right[0]:
+            result.append(left.pop(0))
+        else:
+            result.append(right.pop(0))
+    while left:
+        result.append(left.pop(0))
+    while right:
+        result.append(right.pop(0))
+    return result
+
+def py_mergesort(lst):
+    if len(lst) <= 1:
+        return lst
+    m = len(lst) // 2
+    left = py_mergesort(lst[:m])
+    right = py_mergesort(lst[m:])
+    return py_merge(left, right)
+
+# ---------------------------------------------------------------------------
+# man_boy_test.es
+
+ES_MAN_BOY = """
+A(k, x1, x2, x3, x4, x5) => {
+    B() => {
+        k = k - 1;
+        var B = var A = A(k, B, x1, x2, x3, x4)
+        return B;
+    }
+
+    if (k <= 0) {
+        v4=isinstance(x4,int)?x4:x4()
+        v5=isinstance(x5,int)?x5:x5()
+        var A = v4 + v5;
+        return A;
+    } else {
+        return B();
+    }
+}
+"""
+
+def py_man_boy(k, x1, x2, x3, x4, x5):
+    def B():
+        nonlocal k
+        k = k - 1
+        return py_man_boy(k, B, x1, x2, x3, x4)
+    if k <= 0:
+        v4 = x4 if isinstance(x4, int) else x4()
+        v5 = x5 if isinstance(x5, int) else x5()
+        return v4 + v5
+    return B()
+
+# ---------------------------------------------------------------------------
+# matrix.es
+
+ES_MATMUL = """
+matmul(a, b, n) => {
+    c = []
+    for i in range(n) {
+        row = [0] * n
+        for j in range(n) {
+            s = 0
+            for k in range(n) {
+                s += a[i][k] * b[k][j]
+            }
+            row[j] = s
+        }
+        c.append(row)
+    }
+    return c
+}
+"""
+
+def py_matmul(a, b, n):
+    c = []
+    for i in range(n):
+        row = [0] * n
+        for j in range(n):
+            s = 0
+            for k in range(n):
+                s += a[i][k] * b[k][j]
+            row[j] = s
+        c.append(row)
+    return c
+
+# ---------------------------------------------------------------------------
+# json2.es
+
+ES_DRILL = """
+drill(data, n) => {
+    total = 0
+    for i in range(n) {
+        total += data->fruit->0->inventory
+        total += data->vegetables->0->inventory
+    }
+    return total
+}
+"""
+
+def _py_get(x, y):
+    # the equivalent of x->y, None if the key or index does not exist
+    if x is None:
+        return None
+    if isinstance(x, list):
+        return x[y] if 0 <= y < len(x) else None
+    return x.get(y)
+
+def py_drill(data, n):
+    total = 0
+    for i in range(n):
+        total += _py_get(_py_get(_py_get(data, "fruit"), 0), "inventory")
+        total += _py_get(_py_get(_py_get(data, "vegetables"), 0), "inventory")
+    return total
+
+# ---------------------------------------------------------------------------
+# text_stream.es
+
+ES_PIPELINE = """
+pipeline(lines) => {
+    out = []
+    source = () => {
+        body = (stream) => {
+            for line in lines {
+                stream.stdout.writeline2(line)
+            }
+        }
+        return Proc.TextNode(body)
+    }
+    node = () => {
+        body = (stream) => {
+            while (line = stream.stdin.readline2()) {
+                stream.stdout.writeline2(line.replace("s", "S"))
+            }
+        }
+        return Proc.TextNode(body)
+    }
+    sink = () => {
+        body = (stream) => {
+            while (line = stream.stdin.readline2()) {
+                out.append(line)
+            }
+        }
+        return Proc.TextNode(body)
+    }
+    source() |> node() |> sink()
+    return out
+}
+"""
+
+def _py_stage(target, *files):
+    # a thread which calls target with the files and closes them
+    def run():
+        try:
+            target(*files)
+        finally:
+            for file in files:
+                file.close()
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+def py_pipeline(lines):
+    # the same three stages, each in a thread, connected by pipes
+    out = []
+    def source():
+        def body(wf):
+            for line in lines:
+                wf.write(line + "\n")
+        return body
+    def node():
+        def body(rf, wf):
+            for line in rf:
+                line = line.rstrip("\n")
+                if line:
+                    wf.write(line.replace("s", "S") + "\n")
+        return body
+    def sink():
+        def body(rf):
+            for line in rf:
+                line = line.rstrip("\n")
+                if line:
+                    out.append(line)
+        return body
+
+    r1, w1 = os.pipe()
+    r2, w2 = os.pipe()
+    threads = [
+        _py_stage(source(), open(w1, "w")),
+        _py_stage(node(), open(r1, "r"), open(w2, "w")),
+        _py_stage(sink(), open(r2, "r")),
+    ]
+    for thread in threads:
+        thread.join()
+    return out
+
+# ---------------------------------------------------------------------------
+
+def _shuffled(n):
+    items = list(range(n))
+    random.Random(0).shuffle(items)
+    return items
+
+def _matrix(n):
+    return [[(i * n + j) % 7 for j in range(n)] for i in range(n)]
+
+_JSON = {
+    "fruit": [
+        {"type": "apple", "inventory": 1000},
+        {"type": "orange", "inventory": 500},
+    ],
+    "vegetables": [
+        {"type": "ketchup", "inventory": 3200.0},
+    ],
+}
+
+# name -> (ekanscrypt source, function name, python function, argument factory)
+# the factory is called before every call, so that functions which
+# modify their arguments always see the same input
+WORKLOADS = {
+    "fib":       (ES_FIB,       "fib",       py_fib,       lambda: (20,)),
+    "mergesort": (ES_MERGESORT, "mergesort", py_mergesort, lambda: (_shuffled(2000),)),
+    "man_boy":   (ES_MAN_BOY,   "A",         py_man_boy,   lambda: (8, 1, -1, -1, 1, 0)),
+    "matmul":    (ES_MATMUL,    "matmul",    py_matmul,    lambda: (_matrix(40), _matrix(40), 40)),
+    "drill":     (ES_DRILL,     "drill",     py_drill,     lambda: (_JSON, 20000)),
+    "pipeline":  (ES_PIPELINE,  "pipeline",  py_pipeline,
+        lambda: (["line %d of the stream" % i for i in range(20000)],)),
+}
+
+def load(name):
+    """ compile a workload, return the (ekanscrypt, python) functions """
+    from ..program import Program
+
+    source, function_name, py_function, _ = WORKLOADS[name]
+    exports = Program().compile_text("<%s>" % name, source).function_body()
+    return exports[function_name], py_function
+
+def timeit(function, factory, repeat=10, warmup=2):
+    """
+    call function warmup times, then time repeat calls.
+    returns (result, list of seconds)
+    """
+
+    result = None
+    for i in range(warmup):
+        result = function(*factory())
+
+    times = []
+    for i in range(repeat):
+        args = factory()
+        t0 = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - t0)
+
+    return result, times
+
+def stats(times):
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+    }
+
+def run_workload(name, repeat=10, warmup=2):
+    """
+    time both implementations of a workload. raises ValueError
+    if they do not return the same result
+    """
+
+    es_function, py_function = load(name)
+    factory = WORKLOADS[name][3]
+
+    es_result, es_times = timeit(es_function, factory, repeat, warmup)
+    py_result, py_times = timeit(py_function, factory, repeat, warmup)
+
+    if es_result != py_result:
+        raise ValueError("%s: results differ: %r != %r" % (name,
+            str(es_result)[:40], str(py_result)[:40]))
+
+    es = stats(es_times)
+    py = stats(py_times)
+
+    return {
+        "name": name,
+        "ekanscrypt": es,
+        "python": py,
+        "ratio": es["median"] / py["median"],
+        "ratio_min": es["min"] / py["min"],
+    }
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog="python -m ekanscrypt.bench runtime",
+        description="compare ekanscrypt programs with equivalent python")
+    parser.add_argument("workloads", nargs="*",
+        help="workloads to run: %s (default: all)" % ", ".join(WORKLOADS))
+    parser.add_argument("-r", "--repeat", type=int, default=10,
+        help="number of timed calls")
+    parser.add_argument("-w", "--warmup", type=int, default=2,
+        help="number of calls before timing")
+    args = parser.parse_args(argv)
+
+    names = args.workloads or list(WORKLOADS)
+    for name in names:
+        if name not in WORKLOADS:
+            parser.error("unknown workload: %s" % name)
+
+    sys.stdout.write("%-10s %20s %20s %7s %7s\n" % ("workload",
+        "ekans med±sd [ms]", "python med±sd [ms]", "ratio", "min"))
+
+    for name in names:
+        result = run_workload(name, args.repeat, args.warmup)
+        es = result["ekanscrypt"]
+        py = result["python"]
+        sys.stdout.write("%-10s %11.3f ±%7.3f %11.3f ±%7.3f %7.2f %7.2f\n" % (name,
+            es["median"] * 1000, es["stdev"] * 1000,
+            py["median"] * 1000, py["stdev"] * 1000,
+            result["ratio"], result["ratio_min"]))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
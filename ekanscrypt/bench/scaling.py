@@ -0,0 +1,212 @@
+#! cd ../.. && python3 -m ekanscrypt.bench.scaling
+
+"""
+measure how the compiler scales with the size of the input
+
+    python -m ekanscrypt.bench scaling [--quick] [--check] [-r N] [shape...]
+
+synthetic programs of increasing size are generated for each shape, and
+the time to lex, parse and compile each program is measured, along with
+the peak memory used. The growth exponent between sizes is estimated
+with a least squares fit of log(time) against log(size). An exponent
+above the threshold is flagged as super-linear.
+
+a shape which exceeds the recursion limit of the interpreter is also
+flagged. with --check the exit status is 1 if any shape is flagged,
+so that the benchmark can be used to catch regressions.
+"""
+
+import sys
+import math
+import time
+import argparse
+
+def gen_flat(n):
+    """ a long module of simple statements """
+    return "".join("x%d = %d * 2 + x%d\n" % (i, i, max(i - 1, 0)) for i in range(n))
+
+def gen_nested(n):
+    """ deeply nested blocks """
+    # not indented, so that the size of the text is linear in n
+    return "".join("if (x > %d) {\n" % i for i in range(n)) + "y = 1\n" + "}\n" * n
+
+def gen_json(n):
+    """ a single large literal """
+    items = ('"k%d": [%d, 2.5, "s%d", {"a": true, "b": null}]' % (i, i, i) for i in range(n))
+    return "data = {\n    " + ",\n    ".join(items) + "\n}\n"
+
+def gen_lambdas(n):
+    """ many small functions """
+    return "".join("f%d = (a, b) => {\n    return a + b * %d\n}\n" % (i, i) for i in range(n))
+
+def gen_nested_lambdas(n):
+    """ a chain of lambdas, each nested in the previous """
+    return "f = " + "".join("(a%d) => " % i for i in range(n)) + "1\n"
+
+def gen_switch(n):
+    """ a single switch with many cases """
+    cases = "".join("    case %d {y = %d}\n" % (i, i) for i in range(n))
+    return "switch (x) {\n" + cases + "    default {y = 0}\n}\n"
+
+def gen_exec(n):
+    """ a long exec pipeline """
+    stages = "".join(' |> exec grep "-e" "p%d"' % i for i in range(n))
+    return 'p = exec cat "in.txt"' + stages + "\n"
+
+# name -> (generator, sizes, quick sizes)
+SHAPES = {
+    "flat":           (gen_flat,           [500, 1000, 2000, 4000], [250, 500, 1000]),
+    "nested":         (gen_nested,         [25, 50, 100, 200],      [10, 20, 40]),
+    "json":           (gen_json,           [250, 500, 1000, 2000],  [100, 200, 400]),
+    "lambdas":        (gen_lambdas,        [250, 500, 1000, 2000],  [100, 200, 400]),
+    "nested_lambdas": (gen_nested_lambdas, [25, 50, 100, 200],      [10, 20, 40]),
+    "switch":         (gen_switch,         [250, 500, 1000, 2000],  [100, 200, 400]),
+    "exec":           (gen_exec,           [50, 100, 200, 400],     [20, 40, 80]),
+}
+
+PHASES = ["lex", "parse", "compile"]
+
+def measure(text, repeat=3):
+    """
+    return a dictionary of the best time for each phase, and the
+    peak memory in bytes used to compile the text
+    """
+
+    from ..lexer import lexer
+    from ..parser import parser
+    from ..compiler import Expression
+
+    best = {phase: float("inf") for phase in PHASES}
+
+    def run():
+        t0 = time.perf_counter()
+        tokens = list(lexer(text))
+        t1 = time.perf_counter()
+        asf = parser(tokens)
+        t2 = time.perf_counter()
+        expr = Expression("__main__", "<bench>", flags=Expression.CF_MODULE)
+        expr.compile(asf)
+        t3 = time.perf_counter()
+        return t1 - t0, t2 - t1, t3 - t2
+
+    for i in range(repeat):
+        for phase, seconds in zip(PHASES, run()):
+            best[phase] = min(best[phase], seconds)
+
+    # tracing slows the compiler down, so memory is measured separately
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best["peak"] = peak
+    return best
+
+def growth(sizes, values):
+    """
+    the exponent k in value = c * size ** k, estimated with a
+    least squares fit on a log-log scale
+    """
+
+    points = [(math.log(n), math.log(v)) for n, v in zip(sizes, values) if v > 0]
+    if len(points) < 2:
+        return 0.0
+    mx = sum(x for x, _ in points) / len(points)
+    my = sum(y for _, y in points) / len(points)
+    sxx = sum((x - mx) ** 2 for x, _ in points)
+    sxy = sum((x - mx) * (y - my) for x, y in points)
+    return sxy / sxx if sxx else 0.0
+
+def run_shape(name, sizes, repeat=3, stream=None):
+    """
+    measure one shape at each size. returns a dictionary containing
+    the measurements for each size, and the growth exponent of each
+    phase and the peak memory
+    """
+
+    generator = SHAPES[name][0]
+
+    rows = []
+    # the size at which the compiler exceeded the recursion limit
+    limit = None
+    for n in sizes:
+        text = generator(n)
+        try:
+            result = measure(text, repeat)
+        except RecursionError:
+            if stream is not None:
+                stream.write("%-16s %6d  recursion limit exceeded\n" % (name, n))
+            limit = n
+            break
+        result["size"] = n
+        result["bytes"] = len(text)
+        rows.append(result)
+        if stream is not None:
+            stream.write("%-16s %6d %10.2f %10.2f %10.2f %10.1f\n" % (name, n,
+                result["lex"] * 1000, result["parse"] * 1000,
+                result["compile"] * 1000, result["peak"] / 1024))
+
+    exponents = {}
+    for key in PHASES + ["peak"]:
+        exponents[key] = growth([row["size"] for row in rows], [row[key] for row in rows])
+
+    return {"name": name, "rows": rows, "growth": exponents, "limit": limit}
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog="python -m ekanscrypt.bench scaling",
+        description="measure how the compiler scales with the size of the input")
+    parser.add_argument("shapes", nargs="*",
+        help="shapes to run: %s (default: all)" % ", ".join(SHAPES))
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+        help="number of times to compile each program, the best time is used")
+    parser.add_argument("--quick", action="store_true",
+        help="use smaller sizes")
+    parser.add_argument("--threshold", type=float, default=1.3,
+        help="growth exponent above which a phase is flagged")
+    parser.add_argument("--check", action="store_true",
+        help="exit with status 1 if any phase is flagged")
+    args = parser.parse_args(argv)
+
+    shapes = args.shapes or list(SHAPES)
+    for name in shapes:
+        if name not in SHAPES:
+            parser.error("unknown shape: %s" % name)
+
+    sys.stdout.write("%-16s %6s %10s %10s %10s %10s\n" % (
+        "shape", "size", "lex[ms]", "parse[ms]", "comp[ms]", "peak[KiB]"))
+
+    results = []
+    for name in shapes:
+        _, sizes, quick_sizes = SHAPES[name]
+        results.append(run_shape(name, quick_sizes if args.quick else sizes,
+            args.repeat, sys.stdout))
+
+    sys.stdout.write("\ngrowth exponent (1.0 is linear)\n")
+    sys.stdout.write("%-16s %8s %8s %8s %8s\n" % ("shape", "lex", "parse", "compile", "peak"))
+
+    flagged = []
+    for result in results:
+        cells = []
+        for key in PHASES + ["peak"]:
+            k = result["growth"][key]
+            mark = "*" if k > args.threshold else " "
+            if mark == "*":
+                flagged.append("%s %s" % (result["name"], key))
+            cells.append("%7.2f%s" % (k, mark))
+        if result["limit"] is not None:
+            cells.append("recursion limit at %d" % result["limit"])
+            flagged.append("%s recursion" % result["name"])
+        sys.stdout.write("%-16s %s\n" % (result["name"], " ".join(cells)))
+
+    if flagged:
+        sys.stdout.write("\nsuper-linear (exponent > %.2f): %s\n" % (
+            args.threshold, ", ".join(flagged)))
+
+    return 1 if args.check and flagged else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+#! cd ../.. && python3 -m ekanscrypt.bench.startup
+
+"""
+measure interpreter startup
+
+runs `ekans -e '1'` repeatedly in a fresh process and reports the wall
+time and the number of modules imported. the time to start a bare
+python interpreter is reported for comparison.
+"""
+
+import os
+import sys
+import time
+import subprocess
+import statistics
+
+def _run(argv, env):
+    t0 = time.perf_counter()
+    subprocess.run(argv, env=env, check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - t0
+
+def _import_count(argv, env):
+    result = subprocess.run(argv[:1] + ["-X", "importtime"] + argv[1:],
+        env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    lines = result.stderr.decode("utf-8").splitlines()
+    names = [line.split("|")[-1].strip() for line in lines[1:]
+        if line.startswith("import time:")]
+    return len(names), len([name for name in names if name.startswith("ekanscrypt")])
+
+def benchmark(argv, repeat=20, warmup=3, env=None):
+
+    for i in range(warmup):
+        _run(argv, env)
+
+    times = [_run(argv, env) for i in range(repeat)]
+    total, local = _import_count(argv, env)
+
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "imports": total,
+        "ekanscrypt_imports": local,
+    }
+
+def main():
+
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    env = dict(os.environ)
+    package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, env.get('PYTHONPATH')]))
+
+    cases = [
+        ("python -c pass", [sys.executable, "-c", "pass"]),
+        ("ekans -e '1'", [sys.executable, "-m", "ekanscrypt", "-e", "1"]),
+        ("ekans --no-cache -e '1'", [sys.executable, "-m", "ekanscrypt", "--no-cache", "-e", "1"]),
+    ]
+
+    sys.stdout.write("%-28s %10s %10s %8s %8s\n" % (
+        "case", "min [ms]", "med [ms]", "imports", "ekans"))
+    for name, argv in cases:
+        result = benchmark(argv, repeat=repeat, env=env)
+        sys.stdout.write("%-28s %10.2f %10.2f %8d %8d\n" % (name,
+            result['min'] * 1000, result['median'] * 1000,
+            result['imports'], result['ekanscrypt_imports']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#! cd ../.. && python3 -m ekanscrypt.bench.text
+
+"""
+measure the lines per second read and written by text nodes
+
+    python -m ekanscrypt.bench text [-n LINES] [-b BYTES...] [case...]
+
+a file of words, one per line, is piped from cat through a text node
+which copies every line with readline2 and writeline2. The batches case
+copies lists of lines with batches and writelines2. The codecs case
+wraps the same pipes in codecs stream readers and writers, the way text
+nodes were implemented before io.TextIOWrapper, for comparison. The find
+case is the dictionary scan from samples/find.es written in ekanscrypt.
+The text*3 and objects*3 cases copy the lines through three adjacent
+nodes, exchanging text over pipes or objects in memory. The lines*3
+cases apply three functions to every line with line nodes, which are
+fused into one thread, and with fusing disabled. The parallel cases run
+the same transforms with Proc.Parallel, on a process for every cpu.
+"""
+
+import os
+import sys
+import time
+import random
+import codecs
+import argparse
+import tempfile
+
+ES_FIND = """
+count_unique = (word) => {
+    return len(set(word))
+}
+
+rule = (word) => {
+    return len(word) == 5 && count_unique(word) == 4 && word[2] == word[3];
+}
+
+find = () => {
+    return Proc.TextNode((stream) => {
+        while (line = stream.stdin.readline2()) {
+            if rule(line) {
+                stream.stdout.writeline2(line)
+            }
+        }
+    })
+}
+"""
+
+class _Counter(object):
+    """ a text file like object which counts the lines written to it """
+
+    def __init__(self):
+        super(_Counter, self).__init__()
+        self.count = 0
+
+    def write(self, text):
+        self.count += text.count("\n")
+        return len(text)
+
+def _copy(stream):
+    while True:
+        line = stream.stdin.readline2()
+        if not line:
+            break
+        stream.stdout.writeline2(line)
+
+def _copy_batches(stream):
+    for lines in stream.stdin.batches(1000):
+        stream.stdout.writelines2(lines)
+
+def _copy_codecs(stream):
+    # readline2 and writeline2 as implemented with codecs
+    reader = codecs.getreader("utf-8")(stream.stdin.buffer)
+    writer = codecs.getwriter("utf-8")(stream.stdout.buffer)
+    while True:
+        line = reader.readline()
+        while line and not line.strip():
+            line = reader.readline()
+        line = line.rstrip("\n")
+        if not line:
+            break
+        writer.write(line)
+        writer.write("\n")
+
+def _copy_objects(stream):
+    for batch in stream.stdin.batches():
+        stream.stdout.putmany(batch)
+
+def _chain(mk, count):
+    # a function which connects count nodes to the given stream
+    def connect(stream):
+        for i in range(count):
+            stream = mk()(stream)
+        return stream
+    return connect
+
+def _strip(line):
+    return line.strip()
+
+def _line_node(bufsize, fuse):
+    from ..objects.proc import EkanscryptProcLineNode
+    return EkanscryptProcLineNode(_strip, buffer_size=bufsize, fuse=fuse)
+
+def _parallel(bufsize, ordered):
+    from ..objects.proc import EkanscryptProcParallel
+    return EkanscryptProcParallel(_strip, buffer_size=bufsize,
+        ordered=ordered, processes=True)
+
+def _find():
+    from ..program import Program
+    exports = Program().compile_text("<find>", ES_FIND).function_body()
+    return exports['find']()
+
+def _node(callback, bufsize):
+    from ..objects.proc import EkanscryptProcTextNode
+    return EkanscryptProcTextNode(callback, buffer_size=bufsize)
+
+def _object_node(callback, bufsize):
+    from ..objects.proc import EkanscryptProcObjectNode
+    return EkanscryptProcObjectNode(callback, buffer_size=bufsize)
+
+# name -> function(bufsize) returning a text node, or a function
+# which connects nodes to a stream
+CASES = {
+    "readline2": lambda bufsize: _node(_copy, bufsize),
+    "batches": lambda bufsize: _node(_copy_batches, bufsize),
+    "codecs": lambda bufsize: _node(_copy_codecs, bufsize),
+    "find": lambda bufsize: _find(),
+    "text*3": lambda bufsize: _chain(lambda: _node(_copy_batches, bufsize), 3),
+    "objects*3": lambda bufsize: _chain(lambda: _object_node(_copy_objects, bufsize), 3),
+    "lines*3": lambda bufsize: _chain(lambda: _line_node(bufsize, True), 3),
+    "lines*3-nofuse": lambda bufsize: _chain(lambda: _line_node(bufsize, False), 3),
+    "parallel": lambda bufsize: _parallel(bufsize, True),
+    "parallel-unordered": lambda bufsize: _parallel(bufsize, False),
+}
+
+def make_words(path, count, seed=0):
+    """ write count random lower case words to path, one per line """
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    with open(path, "w") as wf:
+        for i in range(count):
+            wf.write("".join(rng.choice(letters) for j in range(rng.randint(3, 10))))
+            wf.write("\n")
+
+def run_case(name, path, lines, bufsize):
+    """ run a text node over the file at path, returns lines per second """
+    from ..objects.proc import EkanscryptProc
+
+    node = CASES[name](bufsize)
+    stdout = _Counter()
+    t0 = time.perf_counter()
+    returncode = EkanscryptProc.communicate(node(EkanscryptProc("cat", path)()), stdout=stdout)
+    elapsed = time.perf_counter() - t0
+
+    if returncode != 0:
+        raise RuntimeError("%s: pipeline failed: %s" % (name, returncode))
+
+    return {
+        "name": name,
+        "bufsize": bufsize,
+        "lines": stdout.count,
+        "seconds": elapsed,
+        "rate": lines / elapsed,
+    }
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog="python -m ekanscrypt.bench text",
+        description="measure the lines per second of text nodes")
+    parser.add_argument("cases", nargs="*",
+        help="cases to run: %s (default: all)" % ", ".join(CASES))
+    parser.add_argument("-n", "--lines", type=int, default=200000,
+        help="number of lines in the input")
+    parser.add_argument("-b", "--bufsize", type=int, nargs="+",
+        default=[8192, 65536], help="text stream buffer sizes to compare")
+    args = parser.parse_args(argv)
+
+    names = args.cases or list(CASES)
+    for name in names:
+        if name not in CASES:
+            parser.error("unknown case: %s" % name)
+
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "words")
+        make_words(path, args.lines)
+
+        sys.stdout.write("%-20s %10s %10s %12s\n" % (
+            "case", "bufsize", "time [s]", "lines/s"))
+        for name in names:
+            for bufsize in args.bufsize:
+                result = run_case(name, path, args.lines, bufsize)
+                sys.stdout.write("%-20s %10d %10.3f %12.0f\n" % (name,
+                    bufsize, result["seconds"], result["rate"]))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,66 @@
 
+
+import sys
+
+from .objects.io import EkanscryptIo
+from .util import es_glob, es_format, es_regex
+
+def _proc():
+    from .objects.proc import EkanscryptProc
+    return EkanscryptProc
+
+class _LazyProc(object):
+    """
+    stands in for EkanscryptProc so that the process machinery
+    (subprocess, threading, select, ...) is only imported by
+    scripts which use it.
+    """
+
+    def __call__(self, *args):
+        return _proc()(*args)
+
+    def __getattr__(self, name):
+        return getattr(_proc(), name)
+
+    def __repr__(self):
+        return repr(_proc())
+
+def es_communicate(stream, stdout=None, stderr=None):
+    return _proc().communicate(stream, stdout=stdout, stderr=stderr)
+
+def default_globals(spec=None):
+    """
+    returns the globals used when executing compiled code
+
+    spec: the ModuleSpec of an imported module, used to resolve
+        relative imports. like a python script, code without a spec
+        cannot use relative imports.
+    """
+    globals_ = {
+        'print': print,
+        'eprint': es_print,
+        "io": EkanscryptIo(),
+        "True": True,
+        "False": False,
+        "None": None,
+        "nan": float('nan'),
+        "infinity": float("inf"),
+        "Proc": _LazyProc(),
+        "__es_communicate__": es_communicate,
+        '__es_glob__': es_glob,
+        '__es_format__': es_format,
+        '__es_regex__': es_regex,
+        '__es_drill__': es_drill,
+        'range': range,
+        '__spec__': spec, # for import
+        '__loader__': spec.loader if spec is not None else None,
+        '__package__': spec.parent if spec is not None else '',
+        '__builtins__': __builtins__, # for import
+        'globals': globals,
+        'locals': locals,
+    }
+    return globals_
+
 def es_print(*args):
     first = True
     for item in args:
@@ -16,7 +78,7 @@ def es_drill(x, y):
         return None
 
     if isinstance(x, list):
-        if isinstance(x, int):
+        if isinstance(y, int):
             if 0 <= y < len(x):
                 return x[y]
     elif y in x:
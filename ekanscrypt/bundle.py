@@ -0,0 +1,214 @@
+#! cd .. && python3 -m ekanscrypt.bundle
+
+"""
+single file application bundles
+
+    ekans bundle [-o app.ezip] [-p path] [--no-source] app.es
+    ekans app.ezip
+
+a bundle is a zip archive containing the compiled code for an entry
+script and every ekanscrypt module reachable from it. The archive
+layout mirrors the package layout, for example:
+
+    __main__.esc
+    util.esc
+    pkg/__init__.esc
+    pkg/sub.esc
+
+each .esc entry is the compile cache header followed by the marshalled
+code object. The source for each module is stored next to the code,
+and is compiled in memory if the code was built by a different version
+of python or ekanscrypt.
+
+running a bundle opens the archive once, and reads the central directory
+once. Modules are then imported from the open archive without touching
+the file system, so a bundle can run from a read only location.
+"""
+
+import os
+import sys
+import time
+import marshal
+import zipfile
+import argparse
+from importlib.abc import MetaPathFinder
+from importlib.machinery import ModuleSpec
+
+from .cache import CACHE_HEADER
+from .loader import EkanscryptyLoader, compile_module
+
+BUNDLE_EXTENSION = ".ezip"
+
+MAIN_MODULE = "__main__"
+
+def _arcname(name, is_package):
+    arcname = name.replace(".", "/")
+    if is_package:
+        arcname += "/__init__"
+    return arcname
+
+def build_bundle(entry, output=None, search_path=None, include_source=True, stream=None):
+    """
+    compile entry and every ekanscrypt module it imports into a bundle
+
+    output defaults to the entry script with the extension replaced.
+    returns the path to the bundle
+    """
+
+    # imported here so that running a bundle does not require the parser
+    from .imports import import_graph
+
+    if output is None:
+        output = os.path.splitext(entry)[0] + BUNDLE_EXTENSION
+
+    graph = import_graph(entry, search_path, MAIN_MODULE)
+
+    # the archive is written to a temporary name and renamed into place
+    # so that a running bundle is never replaced with a partial file
+    tmp_path = output + ".tmp"
+    try:
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name, info in graph.items():
+                t0 = time.perf_counter()
+
+                with open(info.filename, "rb") as rb:
+                    source_bytes = rb.read()
+
+                code = compile_module(name, info.filename, source_bytes)
+
+                arcname = _arcname(name, info.is_package)
+                zf.writestr(arcname + ".esc", CACHE_HEADER + marshal.dumps(code))
+                if include_source:
+                    zf.writestr(arcname + ".es", source_bytes)
+
+                if stream is not None:
+                    stream.write("%9.2f ms  %-24s %s\n" % (
+                        (time.perf_counter() - t0) * 1000, name, info.filename))
+
+        os.replace(tmp_path, output)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    return output
+
+class BundleLoader(EkanscryptyLoader):
+    def __init__(self, bundle, arcname):
+        super(BundleLoader, self).__init__(os.path.join(bundle.path, arcname + ".es"))
+        self.bundle = bundle
+        self.arcname = arcname
+
+    def get_code(self, fullname):
+        code = self.bundle.read_code(self.arcname)
+        self.cached = code is not None
+
+        if code is None:
+            source_bytes = self.bundle.read(self.arcname + ".es")
+            if source_bytes is None:
+                raise ImportError("bundle %s was built for a different version "
+                    "and does not contain the source for %s" % (
+                    self.bundle.path, fullname), name=fullname)
+            code = compile_module(fullname, self.filename, source_bytes)
+
+        return code
+
+class BundleFinder(MetaPathFinder):
+    """
+    import ekanscrypt modules from a bundle
+
+    the archive is opened once and kept open for the lifetime of
+    the finder. lookups are answered from the central directory
+    which is read when the archive is opened.
+    """
+
+    def __init__(self, path):
+        super(BundleFinder, self).__init__()
+        self.path = path
+        self.archive = zipfile.ZipFile(path, "r")
+        self.names = set(self.archive.namelist())
+
+    def read(self, name):
+        if name not in self.names:
+            return None
+        return self.archive.read(name)
+
+    def read_code(self, arcname):
+        """
+        return the code object for an entry, or None if the code was
+        built by a different version of python or ekanscrypt
+        """
+        data = self.read(arcname + ".esc")
+        if data is None or not data.startswith(CACHE_HEADER):
+            return None
+        try:
+            return marshal.loads(data[len(CACHE_HEADER):])
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def find_spec(self, fullname, path, target=None):
+
+        arcname = fullname.replace(".", "/")
+
+        for is_package in (True, False):
+            name = _arcname(fullname, is_package)
+            if name + ".esc" in self.names or name + ".es" in self.names:
+                loader = BundleLoader(self, name)
+                spec = ModuleSpec(fullname, loader,
+                    origin=loader.filename, is_package=is_package)
+                if is_package:
+                    spec.submodule_search_locations.append(
+                        os.path.join(self.path, arcname))
+                return spec
+
+        return None
+
+    def install(self):
+        # bundled modules take priority over the file system
+        sys.meta_path.insert(0, self)
+
+    def close(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+        self.archive.close()
+
+def load_bundle(path):
+    """
+    install a finder for the modules in a bundle and return the
+    entry script as a CompiledModule
+    """
+
+    from .program import CompiledModule
+
+    finder = BundleFinder(path)
+    finder.install()
+
+    loader = BundleLoader(finder, MAIN_MODULE)
+    return CompiledModule(MAIN_MODULE, loader.get_code(MAIN_MODULE))
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog="ekans bundle",
+        description="bundle an ekanscrypt application into a single file")
+    parser.add_argument("entry",
+        help="the script to run when the bundle is executed")
+    parser.add_argument("-o", "--output", default=None,
+        help="output path (default: the entry script with a %s extension)" % BUNDLE_EXTENSION)
+    parser.add_argument("-p", "--path", action="append", default=None,
+        help="directory to search for imported modules, may be given more than once")
+    parser.add_argument("--no-source", action="store_true",
+        help="do not include the source of each module")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    output = build_bundle(args.entry, args.output, args.path,
+        include_source=not args.no_source,
+        stream=None if args.quiet else sys.stdout)
+
+    if not args.quiet:
+        sys.stdout.write("wrote %s\n" % output)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
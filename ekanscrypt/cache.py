@@ -0,0 +1,177 @@
+
+"""
+persistent compile cache
+
+compiled module code is stored in a content addressed directory. The key
+is a hash of the source text, the compiler version, the python magic
+number and the parameters given to the compiler. A hit skips the lexer,
+parser and compiler entirely.
+"""
+
+import os
+import marshal
+import logging
+from importlib.util import MAGIC_NUMBER, source_hash
+
+from . import __version__
+
+log = logging.getLogger("ekanscrypt.cache")
+
+# the modules which determine the code compiled for a source file
+COMPILER_MODULES = ["lexer.py", "parser.py", "compiler.py", "token.py",
+    "bytecode.py", "util.py", "builtins.py", "program.py"]
+
+def compiler_hash(directory=None):
+    """
+    returns a hash of the size and modification time of the compiler
+    modules, so that editing the lexer, parser or compiler invalidates
+    every cache entry. the modules are only stat'ed, not read, since
+    this runs every time the interpreter starts.
+
+    when the sources are not installed only the version is used.
+    """
+    if directory is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+    parts = [__version__]
+    for name in COMPILER_MODULES:
+        try:
+            st = os.stat(os.path.join(directory, name))
+            parts.append("%s:%d:%d" % (name, st.st_size, st.st_mtime_ns))
+        except OSError:
+            parts.append(name)
+    return source_hash("\x00".join(parts).encode("utf-8")).hex()
+
+CACHE_TAG = ("ekanscrypt-%s-%s" % (__version__, compiler_hash())).encode("utf-8")
+
+CACHE_HEADER = MAGIC_NUMBER + CACHE_TAG + b"\x00"
+
+def default_cache_dir():
+    root = os.environ.get("EKANS_CACHE_DIR")
+    if root:
+        return root
+    root = os.environ.get("XDG_CACHE_HOME")
+    if not root:
+        root = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(root, "ekanscrypt")
+
+def atomic_write(path, data):
+    """
+    write data to a temporary file in the same directory as path and
+    then rename it into place. readers will either see the old file,
+    or the complete new file, never a partial write.
+
+    multiple processes may write the same path at the same time, the
+    last rename wins. Since every writer produces the same content for
+    the same path, it does not matter which one that is.
+    """
+
+    dirpath, _ = os.path.split(path)
+    if dirpath:
+        os.makedirs(dirpath, exist_ok=True)
+
+    # the temporary name is unique to this process and this write.
+    # the file is created with the default permissions (subject to
+    # the umask) so that a shared cache is readable by other users
+    tmp_path = "%s.%d.%x.tmp" % (path, os.getpid(), id(data))
+    fd = os.open(tmp_path, os.O_EXCL | os.O_CREAT | os.O_WRONLY, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as wb:
+            wb.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+class CompileCache(object):
+    def __init__(self, root=None):
+        super(CompileCache, self).__init__()
+
+        self.root = root or default_cache_dir()
+        self.enabled = not os.environ.get("EKANS_NO_CACHE")
+
+        # cleared by the first write which fails, a cache root which
+        # can not be written is not tried again
+        self.writable = True
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def key(self, text, filename, name, flags, globals=None):
+
+        # the code object records the filename and name, and the compiler
+        # emits different instructions depending on the flags and
+        # the set of names which are known to be global.
+        parts = [filename, name, str(flags)]
+        if globals:
+            parts.extend(sorted(globals))
+        parts.append(text)
+
+        # source_hash is the hash used by python for hash based pyc
+        # files (PEP 552). unlike hashlib it is always available
+        # without importing additional modules
+        data = CACHE_HEADER + "\x00".join(parts).encode("utf-8")
+
+        return source_hash(data).hex()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key + ".esc")
+
+    def get(self, key):
+
+        path = self.path(key)
+
+        try:
+            with open(path, "rb") as rb:
+                if rb.read(len(CACHE_HEADER)) != CACHE_HEADER:
+                    raise ValueError("invalid cache header")
+                code = marshal.load(rb)
+        except (FileNotFoundError, NotADirectoryError):
+            self.misses += 1
+            return None
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            log.warning("unable to read cache entry %s: %s" % (path, e))
+            self.errors += 1
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return code
+
+    def put(self, key, code):
+
+        if not self.writable:
+            return False
+
+        path = self.path(key)
+
+        try:
+            atomic_write(path, CACHE_HEADER + marshal.dumps(code))
+        except OSError as e:
+            # a read only cache root, the script still runs using the
+            # code compiled in memory
+            log.info("unable to write cache entry %s: %s" % (path, e))
+            self.writable = False
+            self.errors += 1
+            return False
+
+        return True
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
+
+_default_cache = None
+
+def default_cache():
+    """ return the compile cache shared by every Program in this process """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = CompileCache()
+    return _default_cache
@@ -0,0 +1,194 @@
+#! cd .. && python3 -m ekanscrypt.compileall
+
+"""
+ahead of time compiler for ekanscrypt source trees
+
+    ekans compileall [-j N] [-f] [-q] [--invalidation-mode MODE] path...
+
+every .es file found under the given paths is compiled and written to
+the same cache location used by the loader, so that the first import
+of each module does not pay the cost of compiling it. Each file is also
+compiled as a script into the compile cache, which 'ekans file.es'
+reads the script from.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+from .loader import cache_path, check_module, save_module, compile_module, \
+    default_cache_mode, CACHE_TIMESTAMP, CACHE_CHECKED_HASH, CACHE_UNCHECKED_HASH
+from .exception import TokenError
+
+COMPILED = "compiled"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+def module_name(path):
+    """
+    the name of the module a file would be imported as, including
+    every parent directory which is a package, as the finder does
+    """
+    head, tail = os.path.split(os.path.abspath(path))
+    name = tail[:-3]
+    parts = [] if name == "__init__" else [name]
+    while os.path.isfile(os.path.join(head, "__init__.es")):
+        head, package = os.path.split(head)
+        parts.insert(0, package)
+    return ".".join(parts)
+
+def find_sources(paths):
+    """ yield every .es file in paths, directories are searched recursively """
+
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = sorted(d for d in dirnames
+                    if d != "__pycache__" and not d.startswith("."))
+                for filename in sorted(filenames):
+                    if filename.endswith(".es"):
+                        yield os.path.join(dirpath, filename)
+        else:
+            yield path
+
+def compile_script(path):
+    """
+    compile a file as the script run by 'ekans path' into the compile
+    cache. returns True if it was compiled, False if it was cached
+    """
+    from .program import Program
+
+    program = Program()
+    if not program.cache.enabled:
+        return False
+    misses = program.cache.misses
+    program.compile(path)
+    return program.cache.misses > misses
+
+def compile_file(path, force=False, mode=None):
+    """
+    compile a single file to the loader cache and the compile cache
+
+    returns a tuple (path, status, seconds, message)
+
+    an existing cache is rewritten when it was written with a different
+    invalidation mode, or when it is a hash based cache of an older
+    version of the source, even if the loader does not check the hash.
+    """
+
+    t0 = time.perf_counter()
+
+    if mode is None:
+        mode = default_cache_mode()
+
+    try:
+        cpath = cache_path(path)
+        source_stat = os.stat(path)
+
+        compiled = force or not check_module(cpath, path, source_stat, mode)
+        if compiled:
+            with open(path, "rb") as rb:
+                source_bytes = rb.read()
+
+            code = compile_module(module_name(path), path, source_bytes)
+            save_module(cpath, code, source_bytes, source_stat, mode)
+
+        if compile_script(path):
+            compiled = True
+
+        if not compiled:
+            return path, SKIPPED, time.perf_counter() - t0, ""
+
+    except TokenError as e:
+        message = "line %d column %d: %s" % (e.token.line, e.token.index, e)
+        return path, FAILED, time.perf_counter() - t0, message
+    except Exception as e:
+        message = "%s: %s" % (type(e).__name__, e)
+        return path, FAILED, time.perf_counter() - t0, message
+
+    return path, COMPILED, time.perf_counter() - t0, ""
+
+def compile_paths(paths, workers=None, force=False, mode=None, stream=None):
+    """
+    compile every .es file under paths using a pool of worker processes
+
+    workers defaults to the number of cpus. returns a list of the
+    results of compile_file, in the order the files were found.
+    """
+
+    if mode is None:
+        mode = default_cache_mode()
+
+    sources = list(find_sources(paths))
+
+    if workers is None or workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(sources)) or 1
+
+    if workers == 1:
+        results = []
+        for path in sources:
+            result = compile_file(path, force, mode)
+            _report(stream, result)
+            results.append(result)
+        return results
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(compile_file, path, force, mode) for path in sources]
+        results = []
+        for future in futures:
+            result = future.result()
+            _report(stream, result)
+            results.append(result)
+
+    return results
+
+def _report(stream, result):
+    if stream is None:
+        return
+    path, status, seconds, message = result
+    stream.write("%-8s %9.2f ms  %s\n" % (status, seconds * 1000, path))
+    if message:
+        stream.write("         %s\n" % message)
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog="ekans compileall",
+        description="compile ekanscrypt source files ahead of time")
+    parser.add_argument("paths", nargs="+",
+        help="files or directories to compile")
+    parser.add_argument("-j", "--workers", type=int, default=0,
+        help="number of worker processes, 0 for one per cpu")
+    parser.add_argument("-f", "--force", action="store_true",
+        help="compile files even if the cache is up to date")
+    parser.add_argument("-q", "--quiet", action="store_true",
+        help="only report errors")
+    parser.add_argument("--invalidation-mode", default=None,
+        choices=[CACHE_TIMESTAMP, CACHE_CHECKED_HASH, CACHE_UNCHECKED_HASH])
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+
+    results = compile_paths(args.paths, workers=args.workers,
+        force=args.force, mode=args.invalidation_mode,
+        stream=None if args.quiet else sys.stdout)
+
+    elapsed = time.perf_counter() - t0
+
+    counts = {COMPILED: 0, SKIPPED: 0, FAILED: 0}
+    for path, status, seconds, message in results:
+        counts[status] += 1
+        if args.quiet and status == FAILED:
+            sys.stderr.write("%s: %s\n" % (path, message))
+
+    if not args.quiet:
+        sys.stdout.write("%d compiled, %d skipped, %d failed in %.2f s\n" % (
+            counts[COMPILED], counts[SKIPPED], counts[FAILED], elapsed))
+
+    return 1 if counts[FAILED] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,16 +3,14 @@
 # https://docs.python.org/3/library/dis.html
 # https://docs.python.org/3.8/library/types.html
 
-from .token import Token
+from .token import Token, token_count
 
 import dis
 import types
 import sys
 from collections import defaultdict
 import opcode as _opcode
-from .objects.io import EkanscryptIo
-from .objects.proc import EkanscryptProc
-from .util import parseNumber, es_glob, es_format, es_regex
+from .util import parseNumber
 from .exception import CompilerError, format_generic
 from .bytecode import dump, calcsize, \
     ConcreteBytecode2, \
@@ -20,7 +18,7 @@ from .bytecode import dump, calcsize, \
     BytecodeRelJumpInstr, BytecodeContinueInstr, BytecodeBreakInstr
 
 from  . import builtins
-import faulthandler; faulthandler.enable()
+from .instrument import phase, active_profile
 
 import logging
 log = logging.getLogger("ekanscrypt.compiler")
@@ -73,29 +71,7 @@ class Expression(object):
 
     @staticmethod
     def defaultGlobals():
-        globals_ = {
-            'print': print,
-            'eprint': builtins.es_print,
-            "io": EkanscryptIo(),
-            "True": True,
-            "False": False,
-            "None": None,
-            "nan": float('nan'),
-            "infinity": float("inf"),
-            "Proc": EkanscryptProc,
-            "__es_communicate__": EkanscryptProc.communicate,
-            '__es_glob__': es_glob,
-            '__es_format__': es_format,
-            '__es_regex__': es_regex,
-            '__es_drill__': builtins.es_drill,
-            'range': range,
-            '__spec__': __spec__, # for import
-            '__loader__': __loader__, # for import
-            '__builtins__': __builtins__, # for import
-            'globals': globals,
-            'locals': locals,
-        }
-        return globals_
+        return builtins.default_globals()
 
     def execute(self):
         rv = self.function_body()
@@ -107,20 +83,24 @@ class Expression(object):
 
     def compile(self, asf, name=None):
         last_index = len(asf) - 1
-        for index, ast in enumerate(asf):
-            production = self.flags&Expression.CF_REPL and last_index == index and ast.type !=  Token.S_EXEC_PROCESS
-            instr = self._compile(ast, production=production)
-            try:
-                self.bc.extend(instr)
-            except ValueError:
-                raise
-            if production:
-                self.module_globals.add("_")
-                self.bc.extend(self._compile_store(Token(Token.S_LABEL, 1, 0, "_")))
-        self._finalize()
-
-        stacksize = calcsize(self.bc)
-        code = self.bc.to_code(stacksize)
+        with phase("codegen"):
+            for index, ast in enumerate(asf):
+                production = self.flags&Expression.CF_REPL and last_index == index and ast.type !=  Token.S_EXEC_PROCESS
+                instr = self._compile(ast, production=production)
+                try:
+                    self.bc.extend(instr)
+                except ValueError:
+                    raise
+                if production:
+                    self.module_globals.add("_")
+                    self.bc.extend(self._compile_store(Token(Token.S_LABEL, 1, 0, "_")))
+        with phase("_finalize"):
+            self._finalize()
+
+        with phase("calcsize"):
+            stacksize = calcsize(self.bc)
+        with phase("to_code"):
+            code = self.bc.to_code(stacksize)
         self.function_body = types.FunctionType(code, self.globals, self.bc.name)
 
     def _make_label(self):
@@ -1548,6 +1528,17 @@ class Expression(object):
 
     def _compile_lambda(self, tok, production=True, expr_flags=0):
 
+        profile = active_profile()
+        if profile is None:
+            return self._compile_lambda_impl(tok, production, expr_flags)
+
+        # the self time of the lambda is the code generation for its body
+        name = "lambda %s line %d" % (tok.value or "<anonymous>", tok.line)
+        with profile.phase(name):
+            return self._compile_lambda_impl(tok, production, expr_flags)
+
+    def _compile_lambda_impl(self, tok, production=True, expr_flags=0):
+
         if not tok.value:
             lambda_qualified_name = 'Anonymous_%d_%d_%d' % (
                 tok.line, tok.index, self.depth)
@@ -1633,12 +1624,15 @@ class Expression(object):
         if len(subexpr.bc) and subexpr.bc[-1].name != 'RETURN_VALUE':
                 subexpr.bc.append(BytecodeInstr('RETURN_VALUE', lineno=tok.line))
         subexpr.bc.argcount = argcount
-        subexpr._finalize()
+        with phase("_finalize"):
+            subexpr._finalize()
 
         index_code = len(self.bc.consts)
-        stacksize = calcsize(subexpr.bc)
+        with phase("calcsize"):
+            stacksize = calcsize(subexpr.bc)
         try:
-            code = subexpr.bc.to_code(stacksize)
+            with phase("to_code"):
+                code = subexpr.bc.to_code(stacksize)
         except Exception as e:
             #subexpr.bc.to_code_debug()
             subexpr.dump()
@@ -2266,13 +2260,13 @@ def main():  # pragma: no cover
                 text = src.read()
     try:
         tokens = list(lexer(text))
-        c2 = Token.count
+        c2 = token_count()
         asf = parser(tokens)
-        c3 = Token.count
+        c3 = token_count()
         #for tok in asf:
         #    print(tok.toString(True))
         expr = compiler(asf, path)
-        c4 = Token.count
+        c4 = token_count()
 
         print(expr)
         expr.dump()
@@ -0,0 +1,367 @@
+
+"""
+static import analysis
+
+the parser produces an S_IMPORT token for every import statement,
+with the children (level, name, fromlist). This module walks the
+parse tree of a script to find those tokens, and resolves the names
+to ekanscrypt source files using the same rules as the EkanscryptFinder.
+
+prefetch() uses the import graph to compile every module that is not
+in the loader cache, in parallel, before the entry script is executed.
+"""
+
+import os
+import sys
+import time
+import types
+
+from .token import Token
+
+# the state of a module after prefetch
+CACHED = "cached"
+COMPILED = "compiled"
+FAILED = "failed"
+
+class ModuleInfo(object):
+    def __init__(self, name, filename, is_package=False):
+        super(ModuleInfo, self).__init__()
+        self.name = name
+        self.filename = filename
+        self.is_package = is_package
+        # names of the ekanscrypt modules imported by this module
+        self.imports = []
+        # set by prefetch
+        self.status = None
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return "ModuleInfo<%s,%s>" % (self.name, self.filename)
+
+def find_imports(asf):
+    """
+    yield a tuple (level, name, fromlist) for every import in the
+    parse tree, in the order they appear in the source.
+    """
+
+    stack = list(reversed(asf))
+    while stack:
+        tok = stack.pop()
+        if tok.type == Token.S_IMPORT:
+            level, name, fromlist = tok.children
+            names = []
+            for child in fromlist.children:
+                if child.type == Token.S_LABEL:
+                    names.append(child.value)
+                elif child.children:
+                    names.append(child.children[0].value)
+            yield int(level.value or 0), name.value, names
+        else:
+            stack.extend(reversed(tok.children))
+
+def code_imports(code):
+    """
+    yield a tuple (level, name, fromlist) for every import in a code
+    object, including the imports in nested functions.
+
+    this finds the same imports as find_imports, for code loaded from
+    the cache which has not been parsed.
+    """
+
+    import dis
+
+    stack = [code]
+    while stack:
+        co = stack.pop()
+        instrs = list(dis.get_instructions(co))
+        for i, instr in enumerate(instrs):
+            if instr.opname != "IMPORT_NAME":
+                continue
+
+            # the level and fromlist are pushed before IMPORT_NAME
+            # the fromlist is either a constant or a BUILD_TUPLE
+            j = i - 1
+            if j >= 0 and instrs[j].opname == "BUILD_TUPLE":
+                j -= instrs[j].arg + 1
+            else:
+                j -= 1
+            level = 0
+            if j >= 0 and instrs[j].opname == "LOAD_CONST":
+                level = instrs[j].argval or 0
+
+            fromlist = []
+            k = i + 1
+            while k < len(instrs) and instrs[k].opname == "IMPORT_FROM":
+                fromlist.append(instrs[k].argval)
+                k += 2
+
+            yield level, instr.argval, fromlist
+
+        stack.extend(c for c in co.co_consts if isinstance(c, types.CodeType))
+
+def resolve(fullname, search_path):
+    """
+    resolve a dotted module name to ekanscrypt source files
+
+    returns a list of ModuleInfo, one for each package or module in
+    fullname which is an ekanscrypt source file, parents first.
+    resolution stops at the first name which is not an ekanscrypt
+    module, since that is left to the python import system.
+    """
+
+    modules = []
+    path = search_path
+    parts = fullname.split(".")
+    for i, part in enumerate(parts):
+        name = ".".join(parts[:i + 1])
+        found = None
+        for entry in path:
+            filename = os.path.join(entry, part, "__init__.es")
+            if os.path.isfile(filename):
+                found = ModuleInfo(name, filename, True)
+                break
+            filename = os.path.join(entry, part + ".es")
+            if os.path.isfile(filename):
+                found = ModuleInfo(name, filename, False)
+                break
+
+        if found is None:
+            break
+
+        modules.append(found)
+        if not found.is_package:
+            break
+        path = [os.path.dirname(found.filename)]
+
+    return modules
+
+def parse_file(path):
+    """ return the parse tree for a source file """
+
+    from .lexer import lexer
+    from .parser import parser
+
+    with open(path, "r") as rf:
+        text = rf.read()
+
+    return parser(list(lexer(text)))
+
+def _resolve_relative(info, level, target):
+    """
+    returns the absolute name of a relative import in the module info,
+    None when the import goes beyond the top level package. python
+    reports the error when the module is imported.
+    """
+
+    package = info.name if info.is_package else info.name.rpartition(".")[0]
+    if not package or info.name == "__main__":
+        return None
+    parts = package.split(".")
+    if level - 1 >= len(parts):
+        return None
+    base = ".".join(parts[:len(parts) - (level - 1)])
+    return base + "." + target if target else base
+
+def _add_imports(info, imports, search_path, graph):
+    """
+    resolve the imports of a module, adding new modules to the graph.
+    returns the list of modules which were added
+    """
+
+    added = []
+    for level, target, fromlist in imports:
+        if level != 0:
+            target = _resolve_relative(info, level, target)
+            if target is None:
+                continue
+
+        modules = resolve(target, search_path)
+
+        # from pkg import mod, may import a submodule
+        if modules and modules[-1].is_package and \
+           modules[-1].name == target:
+            for child in fromlist:
+                modules.extend(resolve(target + "." + child, search_path)[len(modules):])
+
+        for module in modules:
+            if module.name not in info.imports:
+                info.imports.append(module.name)
+            if module.name not in graph:
+                graph[module.name] = module
+                added.append(module)
+
+    return added
+
+def import_graph(entry, search_path=None, name="__main__"):
+    """
+    find every ekanscrypt module reachable from the entry script
+
+    search_path defaults to the directory of the entry script and the
+    current working directory. returns a dictionary of module name to
+    ModuleInfo in breadth first order, starting with the entry script.
+    """
+
+    if search_path is None:
+        search_path = [os.path.dirname(os.path.abspath(entry)), os.getcwd()]
+
+    root = ModuleInfo(name, entry, False)
+    graph = {name: root}
+    queue = [root]
+    while queue:
+        info = queue.pop(0)
+        imports = find_imports(parse_file(info.filename))
+        queue.extend(_add_imports(info, imports, search_path, graph))
+
+    return graph
+
+def _prefetch_module(name, path):
+    """
+    compile a module and write it to the loader cache. runs in a
+    worker process and returns (seconds, imports, error)
+    """
+
+    from .loader import cache_path, save_module, compile_module
+
+    t0 = time.perf_counter()
+    try:
+        with open(path, "rb") as rb:
+            source_bytes = rb.read()
+        source_stat = os.stat(path)
+        code = compile_module(name, path, source_bytes)
+        save_module(cache_path(path), code, source_bytes, source_stat)
+    except Exception as e:
+        # the error is reported again when the module is imported
+        return time.perf_counter() - t0, [], "%s: %s" % (type(e).__name__, e)
+
+    return time.perf_counter() - t0, list(code_imports(code)), None
+
+class PrefetchReport(object):
+    def __init__(self, graph, workers, elapsed):
+        super(PrefetchReport, self).__init__()
+        self.graph = graph
+        self.workers = workers
+        # wall time spent in prefetch
+        self.elapsed = elapsed
+
+    def modules(self, status):
+        return [info for info in self.graph.values() if info.status == status]
+
+    def compile_time(self):
+        """ the time it would have taken to compile each module serially """
+        return sum(info.seconds for info in self.graph.values()
+            if info.status in (COMPILED, FAILED))
+
+    def saved(self):
+        """
+        the time saved compared to compiling each module when it is
+        imported. negative if the overhead was larger than the savings
+        """
+        return self.compile_time() - self.elapsed
+
+    def write(self, stream=None):
+
+        if stream is None:
+            stream = sys.stderr
+
+        seen = set()
+        roots = [name for name in self.graph
+            if not any(name in info.imports for info in self.graph.values())]
+        for name in roots:
+            self._write_tree(stream, name, 0, seen)
+
+        stream.write("prefetch: %d modules, %d cached, %d compiled, %d failed\n" % (
+            len(self.graph) - 1, len(self.modules(CACHED)),
+            len(self.modules(COMPILED)), len(self.modules(FAILED))))
+        stream.write("prefetch: %.2f ms using %d workers, %.2f ms serial compile, %.2f ms saved\n" % (
+            self.elapsed * 1000, self.workers, self.compile_time() * 1000,
+            self.saved() * 1000))
+
+    def _write_tree(self, stream, name, depth, seen):
+        info = self.graph[name]
+        if info.status in (COMPILED, FAILED):
+            status = "%s %.2f ms" % (info.status, info.seconds * 1000)
+        else:
+            status = info.status or "entry"
+        if name in seen:
+            stream.write("%s%s (see above)\n" % ("  " * depth, name))
+            return
+        seen.add(name)
+        stream.write("%s%s (%s)\n" % ("  " * depth, name, status))
+        for child in info.imports:
+            self._write_tree(stream, child, depth + 1, seen)
+
+def prefetch(code, search_path=None, workers=None, name="__main__"):
+    """
+    compile every ekanscrypt module reachable from code which is not
+    in the loader cache, using a pool of worker processes.
+
+    code is the compiled entry script. Imports of cached modules are
+    read from the cached code, the source is only parsed for modules
+    which need to be compiled, once, by the worker compiling it.
+
+    search_path defaults to the current working directory, which is
+    where the finder looks for top level modules.
+
+    returns a PrefetchReport
+    """
+
+    from .loader import cache_path, load_module
+
+    t0 = time.perf_counter()
+
+    if search_path is None:
+        search_path = [os.getcwd()]
+
+    if workers is None or workers <= 0:
+        workers = os.cpu_count() or 1
+
+    root = ModuleInfo(name, None, False)
+    graph = {name: root}
+    queue = _add_imports(root, code_imports(code), search_path, graph)
+
+    executor = None
+    pending = {}
+
+    try:
+        while queue or pending:
+
+            while queue:
+                info = queue.pop(0)
+                cached = load_module(cache_path(info.filename), info.filename)
+                if cached is not None:
+                    info.status = CACHED
+                    queue.extend(_add_imports(info, code_imports(cached), search_path, graph))
+                    continue
+
+                if sys.dont_write_bytecode:
+                    # a compiled module can not be shared with the importer
+                    continue
+
+                if workers == 1:
+                    result = _prefetch_module(info.name, info.filename)
+                    queue.extend(_finish(info, result, search_path, graph))
+                    continue
+
+                if executor is None:
+                    from concurrent.futures import ProcessPoolExecutor
+                    executor = ProcessPoolExecutor(max_workers=workers)
+                future = executor.submit(_prefetch_module, info.name, info.filename)
+                pending[future] = info
+
+            if pending:
+                from concurrent.futures import wait, FIRST_COMPLETED
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    info = pending.pop(future)
+                    queue.extend(_finish(info, future.result(), search_path, graph))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return PrefetchReport(graph, workers, time.perf_counter() - t0)
+
+def _finish(info, result, search_path, graph):
+    seconds, imports, error = result
+    info.seconds = seconds
+    info.status = COMPILED if error is None else FAILED
+    return _add_imports(info, imports, search_path, graph)
@@ -0,0 +1,182 @@
+
+"""
+compiler instrumentation
+
+a CompileProfile records the time spent in each phase of the compiler,
+the lexer, each parser pass, code generation, _finalize, calcsize and
+to_code, as well as each nested lambda. Phases may nest, the self time
+of a phase excludes the time spent in the phases it contains.
+
+allocations are counted as the change in the number of memory blocks
+allocated by the interpreter, and the number of tokens created.
+
+    profile = CompileProfile()
+    program.compile_text(path, text, profile=profile)
+    profile.write(sys.stderr)
+
+a profile is only active while compiling in the thread which called
+activate(). When no profile is active phase() returns a shared no-op
+context manager.
+"""
+
+import sys
+import time
+import threading
+
+from .token import token_count
+
+_local = threading.local()
+
+def active_profile():
+    """ return the profile active in the current thread, or None """
+    return getattr(_local, "profile", None)
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_null_phase = _NullPhase()
+
+def phase(name):
+    """ time a phase of the compiler, if a profile is active """
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        return _null_phase
+    return profile.phase(name)
+
+class PhaseStats(object):
+    def __init__(self, name, depth):
+        super(PhaseStats, self).__init__()
+        self.name = name
+        # nesting depth the first time the phase was entered
+        self.depth = depth
+        self.count = 0
+        # inclusive time, a phase nested in itself is counted once
+        self.total = 0.0
+        self.self_time = 0.0
+        self.blocks = 0
+        self.tokens = 0
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "depth": self.depth,
+            "count": self.count,
+            "total": self.total,
+            "self": self.self_time,
+            "blocks": self.blocks,
+            "tokens": self.tokens,
+        }
+
+class _Phase(object):
+    def __init__(self, profile, name):
+        super(_Phase, self).__init__()
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile._enter(self.name)
+        return self
+
+    def __exit__(self, *args):
+        self.profile._exit()
+        return False
+
+class _Activation(object):
+    def __init__(self, profile):
+        super(_Activation, self).__init__()
+        self.profile = profile
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = getattr(_local, "profile", None)
+        _local.profile = self.profile
+        return self.profile
+
+    def __exit__(self, *args):
+        _local.profile = self.previous
+        return False
+
+class CompileProfile(object):
+    def __init__(self):
+        super(CompileProfile, self).__init__()
+        # name -> PhaseStats, in the order phases were first entered
+        self.phases = {}
+        self._stack = []
+
+    def activate(self):
+        """ a context manager which makes this the active profile """
+        return _Activation(self)
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def _enter(self, name):
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = PhaseStats(name, len(self._stack))
+            self.phases[name] = stats
+        # [stats, t0, blocks0, tokens0, child time, child blocks, child tokens]
+        self._stack.append([stats, time.perf_counter(),
+            sys.getallocatedblocks(), token_count(), 0.0, 0, 0])
+
+    def _exit(self):
+        t1 = time.perf_counter()
+        blocks1 = sys.getallocatedblocks()
+        tokens1 = token_count()
+
+        stats, t0, blocks0, tokens0, child_time, child_blocks, child_tokens = self._stack.pop()
+
+        elapsed = t1 - t0
+        blocks = blocks1 - blocks0
+        tokens = tokens1 - tokens0
+
+        stats.count += 1
+        stats.self_time += elapsed - child_time
+        stats.blocks += blocks - child_blocks
+        stats.tokens += tokens - child_tokens
+        if not any(frame[0] is stats for frame in self._stack):
+            stats.total += elapsed
+
+        if self._stack:
+            parent = self._stack[-1]
+            parent[4] += elapsed
+            parent[5] += blocks
+            parent[6] += tokens
+
+    def total(self):
+        """ the total time of the outermost phases """
+        return sum(stats.total for stats in self.phases.values() if stats.depth == 0)
+
+    def report(self):
+        """ return a list of dictionaries, one for each phase """
+        return [stats.to_dict() for stats in self.phases.values()]
+
+    def write(self, stream=None, limit=None):
+        """
+        write a table of phases to stream. limit restricts the output
+        to the phases with the largest self time
+        """
+
+        if stream is None:
+            stream = sys.stderr
+
+        phases = list(self.phases.values())
+        if limit is not None:
+            keep = sorted(phases, key=lambda s: s.self_time, reverse=True)[:limit]
+            phases = [stats for stats in phases if stats in keep]
+
+        total = self.total() or 1.0
+
+        stream.write("%10s %10s %6s %6s %8s %8s  %s\n" % (
+            "total[ms]", "self[ms]", "self%", "count", "blocks", "tokens", "phase"))
+        for stats in phases:
+            stream.write("%10.3f %10.3f %5.1f%% %6d %8d %8d  %s%s\n" % (
+                stats.total * 1000, stats.self_time * 1000,
+                100 * stats.self_time / total, stats.count,
+                stats.blocks, stats.tokens,
+                "  " * stats.depth, stats.name))
+        stream.write("%10.3f ms total\n" % (self.total() * 1000))
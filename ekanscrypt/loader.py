@@ -4,48 +4,342 @@ import os.path
 
 import time
 import struct
+import threading
 import marshal
 from importlib.abc import Loader, MetaPathFinder
-from importlib.util import spec_from_file_location, MAGIC_NUMBER, cache_from_source
+from importlib.util import spec_from_file_location, MAGIC_NUMBER, \
+    cache_from_source, source_hash, decode_source, LazyLoader, \
+    find_spec, module_from_spec
 import types
 
-from .program import Namespace
-from .compiler import Expression
-from .parser import parser
-from .lexer import lexer
-from .util import Namespace
+from .builtins import default_globals
+from .cache import CACHE_TAG, atomic_write
+
+import logging
+log = logging.getLogger("ekanscrypt.loader")
+
+# cache invalidation modes, these mirror py_compile.PycInvalidationMode
+#   timestamp: the cache records the source mtime and size, validating
+#              the cache requires only a stat of the source file
+#   checked-hash: the cache records a hash of the source, validating
+#              the cache requires reading the source file
+#   unchecked-hash: the cache records a hash of the source, but the
+#              source is never checked. the cache must be regenerated
+#              by other means (e.g. at deploy time)
+CACHE_TIMESTAMP = "timestamp"
+CACHE_CHECKED_HASH = "checked-hash"
+CACHE_UNCHECKED_HASH = "unchecked-hash"
+
+# header flags, see PEP 552
+FLAG_HASH = 0x01
+FLAG_CHECK_SOURCE = 0x02
+
+# how often, in seconds, the finder checks a directory for new files.
+# call importlib.invalidate_caches() after creating a module at runtime
+LISTING_TTL = 1.0
+
+# alternate root directory for the cache of imported modules.
+# see set_cache_dir()
+cache_dir = None
+
+# one ImportRecord for every ekanscrypt module created by the loader
+import_records = []
+
+# every ekanscrypt module created by the loader, by the absolute path
+# of the source file. a file imported under different names, or by
+# Program.import_, is only compiled and executed once.
+modules_by_path = {}
+
+# the paths of modules in modules_by_path which are not added to
+# sys.modules, relative imports and names which were already taken
+_private_paths = set()
+
+# guards modules_by_path and installing the finder. python holds an
+# import lock for each module name, but a file may be imported under
+# more than one name from different threads
+_lock = threading.RLock()
+
+def default_cache_mode():
+    mode = os.environ.get("EKANS_CACHE_MODE")
+    if mode:
+        if mode not in (CACHE_TIMESTAMP, CACHE_CHECKED_HASH, CACHE_UNCHECKED_HASH):
+            raise ValueError("invalid EKANS_CACHE_MODE: %s" % mode)
+        return mode
+    # reproducible builds should not depend on the source mtime
+    if os.environ.get("SOURCE_DATE_EPOCH"):
+        return CACHE_CHECKED_HASH
+    return CACHE_TIMESTAMP
+
+def _cache_header(source_bytes, source_stat, mode):
+    """
+    the header is 16 bytes compatible with a python 3.7+ pyc file,
+    followed by the ekanscrypt compiler tag.
+
+        magic (4) | flags (4) | mtime (4) | size (4)
+        magic (4) | flags (4) | source hash (8)
+    """
+
+    if mode == CACHE_TIMESTAMP:
+        flags = 0
+        data = struct.pack("<II",
+            int(source_stat.st_mtime) & 0xFFFFFFFF,
+            source_stat.st_size & 0xFFFFFFFF)
+    else:
+        flags = FLAG_HASH
+        if mode == CACHE_CHECKED_HASH:
+            flags |= FLAG_CHECK_SOURCE
+        data = source_hash(source_bytes)
+
+    return MAGIC_NUMBER + struct.pack("<I", flags) + data + \
+        struct.pack("<H", len(CACHE_TAG)) + CACHE_TAG
+
+def save_module(path, co, source_bytes, source_stat, mode=None):
+    """
+    write the code object for a source file to path
+
+    the file is written to a temporary file and renamed into place
+    so that concurrent readers never see a partial cache file.
+    """
+
+    if mode is None:
+        mode = default_cache_mode()
+
+    header = _cache_header(source_bytes, source_stat, mode)
+    atomic_write(path, header + marshal.dumps(co))
+
+def set_cache_dir(path):
+    """
+    store the cache for imported modules under path instead of
+    in a __pycache__ directory next to each source file.
+    None restores the default.
+    """
+    global cache_dir
+    cache_dir = path
+
+def cache_path(source_path):
+    """
+    return the path to the cache file for source_path
+
+    the cache root is given by set_cache_dir(), the EKANS_CACHE_DIR
+    environment variable or sys.pycache_prefix, in that order. The
+    absolute path of the source directory is mirrored under the root,
+    in the same way python does for sys.pycache_prefix. Otherwise the
+    cache is stored in a __pycache__ directory next to the source.
+    """
+
+    root = cache_dir or os.environ.get("EKANS_CACHE_DIR")
+    if not root:
+        return cache_from_source(source_path)
+
+    head, tail = os.path.split(os.path.abspath(source_path))
+    _, head = os.path.splitdrive(head)
+    name = os.path.basename(cache_from_source(tail))
+    return os.path.join(root, head.lstrip(os.sep), name)
+
+def load_module(path, source_path, source_stat=None):
+    """
+    return the cached code object for source_path, or None if the
+    cache does not exist or is no longer valid.
+
+    source_stat may be given to avoid a second stat of the source file.
+    """
+
+    try:
+        with open(path, "rb") as rb:
+            data = rb.read()
+    except OSError:
+        return None
+
+    offset = _validate_header(data, source_path, source_stat)
+    if offset is None:
+        return None
+
+    try:
+        return marshal.loads(data[offset:])
+    except (EOFError, ValueError, TypeError):
+        return None
+
+def check_module(path, source_path, source_stat=None, mode=None):
+    """
+    return True if the cache at path is valid for source_path
+
+    only the header of the cache file is read
+
+    mode: when given, the cache must have been written with this
+        invalidation mode, and the hash of an unchecked-hash cache is
+        compared with the source, as the loader would not do.
+    """
+
+    try:
+        with open(path, "rb") as rb:
+            data = rb.read(18 + len(CACHE_TAG))
+    except OSError:
+        return False
+
+    if mode is not None and _header_mode(data) != mode:
+        return False
+
+    return _validate_header(data, source_path, source_stat,
+        check_source=mode is not None) is not None
+
+def _header_mode(data):
+    """ returns the invalidation mode of a cache header """
+
+    if len(data) < 8:
+        return None
+    flags, = struct.unpack("<I", data[4:8])
+    if not flags & FLAG_HASH:
+        return CACHE_TIMESTAMP
+    if flags & FLAG_CHECK_SOURCE:
+        return CACHE_CHECKED_HASH
+    return CACHE_UNCHECKED_HASH
+
+def _validate_header(data, source_path, source_stat, check_source=False):
+    """
+    returns the offset of the marshalled code in data, or None
+    if the header is not valid for the given source
+
+    check_source: compare the hash of the source even when the
+        header does not ask for it
+    """
+
+    if len(data) < 18 or data[:4] != MAGIC_NUMBER:
+        return None
+
+    flags, = struct.unpack("<I", data[4:8])
+    taglen, = struct.unpack("<H", data[16:18])
+    if data[18:18 + taglen] != CACHE_TAG:
+        return None
+
+    if flags & FLAG_HASH:
+        if flags & FLAG_CHECK_SOURCE or check_source:
+            with open(source_path, "rb") as rb:
+                if source_hash(rb.read()) != data[8:16]:
+                    return None
+    else:
+        if source_stat is None:
+            source_stat = os.stat(source_path)
+        mtime, size = struct.unpack("<II", data[8:16])
+        if mtime != int(source_stat.st_mtime) & 0xFFFFFFFF or \
+           size != source_stat.st_size & 0xFFFFFFFF:
+            return None
+
+    return 18 + taglen
+
+def compile_module(fullname, filename, source_bytes):
+    """
+    compile the source of a module and return the code object
+    """
+
+    # the compiler is only needed on a cache miss
+    from .lexer import lexer
+    from .parser import parser
+    from .compiler import Expression
+
+    text = decode_source(source_bytes)
+    globals_ = Expression.defaultGlobals()
+    expr = Expression(fullname, filename, globals=globals_, flags=Expression.CF_MODULE)
+    expr.compile(parser(list(lexer(text))))
+
+    return expr.function_body.__code__
+
+class _DirectoryListing(object):
+    """
+    the names of the .es modules and package directories in a single
+    directory. find() answers from memory, the directory is listed again
+    only when its mtime changes, and the mtime is checked at most once
+    every LISTING_TTL seconds.
+    """
+
+    def __init__(self, path):
+        super(_DirectoryListing, self).__init__()
+        self.path = path
+        self.mtime = None
+        self.checked = 0
+        self.modules = set()
+        self.directories = set()
+        self.packages = {}
+
+    def refresh(self):
+
+        self.checked = time.monotonic()
+
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = -1
+
+        if mtime == self.mtime:
+            return
+
+        self.mtime = mtime
+        self.modules = set()
+        self.directories = set()
+        self.packages = {}
+
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if name.endswith(".es"):
+                        self.modules.add(name[:-3])
+                    elif "." not in name:
+                        try:
+                            if entry.is_dir():
+                                self.directories.add(name)
+                        except OSError:
+                            pass
+        except OSError:
+            pass
+
+    def find(self, name):
+        """
+        returns a tuple (filename, submodule_search_locations)
+        or None if name is not an ekanscrypt module in this directory
+        """
+
+        if time.monotonic() - self.checked > LISTING_TTL:
+            self.refresh()
+
+        if name in self.directories:
+            # a directory is only a package if it has an __init__.es
+            # check once and remember the result until the next refresh
+            if name not in self.packages:
+                dirpath = os.path.join(self.path, name)
+                filename = os.path.join(dirpath, "__init__.es")
+                self.packages[name] = os.path.isfile(filename)
+            if self.packages[name]:
+                dirpath = os.path.join(self.path, name)
+                return os.path.join(dirpath, "__init__.es"), [dirpath]
+
+        if name in self.modules:
+            return os.path.join(self.path, name + ".es"), None
+
+        return None
 
-def save_module(path, co):
-
-    dirpath, _ = os.path.split(path)
-    if not os.path.exists(dirpath):
-        os.makedirs(dirpath)
-
-    with open(path, "wb") as wb:
-        wb.write(MAGIC_NUMBER)
-        wb.write(b"\x00\x00\x00\x00")
-        wb.write(struct.pack("I", int(time.time())))
-        wb.write(b"\x00\x00\x00\x00")
-        marshal.dump(co, wb)
-
-def load_module(path):
+class EkanscryptFinder(MetaPathFinder):
 
-    with open(path, "rb") as rb:
+    # lazy imports defer loading and executing a module until the
+    # first time an attribute of the module is accessed.
+    # True to enable lazy imports for all modules, otherwise a set
+    # containing the fully qualified names of modules to import lazily
+    lazy = False
 
-        magic = rb.read(4)
-        if magic != MAGIC_NUMBER:
-            raise ImportError("magic number does not match")
-        rb.read(4)
-        rb.read(4)
-        rb.read(4)
-        return marshal.load(rb)
+    def __init__(self):
+        super(EkanscryptFinder, self).__init__()
+        self._listings = {}
 
-def isNewer(source_path, compiled_path):
-    return os.stat(source_path).st_mtime > os.stat(compiled_path).st_mtime
+    def _listing(self, entry):
+        listing = self._listings.get(entry)
+        if listing is None:
+            listing = _DirectoryListing(entry)
+            self._listings[entry] = listing
+        return listing
 
-class EkanscryptFinder(MetaPathFinder):
+    def invalidate_caches(self):
+        """ called by importlib.invalidate_caches() """
+        self._listings.clear()
 
-    _installed = False
     def find_spec(self, fullname, path, target=None):
 
         if path is None or path == "":
@@ -58,76 +352,227 @@ class EkanscryptFinder(MetaPathFinder):
 
         for entry in path:
 
-            if os.path.isdir(os.path.join(entry, name)):
-                # this module has child modules
-                filename = os.path.join(entry, name, "__init__.es")
-                submodule_locations = [os.path.join(entry, name)]
-            else:
-                filename = os.path.join(entry, name + ".es")
-                submodule_locations = None
+            if not isinstance(entry, str):
+                continue
 
-            if not os.path.exists(filename):
+            result = self._listing(entry or os.getcwd()).find(name)
+            if result is None:
                 continue
 
-            sys.stderr.write("loader found `%s`\n" % filename)
+            filename, submodule_locations = result
+
+            log.info("loader found `%s`" % filename)
+
+            loader = EkanscryptyLoader(filename)
+            if EkanscryptFinder.is_lazy(fullname):
+                loader = LazyLoader(loader)
 
-            return spec_from_file_location(fullname, filename,
-                loader=EkanscryptyLoader(filename),
+            spec = spec_from_file_location(fullname, filename,
+                loader=loader,
                 submodule_search_locations=submodule_locations)
+            # python only computes the cache path for .py files
+            spec.cached = cache_path(filename)
+            return spec
 
         return None # we don't know how to import this
 
+    @staticmethod
+    def is_lazy(fullname):
+        lazy = EkanscryptFinder.lazy
+        if isinstance(lazy, bool):
+            return lazy
+        return fullname in lazy
+
+    @staticmethod
+    def set_lazy(enable=True, modules=None):
+        """
+        enable lazy imports for all modules, or only for the named modules
+        """
+        if modules is None:
+            EkanscryptFinder.lazy = bool(enable)
+        else:
+            if isinstance(EkanscryptFinder.lazy, bool):
+                EkanscryptFinder.lazy = set()
+            if enable:
+                EkanscryptFinder.lazy.update(modules)
+            else:
+                EkanscryptFinder.lazy.difference_update(modules)
+
     @staticmethod
     def install():
-        if not EkanscryptFinder._installed:
-            print("install loader")
+        """ add a finder to sys.meta_path, unless one is already installed """
+        with _lock:
+            for finder in sys.meta_path:
+                if isinstance(finder, EkanscryptFinder):
+                    return
             sys.meta_path.insert(0, EkanscryptFinder())
-            EkanscryptFinder._installed = True
+
+class ImportRecord(object):
+    """ timing information for a single module import """
+    def __init__(self, name, lazy):
+        super(ImportRecord, self).__init__()
+        self.name = name
+        self.lazy = lazy
+        self.cached = None
+        self.executed = False
+        self.load_time = 0.0
+        self.exec_time = 0.0
+
+def import_report(stream=None):
+    """
+    write the time spent loading (from cache or by compiling) and
+    executing each imported module. lazy modules which were never
+    used are listed as deferred.
+    """
+
+    if stream is None:
+        stream = sys.stderr
+
+    stream.write("import time: %10s | %10s | module\n" % ("load [us]", "exec [us]"))
+
+    deferred = 0
+    for record in import_records:
+        if record.executed:
+            tags = ["cached" if record.cached else "compiled"]
+            if record.lazy:
+                tags.append("lazy")
+            stream.write("import time: %10d | %10d | %s (%s)\n" % (
+                record.load_time * 1e6, record.exec_time * 1e6,
+                record.name, ", ".join(tags)))
+        else:
+            deferred += 1
+            stream.write("import time: %10s | %10s | %s (deferred)\n" % (
+                "-", "-", record.name))
+
+    stream.write("import time: %d modules, %d deferred\n" % (
+        len(import_records), deferred))
+
+def _registered_module(path):
+    """
+    the module registered for path, or None. a module which was removed
+    from sys.modules is imported again, as python does for any module,
+    so the registry only keeps it while it is there under some name.
+    must be called with _lock held
+    """
+
+    module = modules_by_path.get(path)
+    if module is None or path in _private_paths:
+        return module
+
+    # identity only, any attribute access would load a lazy module
+    if any(value is module for value in list(sys.modules.values())):
+        return module
+
+    del modules_by_path[path]
+    return None
 
 class EkanscryptyLoader(Loader):
-    def __init__(self, filename):
+    def __init__(self, filename, private=False):
         self.filename = filename
+        self.cached = None
+        # an existing module for the same file
+        self.shared = None
+        # the module is not added to sys.modules, see import_path
+        self.private = private
+        self.record = None
 
-    def create_module(self, spec):
+    def get_code(self, fullname):
+        """
+        return the code object for the module, from the cache if valid
+        otherwise by compiling the source and updating the cache
+        """
+
+        cpath = cache_path(self.filename)
 
-        cpath = cache_from_source(spec.origin)
-        code = None
-        mod_fptr = None
-        if os.path.exists(cpath) and not isNewer(spec.origin, cpath):
-            code = load_module(cpath)
-            mod_fptr = types.FunctionType(code, Expression.defaultGlobals(), spec.name)
+        source_stat = os.stat(self.filename)
+        code = load_module(cpath, self.filename, source_stat)
+        self.cached = code is not None
 
-        if not mod_fptr:
-            with open(spec.origin, "r") as src:
-                text = src.read()
+        if code is None:
+            with open(self.filename, "rb") as src:
+                source_bytes = src.read()
 
-            globals_ = Expression.defaultGlobals()
-            expr = Expression(spec.name, spec.origin, globals=globals_, module=True)
-            expr.compile(parser(list(lexer(text))))
+            code = compile_module(fullname, self.filename, source_bytes)
 
-            mod_fptr = expr.function_body
-            code = mod_fptr.__code__
-            save_module(cpath, code)
+            if not sys.dont_write_bytecode:
+                try:
+                    save_module(cpath, code, source_bytes, source_stat)
+                except OSError as e:
+                    # a read only source tree, the module is still
+                    # imported using the code compiled in memory
+                    log.info("unable to write cache for `%s`: %s" % (self.filename, e))
 
-        mod = types.ModuleType(spec.name)
+        return code
 
-        mod.__name__ = spec.name
-        mod.__file__ = spec.origin
-        mod.__cached__ = cpath
-        # TODO: set package name
-        # https://docs.python.org/3/reference/import.html#__package__
-        mod.__package__ = spec.name
-        mod.__loader__ = self
-        mod.__spec__ = spec
+    def create_module(self, spec):
+
+        path = os.path.abspath(self.filename)
+
+        with _lock:
+            shared = _registered_module(path)
+            if shared is not None:
+                # the file was already imported under another name
+                self.shared = shared
+                return shared
+
+            mod = types.ModuleType(spec.name)
+
+            mod.__name__ = spec.name
+            mod.__file__ = spec.origin
+            mod.__cached__ = spec.cached
+            # https://docs.python.org/3/reference/import.html#__package__
+            mod.__package__ = spec.parent
+            mod.__loader__ = self
+            mod.__spec__ = spec
+
+            self._record(spec)
 
-        mod.__body__ = mod_fptr
+            # registered before the body is executed, like sys.modules,
+            # so that a circular import finds the partially initialized module
+            modules_by_path[path] = mod
+            if self.private:
+                _private_paths.add(path)
+            else:
+                _private_paths.discard(path)
 
         return mod
 
+    def _record(self, spec):
+        self.record = ImportRecord(spec.name, isinstance(spec.loader, LazyLoader))
+        import_records.append(self.record)
+
     def exec_module(self, module):
 
-        result = module.__body__()
-        delattr(module, '__body__')
+        if module is self.shared:
+            return
+
+        if self.record is None:
+            # importlib.reload executes a module without creating it
+            with _lock:
+                self._record(module.__spec__)
+
+        # the code is loaded here and not in create_module so that
+        # a LazyLoader defers the cost of compiling the module as well
+        t0 = time.perf_counter()
+        code = self.get_code(module.__name__)
+        mod_fptr = types.FunctionType(code, default_globals(module.__spec__), module.__name__)
+
+        t1 = time.perf_counter()
+        try:
+            result = mod_fptr()
+        except BaseException:
+            path = os.path.abspath(self.filename)
+            with _lock:
+                if modules_by_path.get(path) is module:
+                    del modules_by_path[path]
+                    _private_paths.discard(path)
+            raise
+        t2 = time.perf_counter()
+
+        self.record.cached = self.cached
+        self.record.executed = True
+        self.record.load_time = t1 - t0
+        self.record.exec_time = t2 - t1
 
         if not isinstance(result, dict):
             raise ImportError("not a proper ES module")
@@ -136,5 +581,74 @@ class EkanscryptyLoader(Loader):
             if not name.startswith("_"):
                 setattr(module, name, attr)
 
+def lazy_import(name):
+    """
+    import a module lazily, regardless of the global lazy setting
+    """
+
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+
+    spec = find_spec(name)
+    if spec is None:
+        raise ImportError("No module named %r" % name, name=name)
+
+    if not isinstance(spec.loader, LazyLoader):
+        spec.loader = LazyLoader(spec.loader)
+
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+
+    return module
+
+def import_path(path, name=None):
+    """
+    import the ekanscrypt module at path
+
+    returns the existing module if the file was already imported, either
+    by the finder or by a previous call. If name is given the module is
+    added to sys.modules, unless a module with that name already exists.
+    Otherwise the module is named after the file.
+    """
+
+    path = os.path.abspath(path)
+
+    with _lock:
+        module = _registered_module(path)
+    if module is not None:
+        return module
+
+    register = name is not None and name not in sys.modules
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0]
+
+    loader = EkanscryptyLoader(path, private=not register)
+    spec = spec_from_file_location(name, path, loader=loader)
+    spec.cached = cache_path(path)
+
+    module = module_from_spec(spec)
+
+    if register:
+        sys.modules[name] = module
+
+    try:
+        loader.exec_module(module)
+    except BaseException:
+        if register:
+            sys.modules.pop(name, None)
+        raise
+
+    return module
+
+def _lazy_from_environ():
+    # EKANS_LAZY_IMPORT=1 for all modules, or a comma separated list of names
+    value = os.environ.get("EKANS_LAZY_IMPORT", "")
+    if value in ("1", "*", "all"):
+        EkanscryptFinder.set_lazy(True)
+    elif value and value != "0":
+        EkanscryptFinder.set_lazy(True, value.split(","))
 
+_lazy_from_environ()
 EkanscryptFinder.install()
\ No newline at end of file
@@ -0,0 +1,469 @@
+
+"""
+process pipelines driven by an asyncio event loop
+
+the stages of a pipeline are linked with the same call syntax as
+Proc and Proc.Node, so `a |> b` builds the pipeline `b(a())`.
+Nothing runs until the pipeline is awaited:
+
+    pipeline = AsyncProc("cat", path) |> AsyncNode(callback) |> AsyncProc("sort")
+    returncode, stdout, stderr = await pipeline.run()
+
+an AsyncNode runs a coroutine on the event loop instead of a thread,
+and adjacent nodes exchange data through memory instead of an os pipe.
+adjacent processes are connected by an os pipe directly.
+`gather` runs many pipelines on one event loop.
+"""
+
+import os
+import io
+import asyncio
+import codecs
+import threading
+import traceback
+
+class _AsyncPipe(object):
+    """
+    an in memory pipe between two stages running on the event loop
+
+    write waits while limit bytes are buffered, so that a fast producer
+    does not run ahead of a slow consumer.
+    """
+
+    def __init__(self, limit):
+        super(_AsyncPipe, self).__init__()
+        self.limit = limit
+        self._buffer = bytearray()
+        self._eof = False
+        self._closed = False
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    async def write(self, data):
+        while len(self._buffer) >= self.limit and not self._closed:
+            self._writable.clear()
+            await self._writable.wait()
+
+        if self._closed:
+            # like a broken pipe, the reader is not interested
+            return
+
+        self._buffer.extend(data)
+        self._readable.set()
+
+    def write_eof(self):
+        self._eof = True
+        self._readable.set()
+
+    def _take(self, n):
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        if len(self._buffer) < self.limit:
+            self._writable.set()
+        return data
+
+    async def read(self, n=-1):
+        while not self._eof and (n < 0 or not self._buffer):
+            self._readable.clear()
+            await self._readable.wait()
+        return self._take(len(self._buffer) if n < 0 else n)
+
+    async def readline(self):
+        index = self._buffer.find(b"\n")
+        while index < 0 and not self._eof:
+            self._readable.clear()
+            await self._readable.wait()
+            index = self._buffer.find(b"\n")
+        return self._take(index + 1 if index >= 0 else len(self._buffer))
+
+    def close(self):
+        self._closed = True
+        self._buffer.clear()
+        self._writable.set()
+
+class _PipeReader(object):
+    """ reads the output of a child process """
+
+    def __init__(self, reader, transport):
+        super(_PipeReader, self).__init__()
+        self.reader = reader
+        self.transport = transport
+
+    async def read(self, n=-1):
+        return await self.reader.read(n)
+
+    async def readline(self):
+        return await self.reader.readline()
+
+    def close(self):
+        # the child process gets a broken pipe, like a pipe closed
+        # by the reader in a synchronous pipeline
+        self.transport.close()
+
+async def _read_pipe(fd, limit):
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader(limit=limit)
+    protocol = asyncio.StreamReaderProtocol(reader)
+    transport, _ = await loop.connect_read_pipe(lambda: protocol, os.fdopen(fd, "rb", 0))
+    return _PipeReader(reader, transport)
+
+async def _copy(source, writer, bufsize):
+    """ copy from a stage to the stdin of a child process """
+    try:
+        data = await source.read(bufsize)
+        while data:
+            writer.write(data)
+            await writer.drain()
+            data = await source.read(bufsize)
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        source.close()
+        writer.close()
+
+async def _in_thread(function, *args):
+    """
+    run a blocking function on a new thread. the default executor is
+    not used, a pipeline of blocking nodes waiting on each other could
+    use every thread of the executor.
+    """
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+
+    def run():
+        try:
+            result = function(*args)
+        except BaseException as e:
+            loop.call_soon_threadsafe(future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(future.set_result, result)
+
+    threading.Thread(target=run, daemon=True).start()
+    return await future
+
+class AsyncReader(object):
+    """
+    the input of an AsyncNode, like stream.stdin of a Proc.Node
+
+    every method is a coroutine. `async for line in stream.stdin` yields
+    each line, including the new line.
+    """
+
+    def __init__(self, source, text=False):
+        super(AsyncReader, self).__init__()
+        self.source = source
+        self.text = text
+        self._decoder = codecs.getincrementaldecoder("utf-8")() if text else None
+
+    def _decode(self, data):
+        return self._decoder.decode(data, final=not data) if self.text else data
+
+    async def read(self, n=-1):
+        data = await self.source.read(n)
+        result = self._decode(data)
+        # a character may be split between two reads
+        while data and not result:
+            data = await self.source.read(n)
+            result = self._decode(data)
+        return result
+
+    async def readline(self):
+        return self._decode(await self.source.readline())
+
+    async def readline2(self):
+        """ returns the next line which is not empty, without the new line """
+        line = await self.readline()
+        while line and not line.strip():
+            line = await self.readline()
+        return line.rstrip("\n" if self.text else b"\n")
+
+    def __aiter__(self):
+        return self._lines()
+
+    async def _lines(self):
+        line = await self.readline()
+        while line:
+            yield line
+            line = await self.readline()
+
+class AsyncWriter(object):
+    """ the output of an AsyncNode, like stream.stdout of a Proc.Node """
+
+    def __init__(self, pipe, text=False):
+        super(AsyncWriter, self).__init__()
+        self.pipe = pipe
+        self.text = text
+
+    async def write(self, data):
+        if self.text:
+            data = data.encode("utf-8")
+        await self.pipe.write(data)
+
+    async def writeline2(self, line):
+        await self.write(line + ("\n" if self.text else b"\n"))
+
+class _SyncAdapter(object):
+    """
+    calls the coroutines of an AsyncReader or AsyncWriter from a
+    thread which is not running the event loop
+    """
+
+    def __init__(self, obj, loop):
+        super(_SyncAdapter, self).__init__()
+        self._obj = obj
+        self._loop = loop
+
+    def __getattr__(self, name):
+        method = getattr(self._obj, name)
+
+        def call(*args):
+            future = asyncio.run_coroutine_threadsafe(method(*args), self._loop)
+            return future.result()
+        return call
+
+    def __iter__(self):
+        line = self.readline()
+        while line:
+            yield line
+            line = self.readline()
+
+class _AsyncNodeStream(object):
+    """ the stream given to the callback of an AsyncNode """
+
+    def __init__(self, stdin, stdout):
+        super(_AsyncNodeStream, self).__init__()
+        self.stdin = stdin
+        self.stdout = stdout
+
+class AsyncStage(object):
+    """ base class for the stages of an asyncio pipeline """
+
+    # True if the output of this stage is text
+    text = False
+
+    # the number of bytes read from a stage at a time
+    buffer_size = 65536
+
+    def __init__(self):
+        super(AsyncStage, self).__init__()
+        self._called = False
+        self._parent = None
+        self._child = None
+        self.returncode = None
+
+    def __call__(self, stream=None):
+        if self._called:
+            raise RuntimeError("Double call on process")
+        if stream is not None and not isinstance(stream, AsyncStage):
+            raise TypeError("an async pipeline can not read from %r" % stream)
+        self._called = True
+
+        self._parent = stream
+        if stream is not None:
+            stream._child = self
+        return self
+
+    async def _start(self, source, bufsize, pipe):
+        """
+        start this stage reading from source, the output of the previous
+        stage. returns the output of this stage, a file descriptor if pipe
+        is true, otherwise an object with read, readline and close
+        coroutines
+        """
+        raise NotImplementedError()
+
+    async def wait(self):
+        raise NotImplementedError()
+
+    def _stages(self):
+        stages = []
+        nd = self
+        while nd is not None:
+            stages.insert(0, nd)
+            nd = nd._parent
+        return stages
+
+    async def run(self, stdout=None, bufsize=None):
+        """
+        run the pipeline which ends with this stage
+
+        returns (returncode, stdout, stderr) like Proc.run, the output is
+        bytes or text when the last stage is a text node. if stdout is
+        given the output is written to it instead and None is returned
+        in its place. stderr is not captured.
+        """
+        if not self._called:
+            self(None)
+
+        if bufsize is None:
+            bufsize = self.buffer_size
+
+        stages = self._stages()
+        source = None
+        for stage, child in zip(stages, stages[1:] + [None]):
+            # processes next to each other are connected by an os pipe
+            pipe = isinstance(stage, AsyncProc) and isinstance(child, AsyncProc)
+            source = await stage._start(source, bufsize, pipe)
+
+        output = stdout
+        if output is None:
+            output = io.StringIO() if self.text else io.BytesIO()
+
+        reader = AsyncReader(source, self.text)
+        data = await reader.read(bufsize)
+        while data:
+            output.write(data)
+            data = await reader.read(bufsize)
+        source.close()
+
+        for stage in stages:
+            await stage.wait()
+
+        empty = "" if self.text else b""
+        return self.returncode, output.getvalue() if stdout is None else None, empty
+
+    def background(self):
+        """ start the pipeline on the running event loop, returns a task """
+        return asyncio.ensure_future(self.run())
+
+class AsyncProc(AsyncStage):
+    """ a child process in an asyncio pipeline """
+
+    def __init__(self, *args):
+        super(AsyncProc, self).__init__()
+        self.args = []
+        for arg in args:
+            if isinstance(arg, list):
+                self.args.extend(str(val) for val in arg)
+            else:
+                self.args.append(arg)
+        self.proc = None
+        self._pump = None
+
+    def __repr__(self):
+        return "AsyncProc(%s)" % (','.join('%r' % r for r in self.args))
+
+    async def _start(self, source, bufsize, pipe):
+
+        stdin = None
+        if isinstance(source, int):
+            stdin = source
+        elif source is not None:
+            stdin = asyncio.subprocess.PIPE
+
+        fd_r, fd_w = os.pipe()
+
+        try:
+            self.proc = await asyncio.create_subprocess_exec(*self.args,
+                stdin=stdin, stdout=fd_w)
+        finally:
+            os.close(fd_w)
+            if isinstance(source, int):
+                os.close(source)
+
+        if source is not None and not isinstance(source, int):
+            self._pump = asyncio.ensure_future(_copy(source, self.proc.stdin, bufsize))
+
+        if pipe:
+            return fd_r
+        return await _read_pipe(fd_r, max(bufsize, 1 << 20))
+
+    async def wait(self):
+        if self._pump is not None:
+            await self._pump
+        if self.proc is not None:
+            self.returncode = await self.proc.wait()
+        return self.returncode
+
+class AsyncNode(AsyncStage):
+    """
+    a stage of an asyncio pipeline which runs a function on the event loop
+
+    the callback is a coroutine function given a stream. stream.stdin
+    and stream.stdout have the api of a Proc.Node stream, except every
+    method is a coroutine:
+
+        async def callback(stream):
+            async for line in stream.stdin:
+                await stream.stdout.write(line.upper())
+
+    a callback which is not a coroutine function, such as an ekanscrypt
+    function, is run on a thread with blocking streams.
+
+    limit: the number of bytes buffered between this node and the next
+    """
+
+    def __init__(self, callback=None, limit=None):
+        super(AsyncNode, self).__init__()
+        self.callback = callback or self.execute
+        self.limit = limit or 4 * self.buffer_size
+        self._task = None
+
+    def __repr__(self):
+        return "AsyncNode<%s>" % (self.callback.__name__)
+
+    def execute(self, stream):
+        # puplic API to implement
+        raise NotImplementedError("implement execute")
+
+    async def _start(self, source, bufsize, pipe):
+
+        output = _AsyncPipe(self.limit)
+        stdin = AsyncReader(source, self.text) if source is not None else None
+        stream = _AsyncNodeStream(stdin, AsyncWriter(output, self.text))
+        self._task = asyncio.ensure_future(self._execute(source, output, stream))
+        return output
+
+    async def _execute(self, source, output, stream):
+        try:
+            if asyncio.iscoroutinefunction(self.callback):
+                await self.callback(stream)
+            else:
+                loop = asyncio.get_event_loop()
+                stdin = _SyncAdapter(stream.stdin, loop) if stream.stdin else None
+                stdout = _SyncAdapter(stream.stdout, loop)
+                await _in_thread(self.callback, _AsyncNodeStream(stdin, stdout))
+            self.returncode = 0
+        except Exception:
+            self.returncode = 1
+            traceback.print_exc()
+        finally:
+            if source is not None:
+                source.close()
+            output.write_eof()
+
+    async def wait(self):
+        if self._task is not None:
+            await self._task
+        return self.returncode
+
+class AsyncTextNode(AsyncNode):
+    """ an AsyncNode which reads and writes utf-8 text """
+
+    text = True
+
+    def __repr__(self):
+        return "AsyncTextNode<%s>" % (self.callback.__name__)
+
+async def _gather(pipelines, jobs):
+
+    semaphore = asyncio.Semaphore(jobs) if jobs else None
+
+    async def run(pipeline):
+        if semaphore is None:
+            return await pipeline.run()
+        async with semaphore:
+            return await pipeline.run()
+
+    return await asyncio.gather(*[run(pipeline) for pipeline in pipelines])
+
+def gather(pipelines, jobs=None):
+    """
+    run async pipelines on one event loop, blocking until all complete
+
+    returns a list of (returncode, stdout, stderr), one for each pipeline.
+
+    jobs: the maximum number of pipelines to run at the same time
+    """
+    return asyncio.run(_gather(pipelines, jobs))
@@ -1,59 +1,70 @@
 
 import os
 import sys
+import errno
 import subprocess
 import types
-import select
+import pickle
+import marshal
+import importlib
+import multiprocessing
+import selectors
 import io
 import threading
 import traceback
 import codecs
 import logging
+import json
+import queue
+import collections
+import concurrent.futures
+
+from ..builtins import default_globals, es_drill
+
 log = logging.getLogger("ekanscrypt.proc")
 
-class _fdfile(object):
+class _fdfile(io.RawIOBase):
+    """
+    an unbuffered file over one end of a pipe
+
+    a raw file, so that it can be wrapped by io.BufferedReader and
+    io.TextIOWrapper. closing a wrapper closes the file descriptor.
+    """
+
     def __init__(self, fd, mode):
         super(_fdfile, self).__init__()
         self.mode = mode
         self.fd = fd
-        self.closed = False
 
-    def read(self, n):
+    def read(self, n=-1):
         if self.mode != "r":
             raise ValueError(self.mode)
         if self.closed:
             return b""
+        if n is None or n < 0:
+            return self.readall()
         return os.read(self.fd, n)
 
+    def readinto(self, b):
+        if self.mode != "r":
+            raise ValueError(self.mode)
+        return os.readv(self.fd, [b])
+
     def write(self, string):
         if self.mode != "w":
             raise ValueError(self.mode)
-        try:
-            return os.write(self.fd, string)
-        except BrokenPipeError:
-            sys.stderr.write("write to %d failed 1 (%d)" % (self.fd, len(string)))
-        except OSError:
-            sys.stderr.write("write to %d failed 2 (%d)" % (self.fd, len(string)))
-
-    def flush():
-        pass
-
-    def isatty():
-        return False
+        return os.write(self.fd, string)
 
-    def readable():
+    def readable(self):
         return self.mode == "r"
 
-    def seekable():
-        return False
-
-    def writable():
+    def writable(self):
         return self.mode == "w"
 
     def close(self):
         if not self.closed:
-            self.closed = True
-            return os.close(self.fd)
+            super(_fdfile, self).close()
+            os.close(self.fd)
 
     def fileno(self):
         return self.fd
@@ -70,83 +81,287 @@ class _pipefile(object):
         self.stdout = _fdfile(self._fd_in_r, "r")
         self.stderr = None
 
-class _textfile(object):
-    def __init__(self):
-        super(_textfile, self).__init__()
+class _textio(io.TextIOWrapper):
+    """
+    utf-8 text over a pipe, with the line helpers of a text node
 
-        writer_factory = codecs.getwriter("utf-8")
-        reader_factory = codecs.getreader("utf-8")
+    like sys.stdout, the buffer attribute allows for reading
+    or writing bytes directly
+    """
 
-        self._fd_in_r, self._fd_in_w = os.pipe()
+    def readline2(self):
+        """
+        returns the next line which is not empty, without the new line
+        an empty string is returned at end of file
+        """
+        line = self.readline()
+        while line and not line.strip():
+            line = self.readline()
+        return line.rstrip("\n")
 
-        self._stdin = _fdfile(self._fd_in_w, "w")
-        self._stdout = _fdfile(self._fd_in_r, "r")
-        self._stderr = None
-
-        # provide an underlying buffer
-        # like sys.stdout.buffer, to allow
-        # for directly writing bytes
-        self.stdin = writer_factory(self._stdin)
-        self.stdin.buffer = self._stdin
-        self.stdin.writeline2 = self._writeline
-        self.stdout = reader_factory(self._stdout)
-        self.stdout.buffer = self._stdout
-        self.stdout.readline2 = self._readline2
-        self.stderr = None
+    def writeline2(self, text):
+        """ write the text followed by a new line """
+        self.write(text + "\n")
+
+    def batches(self, size=1024):
+        """
+        yields lists of up to size lines, with the same lines as
+        readline2: empty lines are skipped and the new line is removed.
+
+        the input is read and decoded a buffer at a time, instead of
+        a line at a time
+        """
+        chunk_size = max(self._CHUNK_SIZE, io.DEFAULT_BUFFER_SIZE)
+        pending = ""
+        batch = []
+        while True:
+            text = self.read(chunk_size)
+            if not text:
+                break
+            lines = (pending + text).split("\n")
+            pending = lines.pop()
+            batch.extend(line for line in lines if line.strip())
+            while len(batch) >= size:
+                yield batch[:size]
+                del batch[:size]
+
+        if pending.strip():
+            batch.append(pending)
+        while batch:
+            yield batch[:size]
+            del batch[:size]
+
+    def writelines(self, lines):
+        """ write each string in lines, with one write """
+        self.write("".join(lines))
+
+    def writelines2(self, lines):
+        """ write each string in lines followed by a new line, with one write """
+        if lines:
+            self.write("\n".join(lines) + "\n")
+
+def _textopen(f, mode, buffer_size, newline, line_buffering=False):
+    """
+    wrap a pipe in a text file
 
-    def _readline2(self):
+    f: a raw or buffered binary file
+    buffer_size: size of the buffer used when f is a raw file
+    newline: the newline argument of io.TextIOWrapper. the empty string
+        reads and writes line endings unchanged.
+    """
+    if isinstance(f, io.TextIOBase):
+        return f
+    if not isinstance(f, io.BufferedIOBase):
+        if mode == "r":
+            f = io.BufferedReader(f, buffer_size)
+        else:
+            f = io.BufferedWriter(f, buffer_size)
+    # write_through keeps text in order with bytes written to the buffer,
+    # which is still flushed only when full
+    return _textio(f, encoding="utf-8", newline=newline,
+        line_buffering=line_buffering, write_through=True)
 
-        line = self.stdout.readline()
-        while line and not line.strip():
-            line = self.stdout.readline()
-        return line.rstrip("\n")
+class _textfile(object):
+    def __init__(self, buffer_size=io.DEFAULT_BUFFER_SIZE, newline="", line_buffering=False):
+        super(_textfile, self).__init__()
 
-    def _writeline(self, text):
-        self.stdin.write(text)
-        self.stdin.write("\n")
+        self._fd_in_r, self._fd_in_w = os.pipe()
+
+        self.stdin = _textopen(_fdfile(self._fd_in_w, "w"), "w",
+            buffer_size, newline, line_buffering)
+        self.stdout = _textopen(_fdfile(self._fd_in_r, "r"), "r",
+            buffer_size, newline)
+        self.stderr = None
 
 class _textstream(object):
-    def __init__(self, stream):
+    def __init__(self, stream, buffer_size=io.DEFAULT_BUFFER_SIZE, newline="", line_buffering=False):
         super(_textstream, self).__init__()
         self.stream = stream
 
-        writer_factory = codecs.getwriter("utf-8")
-        reader_factory = codecs.getreader("utf-8")
-
         self.stdin = None
         self.stdout = None
         self.stderr = None
 
         if self.stream:
             if self.stream.stdin:
-                if isinstance(self.stream.stdin, codecs.StreamWriter):
-                    self.stdin = self.stream.stdin
-                else:
-                    self.stdin = writer_factory(self.stream.stdin)
-                    self.stdin.buffer = self.stream.stdin
-                    self.stdin.writeline2 = self._writeline
+                self.stdin = _textopen(self.stream.stdin, "w",
+                    buffer_size, newline, line_buffering)
 
             if self.stream.stdout:
-                if isinstance(self.stream.stdout, codecs.StreamReader):
-                    self.stdout = self.stream.stdout
-                else:
-                    self.stdout = reader_factory(self.stream.stdout)
-                    self.stdout.buffer = self.stream.stdout
-                    self.stdout.readline2 = self._readline2
+                self.stdout = _textopen(self.stream.stdout, "r",
+                    buffer_size, newline)
 
             if self.stream.stderr:
-                self.stderr = reader_factory(self.stream.stderr)
+                self.stderr = _textopen(self.stream.stderr, "r",
+                    buffer_size, newline)
 
-    def _readline2(self):
+def _objectline(obj):
+    """ the line written for an object, at a boundary with a byte stream """
+    if isinstance(obj, str):
+        return obj + "\n"
+    return json.dumps(obj) + "\n"
 
-        line = self.stdout.readline()
-        while line and not line.strip():
-            line = self.stdout.readline()
-        return line.rstrip("\n")
+class _objectwriter(object):
+    """
+    the writing end of an object channel
+
+    objects are collected in a list, which is put into the queue of the
+    channel once it holds batch_size objects or the writer is closed
+    """
+
+    def __init__(self, channel, batch_size):
+        super(_objectwriter, self).__init__()
+        self.channel = channel
+        self.batch_size = batch_size
+        self.closed = False
+        self._batch = []
+
+    def put(self, obj):
+        """ write one object """
+        self._batch.append(obj)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def putmany(self, objs):
+        """ write every object of a list """
+        self._batch.extend(objs)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self.channel.send(batch)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.flush()
+            except BrokenPipeError:
+                # the reader stopped reading
+                pass
+            self.channel.send(None)
+
+class _objectreader(object):
+    """
+    the reading end of an object channel, or the lines of a text stream
+
+    batches: an iterator of lists of objects
+    close: called when the reader is closed
+    """
+
+    def __init__(self, batches, close):
+        super(_objectreader, self).__init__()
+        self._batches = batches
+        self._close = close
+        self._batch = []
+        self._index = 0
+        self._file = None
+        self.closed = False
+
+    def get(self):
+        """ returns the next object, None at the end of the input """
+        while self._index >= len(self._batch):
+            self._batch = next(self._batches, None)
+            self._index = 0
+            if self._batch is None:
+                self._batch = []
+                return None
+        obj = self._batch[self._index]
+        self._index += 1
+        return obj
+
+    def batches(self):
+        """ yields lists of objects, as they were written to the channel """
+        if self._index < len(self._batch):
+            batch = self._batch[self._index:]
+            self._batch = []
+            self._index = 0
+            yield batch
+        for batch in self._batches:
+            yield batch
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
+
+    def tofile(self):
+        """
+        returns the read end of a pipe, which a thread fills with the
+        objects of this reader, one line each
+        """
+        if self._file is None:
+            fd_r, fd_w = os.pipe()
+            thread = threading.Thread(target=self._encode, args=(fd_w,), daemon=True)
+            thread.start()
+            self._file = _fdfile(fd_r, "r")
+        return self._file
+
+    def _encode(self, fd):
+        try:
+            for batch in self.batches():
+                view = memoryview("".join([_objectline(obj) for obj in batch]).encode("utf-8"))
+                while view:
+                    view = view[os.write(fd, view):]
+        except BrokenPipeError:
+            pass
+        finally:
+            os.close(fd)
+            self._close()
+
+    def fileno(self):
+        return self.tofile().fileno()
 
-    def _writeline(self, text):
-        self.stdin.write(text)
-        self.stdin.write("\n")
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self._file is not None:
+                # the thread writing to the pipe closes the channel
+                self._file.close()
+            else:
+                self._close()
+
+class _objectfile(object):
+    """
+    a bounded queue of lists of objects, in place of a pipe
+
+    queue_size: the number of batches which can be waiting in the queue
+        before the writer blocks
+    """
+
+    def __init__(self, batch_size, queue_size):
+        super(_objectfile, self).__init__()
+        self._queue = queue.Queue(queue_size)
+        self._closed = False
+
+        self.stdin = _objectwriter(self, batch_size)
+        self.stdout = _objectreader(self._receive(), self._close_reader)
+        self.stderr = None
+
+    def send(self, batch):
+        """ put a list of objects in the queue, None for end of file """
+        if self._closed:
+            if batch is None:
+                return
+            raise BrokenPipeError(errno.EPIPE, "object channel is closed")
+        self._queue.put(batch)
+
+    def _receive(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            yield batch
+
+    def _close_reader(self):
+        # unblock the writer, which raises on the next send
+        self._closed = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
 
 class _ndfile(object):
     """
@@ -166,23 +381,37 @@ class _ndfile(object):
         self._stdin = src.stdin if src else None
 
     def close(self):
-        if self.stdin:
-            self.stdin.close()
-
-        if self.stdout:
-            self.stdout.close()
-
-        if self._stderr:
-            self._stderr.close()
+        # every file is closed, the first error is raised after
+        error = None
+        for f in (self.stdin, self.stdout, self._stderr):
+            if f:
+                try:
+                    f.close()
+                except (OSError, ValueError) as e:
+                    error = error or e
 
+        # the output of the previous stage, which is written by another
+        # thread and fails to flush once this stage stops reading
         if self._stdin:
-            self._stdin.close()
+            try:
+                self._stdin.close()
+            except (OSError, ValueError):
+                pass
+
+        if error is not None:
+            raise error
 
     def __enter__(self):
         return self
 
-    def __exit__(self, *args):
-        self.close()
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.close()
+        except (OSError, ValueError):
+            # flushing the output fails again after a broken pipe,
+            # the error which stopped the node is reported instead
+            if exc_type is None:
+                raise
 
 class Popen(subprocess.Popen):
 
@@ -211,11 +440,184 @@ class ProcNodeThread(threading.Thread):
                 #    sys.stderr.write("waiting for parent process to finish\n")
                 #    time.sleep(0.1)
 
+        except BrokenPipeError:
+            # the next stage stopped reading, as a process killed by SIGPIPE
+            self.parent.returncode = 1
+
         except BaseException as e:
             self.parent.returncode = 1
             traceback.print_exc()
             sys.stderr.write("unhandled exception: %s\n" % e)
 
+def _is_es_function(obj):
+    """ true for functions compiled from ekanscrypt source """
+    return isinstance(obj, types.FunctionType) and \
+        obj.__globals__.get('__es_drill__') is es_drill
+
+def _global_names(code):
+    """ the names of globals which code, or a nested function, may use """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _global_names(const)
+    return names
+
+def _make_function(code, name, ncells):
+    """ create an ekanscrypt function, the state is set by _set_function_state """
+    closure = tuple(types.CellType() for i in range(ncells)) if ncells else None
+    return types.FunctionType(marshal.loads(code), default_globals(), name, None, closure)
+
+def _set_function_state(fn, state):
+    globals_, defaults, kwdefaults, closure = state
+    fn.__globals__.update(globals_)
+    fn.__defaults__ = defaults
+    fn.__kwdefaults__ = kwdefaults
+    for cell, (empty, value) in zip(fn.__closure__ or (), closure):
+        if not empty:
+            cell.cell_contents = value
+
+class _Pickler(pickle.Pickler):
+    """
+    pickles ekanscrypt functions by value, since they can not be
+    imported by name. the function is rebuilt with fresh default
+    globals and a copy of the globals it uses. the state is set after
+    the function is created so that recursive functions can be pickled.
+    modules are imported by name, .es modules from their source file.
+    """
+
+    def reducer_override(self, obj):
+
+        if _is_es_function(obj):
+            defaults = default_globals()
+            globals_ = {}
+            for name in _global_names(obj.__code__):
+                if name in obj.__globals__ and name not in defaults:
+                    globals_[name] = obj.__globals__[name]
+
+            closure = []
+            for cell in obj.__closure__ or ():
+                try:
+                    closure.append((False, cell.cell_contents))
+                except ValueError:
+                    closure.append((True, None))
+
+            args = (marshal.dumps(obj.__code__), obj.__name__, len(closure))
+            state = (globals_, obj.__defaults__, obj.__kwdefaults__, closure)
+            return _make_function, args, state, None, None, _set_function_state
+
+        if isinstance(obj, types.ModuleType):
+            path = getattr(obj, "__file__", None)
+            if path and path.endswith(".es"):
+                # the child may not have the finder installed, or a
+                # different working directory, import the source file
+                return _import_es_module, (os.path.abspath(path), obj.__name__)
+            return importlib.import_module, (obj.__name__,)
+
+        return NotImplemented
+
+def _import_es_module(path, name):
+    from .. import loader
+    return loader.import_path(path, name)
+
+def _dumps(obj):
+    f = io.BytesIO()
+    _Pickler(f).dump(obj)
+    return f.getvalue()
+
+class _inheritfd(object):
+    """ a file descriptor given to the child process of a node """
+
+    def __init__(self, fd):
+        super(_inheritfd, self).__init__()
+        self.fd = fd
+
+    def __reduce__(self):
+        # only valid while multiprocessing is starting a process
+        return _detachfd, (multiprocessing.reduction.DupFd(self.fd),)
+
+def _detachfd(dupfd):
+    return _inheritfd(dupfd.detach())
+
+def _closefds(keep):
+    """ close every file descriptor not in keep, other than stdio """
+    fd = 3
+    for keep_fd in sorted(fd for fd in keep if fd >= 3):
+        os.closerange(fd, keep_fd)
+        fd = keep_fd + 1
+    os.closerange(fd, os.sysconf("SC_OPEN_MAX"))
+
+def _run_node_process(callback, stdin, stdout, text, inherited):
+    """
+    text: the options of the text streams, None for a binary node
+    """
+
+    if inherited:
+        # a forked child inherits every pipe of the parent. the reader
+        # of a pipe only sees end of file once every copy of the write
+        # end is closed
+        _closefds([f.fd for f in (stdin, stdout) if f is not None])
+
+    if isinstance(callback, bytes):
+        callback = pickle.loads(callback)
+
+    src = types.SimpleNamespace(stdin=None, stderr=None,
+        stdout=_fdfile(stdin.fd, "r") if stdin is not None else None)
+    dst = types.SimpleNamespace(stdin=_fdfile(stdout.fd, "w"), stdout=None, stderr=None)
+
+    if text:
+        src = _textstream(src, *text)
+        dst = _textstream(dst, *text)
+
+    with _ndfile(src, dst) as f:
+        callback(f)
+
+def _default_start_method():
+    """
+    the start method of child processes when none is given. a forked
+    child copies the parent while the threads of other stages hold
+    locks, and inherits every pipe of the pipeline.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return "forkserver"
+    return "spawn"
+
+class ProcNodeProcess(object):
+    """ runs the callback of an EkanscryptProcessNode in a child process """
+
+    def __init__(self, parent, stream, callback, context):
+        super(ProcNodeProcess, self).__init__()
+        self.callback = callback
+        self.stream = stream
+        self.parent = parent
+        self.context = context
+        self.process = None
+
+    def start(self):
+
+        stdin = None
+        if self.stream and self.stream.stdout:
+            stdin = _inheritfd(self.stream.stdout.fileno())
+        stdout = _inheritfd(self.parent.pipe.stdin.fileno())
+
+        inherited = self.context.get_start_method() == "fork"
+        callback = self.callback if inherited else _dumps(self.callback)
+        text = None
+        if isinstance(self.parent, EkanscryptProcTextNode):
+            text = self.parent._text_options()
+
+        self.process = self.context.Process(target=_run_node_process,
+            args=(callback, stdin, stdout, text, inherited))
+        self.process.start()
+
+        # the child owns these ends of the pipes now
+        self.parent.pipe.stdin.close()
+        if stdin is not None:
+            self.stream.stdout.close()
+
+    def join(self):
+        self.process.join()
+        self.parent.returncode = 0 if self.process.exitcode == 0 else 1
+
 class EkanscryptProcNode(object):
 
     _filetype = _pipefile
@@ -226,7 +628,7 @@ class EkanscryptProcNode(object):
         self.callback = callback or self.execute
         self._called = False
 
-        self.pipe = self._filetype()
+        self.pipe = self._open_pipe()
 
         # used by communicate api
         self.stdin = self.pipe.stdin
@@ -239,16 +641,19 @@ class EkanscryptProcNode(object):
         #return "Node<%s,%s,%s>" % (self.stdin, self.stdout, self.stderr)
         return "ProcNode<%s>" % (self.callback.__name__)
 
+    def _open_pipe(self):
+        return self._filetype()
+
     def __call__(self, stream=None):
         if self._called:
             raise RuntimeError("Double call on process")
         self._called = True
         original = stream
+        if isinstance(stream, EkanscryptProcNode):
+            stream._begin()
         if isinstance(stream, (EkanscryptProcNode, subprocess.Popen)):
-            if isinstance(self, EkanscryptProcTextNode):
-                stream = _textstream(stream)
-        self.thread = ProcNodeThread(self, stream, self.callback)
-        self.thread.start()
+            stream = self._input(stream)
+        self.thread = self._start(stream)
 
         self._parent = original
         self._child = None
@@ -256,6 +661,24 @@ class EkanscryptProcNode(object):
             original._child = self
         return self
 
+    def _input(self, stream):
+        """ returns the stream the callback reads from """
+        if isinstance(stream, EkanscryptProcObjectNode):
+            # objects are written to a pipe, one line each
+            stream = types.SimpleNamespace(stdin=None,
+                stdout=stream.stdout.tofile(), stderr=None)
+        return stream
+
+    def _start(self, stream):
+        """ run the callback, returns an object with a join method """
+        thread = ProcNodeThread(self, stream, self.callback)
+        thread.start()
+        return thread
+
+    def _begin(self):
+        """ called before the output of this node is read """
+        pass
+
     def execute(self, stream):
         # puplic API to implement
         raise NotImplementedError("implement execute")
@@ -290,13 +713,537 @@ class EkanscryptProcNode(object):
         return self
 
 class EkanscryptProcTextNode(EkanscryptProcNode):
+    """
+    a node which reads and writes utf-8 text
+
+    the text streams can be configured with keyword arguments, or by
+    overriding the class attributes in a subclass:
+
+    buffer_size: the size of the buffer of each stream
+    newline: the newline argument of io.TextIOWrapper. the default, an
+        empty string, returns and writes line endings unchanged.
+    line_buffering: flush the output at the end of every line, instead
+        of when the buffer is full
+    """
 
     _filetype = _textfile
 
+    buffer_size = 65536
+
+    newline = ""
+
+    line_buffering = False
+
+    _options = ("buffer_size", "newline", "line_buffering")
+
+    def __init__(self, callback=None, **options):
+        for name, value in options.items():
+            if name not in self._options:
+                raise TypeError("unexpected keyword argument '%s'" % name)
+            setattr(self, name, value)
+        super().__init__(callback)
+
+    def _text_options(self):
+        return self.buffer_size, self.newline, self.line_buffering
+
+    def _open_pipe(self):
+        return self._filetype(*self._text_options())
+
+    def _input(self, stream):
+        return _textstream(super()._input(stream), *self._text_options())
+
     def __repr__(self):
         #return "Node<%s,%s,%s>" % (self.stdin, self.stdout, self.stderr)
         return "ProcTextNode<%s>" % (self.callback.__name__)
 
+class EkanscryptProcObjectNode(EkanscryptProcTextNode):
+    """
+    a node which reads and writes python objects
+
+    the callback reads objects with stream.stdin.get(), batches() or by
+    iterating over stream.stdin, and writes objects with
+    stream.stdout.put() or putmany(). adjacent object nodes exchange
+    lists of objects through a bounded queue, without encoding or
+    system calls.
+
+    at a boundary with a process or a node reading bytes, every object
+    is written as one line: strings as they are and other objects as
+    json. the input from a process is read as lines of text, with the
+    same lines as readline2, and the text options of a TextNode.
+
+    batch_size: the number of objects written to the queue at a time
+    queue_size: the number of batches in the queue before the writer
+        waits for the reader
+    """
+
+    _filetype = _objectfile
+
+    _options = EkanscryptProcTextNode._options + ("batch_size", "queue_size")
+
+    batch_size = 1024
+
+    queue_size = 16
+
+    def _open_pipe(self):
+        return self._filetype(self.batch_size, self.queue_size)
+
+    def _input(self, stream):
+        if isinstance(stream, EkanscryptProcObjectNode):
+            return stream
+        stream = super()._input(stream)
+        return types.SimpleNamespace(stdin=stream.stdin,
+            stdout=_objectreader(stream.stdout.batches(self.batch_size),
+                stream.stdout.close), stderr=stream.stderr)
+
+    def __repr__(self):
+        return "ProcObjectNode<%s>" % (self.callback.__name__)
+
+# the transforms of a line node, in a worker process of Parallel
+_worker_transforms = None
+
+def _init_worker(transforms):
+    global _worker_transforms
+    _worker_transforms = pickle.loads(transforms)
+
+def _transform_lines(transforms, lines):
+    """
+    apply each transform to a list of lines, dropping lines which are None
+
+    transforms: a list of functions, None in a worker process
+    """
+    if transforms is None:
+        transforms = _worker_transforms
+    for transform in transforms:
+        lines = [line for line in map(transform, lines) if line is not None]
+    return lines
+
+class EkanscryptProcLineNode(EkanscryptProcTextNode):
+    """
+    a text node which applies a function to every line
+
+    transform: a function which is given a line, without the new line,
+        and returns the line to write or None to drop it. as with
+        readline2 empty lines are skipped.
+
+    the node is started when its output is first used. a line node
+    connected to a line node which has not started takes over its
+    transforms, so that a run of line nodes becomes one thread
+    which passes each batch of lines through every transform, instead
+    of a thread and a pipe for every stage.
+
+    batch_size: the number of lines read and written at a time
+    fuse: when False the node runs on its own thread
+    """
+
+    _options = EkanscryptProcTextNode._options + ("batch_size", "fuse")
+
+    batch_size = 1024
+
+    fuse = True
+
+    def __init__(self, transform, **options):
+        self.transforms = [transform]
+        self._stream = None
+        self._fused = None
+        super().__init__(self._transform_lines, **options)
+
+    def __call__(self, stream=None):
+        if self.fuse and isinstance(stream, EkanscryptProcLineNode) and \
+                stream._fuse(self):
+            if self._called:
+                raise RuntimeError("Double call on process")
+            self._called = True
+            self.transforms = stream.transforms + self.transforms
+            self.thread = self._start(stream._stream)
+            self._parent = stream
+            self._child = None
+            stream._child = self
+            return self
+        return super().__call__(stream)
+
+    def _fuse(self, child):
+        """ give the input of this node to the child, if not started """
+        if not self.fuse or self.thread is not None or self._fused is not None:
+            return False
+        self._fused = child
+        # the output of this node is written by the child
+        self.pipe.stdin.close()
+        self.pipe.stdout.close()
+        return True
+
+    def _start(self, stream):
+        self._stream = stream
+        return None
+
+    def _begin(self):
+        if self.thread is None and self._fused is None and self._called:
+            self.thread = super()._start(self._stream)
+
+    def wait(self):
+        if self._fused is not None:
+            self.returncode = self._fused.wait()
+            return self.returncode
+        self._begin()
+        return super().wait()
+
+    def _transform_lines(self, stream):
+        if stream.stdin is None:
+            return
+        for lines in stream.stdin.batches(self.batch_size):
+            stream.stdout.writelines2(_transform_lines(self.transforms, lines))
+
+    def __repr__(self):
+        return "ProcLineNode<%s>" % ("|".join(getattr(t, "__name__", "?")
+            for t in self.transforms))
+
+class EkanscryptProcParallel(EkanscryptProcTextNode):
+    """
+    a text node which applies the transforms of a line node to batches
+    of lines on a pool of workers
+
+    node: a LineNode, or a function from a line to a line
+    workers: the number of threads or processes, defaults to the
+        number of cpus
+    ordered: write the output in the order of the input. when False
+        each batch is written as soon as it is done.
+    processes: run the transforms in worker processes instead of
+        threads. the transforms are pickled as for a ProcessNode.
+    start_method: the multiprocessing start method of the workers.
+        fork is not supported, a forked worker would keep the pipes of
+        the pipeline open.
+
+    at most two batches for every worker are read before the output
+    of the oldest batch is written, so that a slow transform stops
+    the input instead of buffering it.
+    """
+
+    _options = EkanscryptProcTextNode._options + ("batch_size",)
+
+    batch_size = 1024
+
+    def __init__(self, node, workers=None, ordered=True, processes=False,
+            start_method=None, **options):
+        if isinstance(node, EkanscryptProcLineNode):
+            if node._called:
+                raise RuntimeError("Parallel requires a line node which is not connected")
+            # only the transforms are used
+            node.pipe.stdin.close()
+            node.pipe.stdout.close()
+            self.transforms = list(node.transforms)
+        elif isinstance(node, EkanscryptProcNode):
+            raise TypeError("Parallel requires a LineNode, not %r" % node)
+        else:
+            self.transforms = [node]
+
+        if processes:
+            if start_method is None:
+                start_method = _default_start_method()
+            if start_method == "fork":
+                raise ValueError("the fork start method is not supported")
+            self.context = multiprocessing.get_context(start_method)
+
+        self.workers = workers or os.cpu_count() or 1
+        self.ordered = ordered
+        self.processes = processes
+        super().__init__(self._map_lines, **options)
+
+    def _executor(self):
+        if self.processes:
+            return concurrent.futures.ProcessPoolExecutor(self.workers,
+                mp_context=self.context, initializer=_init_worker,
+                initargs=(_dumps(self.transforms),))
+        return concurrent.futures.ThreadPoolExecutor(self.workers)
+
+    def _map_lines(self, stream):
+        if stream.stdin is None:
+            return
+
+        transforms = None if self.processes else self.transforms
+        pending = collections.deque()
+
+        def write(block):
+            # write the output of finished batches, waiting for one if block
+            if self.ordered:
+                while pending and (block or pending[0].done()):
+                    stream.stdout.writelines2(pending.popleft().result())
+                    block = False
+            elif pending:
+                done, _ = concurrent.futures.wait(pending,
+                    timeout=None if block else 0,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    stream.stdout.writelines2(future.result())
+
+        with self._executor() as executor:
+            for lines in stream.stdin.batches(self.batch_size):
+                pending.append(executor.submit(_transform_lines, transforms, lines))
+                write(len(pending) >= 2 * self.workers)
+            while pending:
+                write(True)
+
+    def __repr__(self):
+        return "ProcParallel<%s,%d>" % ("|".join(getattr(t, "__name__", "?")
+            for t in self.transforms), self.workers)
+
+def _writeall(fd, data):
+    """ write all of data to fd, raises BrokenPipeError if the reader exits """
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+class _TeeBranch(EkanscryptProcNode):
+    """
+    one output of a tee, a node which writes the chunks put in its queue
+    """
+
+    def __init__(self, tee, queue_size):
+        super().__init__(self._write_chunks)
+        self.queue = queue.Queue(queue_size)
+        self.closed = False
+        self._called = True
+        self._parent = tee
+        self._child = None
+
+    def __call__(self, stream=None):
+        # the left hand side of |> is called without an input
+        if stream is not None:
+            raise RuntimeError("the output of a tee has no input")
+        return self
+
+    def _write_chunks(self, stream):
+        fd = stream.stdout.fileno()
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            # the pipe is closed by the next stage when it exits
+            if self.closed or stream.stdout.closed:
+                self.closed = True
+                continue
+            try:
+                _writeall(fd, chunk)
+            except OSError:
+                # the reader exited, the remaining chunks are dropped
+                self.closed = True
+
+    def __repr__(self):
+        return "ProcTeeBranch<%d>" % self._parent.branches.index(self)
+
+class EkanscryptProcTee(EkanscryptProcNode):
+    """
+    a node which copies its input to several outputs
+
+    count: the number of outputs. tee[i] is the i-th output, a stream
+        which is connected to the next stage, every output must be read.
+    buffer_size: the number of bytes read at a time
+    queue_size: the number of chunks each output can be behind before
+        the tee waits for it to catch up, which bounds the memory used
+        for a slow reader. zero for no limit, which is needed when one
+        output is only read after another has been read to the end.
+
+    an output whose reader exits is dropped. when every reader has
+    exited the tee stops reading its input.
+
+    the tee itself has no output, using it as the input of a stage
+    raises TypeError.
+    """
+
+    buffer_size = 65536
+
+    queue_size = 16
+
+    def __init__(self, count=2, buffer_size=None, queue_size=None):
+        if buffer_size is not None:
+            self.buffer_size = buffer_size
+        if queue_size is not None:
+            self.queue_size = queue_size
+        super().__init__(self._split)
+        self.branches = [_TeeBranch(self, self.queue_size) for i in range(count)]
+
+    def __call__(self, stream=None):
+        # the left hand side of |> is called without an input
+        if self._called and stream is None:
+            raise TypeError("a tee has no output, read from tee[i]")
+        return super().__call__(stream)
+
+    def __getitem__(self, index):
+        return self.branches[index]
+
+    def __len__(self):
+        return len(self.branches)
+
+    def _open_pipe(self):
+        # the output is written to the pipes of the branches
+        return types.SimpleNamespace(stdin=None, stdout=None, stderr=None)
+
+    def _begin(self):
+        raise TypeError("a tee has no output, read from tee[i]")
+
+    def _start(self, stream):
+        for branch in self.branches:
+            branch.thread = branch._start(None)
+        return super()._start(stream)
+
+    def _split(self, stream):
+        try:
+            src = stream.stdin
+            if src is None:
+                return
+            fd = getattr(src, "buffer", src).fileno()
+            while not all(branch.closed for branch in self.branches):
+                chunk = os.read(fd, self.buffer_size)
+                if not chunk:
+                    break
+                for branch in self.branches:
+                    if not branch.closed:
+                        branch.queue.put(chunk)
+        finally:
+            for branch in self.branches:
+                branch.queue.put(None)
+
+    def __repr__(self):
+        return "ProcTee<%d>" % len(self.branches)
+
+class EkanscryptProcMerge(EkanscryptProcNode):
+    """
+    a node which reads from several stages
+
+        Proc.Merge([a, b], "concat") |> exec cat
+
+    streams: the stages to read from. a process or a node which has
+        not been connected is started without an input.
+    mode: 'interleave' writes whole lines from each input as they
+        arrive, 'concat' writes each input in turn, until end of file.
+    buffer_size: the number of bytes read at a time
+
+    an input is read only as fast as the output is read, while an input
+    is not read the stage writing to it waits.
+    """
+
+    buffer_size = 65536
+
+    def __init__(self, streams, mode="interleave", buffer_size=None):
+        if mode not in ("interleave", "concat"):
+            raise ValueError("unknown merge mode: %s" % mode)
+        self.mode = mode
+        if buffer_size is not None:
+            self.buffer_size = buffer_size
+        super().__init__(self._merge)
+        self.streams = list(streams)
+        self.inputs = []
+
+    def __call__(self, stream=None):
+        if self._called:
+            raise RuntimeError("Double call on process")
+        if stream is not None:
+            raise RuntimeError("a merge reads from the streams it was created with")
+        self._called = True
+
+        streams, self.streams = self.streams, []
+        for stream in streams:
+            if isinstance(stream, EkanscryptProc) or \
+                    (isinstance(stream, EkanscryptProcNode) and not stream._called):
+                stream = stream()
+            if isinstance(stream, EkanscryptProcNode):
+                stream._begin()
+            f = self._input(stream).stdout
+            self.inputs.append(f)
+            self.streams.append(stream)
+            stream._child = self
+
+        # each input is waited for by wait
+        self._parent = None
+        self._child = None
+        self.thread = self._start(None)
+        return self
+
+    def wait(self):
+        super().wait()
+        for stream in self.streams:
+            nd = stream
+            while nd:
+                nd.wait()
+                nd = nd._parent
+        return self.returncode
+
+    def _merge(self, stream):
+        out = stream.stdout
+        fds = [getattr(f, "buffer", f).fileno() for f in self.inputs]
+        try:
+            if self.mode == "concat":
+                move = EkanscryptProc._splicer(out, self.buffer_size) or self._copy(out)
+                for fd in fds:
+                    EkanscryptProc._forward({fd: move})
+            else:
+                move = self._interleave(out)
+                EkanscryptProc._forward({fd: move for fd in fds})
+        finally:
+            for f in self.inputs:
+                f.close()
+
+    def _copy(self, out):
+        def move(fd):
+            data = os.read(fd, self.buffer_size)
+            _writeall(out.fileno(), data)
+            return len(data)
+        return move
+
+    def _interleave(self, out):
+        # the partial last line of each input
+        pending = {}
+        def move(fd):
+            data = os.read(fd, self.buffer_size)
+            buf = pending.pop(fd, b"") + data
+            end = len(buf) if not data else buf.rfind(b"\n") + 1
+            if data:
+                pending[fd] = buf[end:]
+            elif buf and not buf.endswith(b"\n"):
+                buf += b"\n"
+                end += 1
+            if end:
+                _writeall(out.fileno(), buf[:end])
+            return len(data)
+        return move
+
+    def __repr__(self):
+        return "ProcMerge<%s,%d>" % (self.mode, len(self.inputs))
+
+class EkanscryptProcessNode(EkanscryptProcNode):
+    """
+    a node which runs the callback in a child process
+
+    the child is connected to the pipeline by the same os pipes as a
+    node running on a thread, so that python stages of a pipeline are
+    not limited to one core.
+
+    start_method: the multiprocessing start method, defaults to
+        'forkserver', or 'spawn' where it is not available. the
+        callback is pickled, ekanscrypt functions are pickled by value,
+        with the globals they use. with 'fork' the callback is inherited
+        by the child, which is only safe while no other stage runs on a
+        thread.
+    """
+
+    def __init__(self, callback=None, start_method=None):
+        if start_method is None:
+            start_method = _default_start_method()
+        self.context = multiprocessing.get_context(start_method)
+        super().__init__(callback)
+
+    def __repr__(self):
+        return "ProcessNode<%s>" % (self.callback.__name__)
+
+    def _start(self, stream):
+        process = ProcNodeProcess(self, stream, self.callback, self.context)
+        process.start()
+        return process
+
+class EkanscryptProcessTextNode(EkanscryptProcessNode, EkanscryptProcTextNode):
+
+    def __repr__(self):
+        return "ProcessTextNode<%s>" % (self.callback.__name__)
+
 class BackgroundProc(threading.Thread):
     def __init__(self, proc, target):
         super(BackgroundProc, self).__init__(target=target)
@@ -335,7 +1282,33 @@ class EkanscryptProcRedirect(object):
     def __repr__(self):
         return "'%s%s%s'" % (self.src, {1:'>', 2:'>>'}[self.mode], self.dst)
 
+class _lazy(object):
+    """
+    a class attribute imported from a module of this package the first
+    time it is used, the asyncio pipelines are not loaded otherwise
+    """
+
+    def __init__(self, module, name):
+        super(_lazy, self).__init__()
+        self.module = module
+        self.name = name
+
+    def __get__(self, obj, cls):
+        return getattr(importlib.import_module(self.module, __package__), self.name)
+
+def _is_async(stream):
+    aio = sys.modules.get(__package__ + ".aio")
+    return aio is not None and isinstance(stream, aio.AsyncStage)
+
 class EkanscryptProc(object):
+
+    # the number of bytes communicate reads from a pipe at a time
+    buffer_size = 65536
+
+    # when true, communicate moves the output of the last stage to a
+    # file descriptor inside the kernel where the platform supports it
+    zero_copy = True
+
     def __init__(self, *args):
         super(EkanscryptProc, self).__init__()
         self.args, self.port_mapping = self._build_args(args)
@@ -461,7 +1434,7 @@ class EkanscryptProc(object):
                     if _mode != _x_mode:
                         raise RuntimeError("invalid redirect dst file opened for 2 different modes")
                 self.file_mapping[src] = _f
-        print("proc file mapping", self.file_mapping)
+        log.info("proc file mapping %s", self.file_mapping)
         return open_files
 
     def __call__(self, stream=None):
@@ -470,6 +1443,9 @@ class EkanscryptProc(object):
 
         self._called = True
 
+        if isinstance(stream, EkanscryptProcNode):
+            stream._begin()
+
         open_files = self._open_pipes(stream)
 
         self.proc = Popen(
@@ -525,48 +1501,165 @@ class EkanscryptProc(object):
 
     TextNode = EkanscryptProcTextNode
 
+    ObjectNode = EkanscryptProcObjectNode
+
+    LineNode = EkanscryptProcLineNode
+
+    Parallel = EkanscryptProcParallel
+
+    Tee = EkanscryptProcTee
+
+    Merge = EkanscryptProcMerge
+
+    ProcessNode = EkanscryptProcessNode
+
+    ProcessTextNode = EkanscryptProcessTextNode
+
+    AsyncProc = _lazy(".aio", "AsyncProc")
+
+    AsyncNode = _lazy(".aio", "AsyncNode")
+
+    AsyncTextNode = _lazy(".aio", "AsyncTextNode")
+
+    gather = _lazy(".aio", "gather")
+
     @staticmethod
-    def communicate(stream, stdout=None, stderr=None):
+    def _forward(files):
+        """
+        move data out of pipes until every pipe reaches end of file
+
+        files: a map of file descriptor to a callable which is given
+            the descriptor when it is readable. the callable returns
+            the number of bytes moved, zero at end of file.
+
+        end of file is reached when every writer of a pipe is closed,
+        which happens when a process exits or a node thread ends.
+        """
+        with selectors.DefaultSelector() as selector:
+            for fd, move in files.items():
+                selector.register(fd, selectors.EVENT_READ, move)
+
+            while selector.get_map():
+                for key, _ in selector.select():
+                    if not key.data(key.fd):
+                        selector.unregister(key.fd)
 
-        if isinstance(stream, EkanscryptProcNode):
+    @staticmethod
+    def _copier(dst, bufsize, text=False):
+        """ returns a callable for _forward which reads and writes to dst """
+        if not text:
+            def move(fd):
+                data = os.read(fd, bufsize)
+                if data:
+                    dst.write(data)
+                return len(data)
+            return move
+
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        def move(fd):
+            data = os.read(fd, bufsize)
+            text = decoder.decode(data, final=not data)
+            if text:
+                dst.write(text)
+            return len(data)
+        return move
 
-            fds = []
-            dst = {}
-            src = {}
-            if hasattr(stream, 'stdout') and stream.stdout:
-                fd = stream.stdout.fileno()
-                fds.append(fd)
-                if stdout is None:
-                    if isinstance(stream, EkanscryptProcTextNode):
-                        dst[fd] = sys.stdout
-                    else:
-                        dst[fd] = sys.stdout.buffer
-                else:
-                    dst[fd] = stdout
+    @staticmethod
+    def _splicer(dst, bufsize):
+        """
+        returns a callable for _forward which moves data from a pipe to
+        dst inside the kernel, without copying it into python.
+
+        returns None when dst is not backed by a file descriptor or the
+        platform does not support splice. when the kernel refuses the
+        destination, for example a file opened for append, the data is
+        copied instead.
+
+        sendfile is not used: linux requires its input to be a regular
+        file and the output of every stage is a pipe.
+        """
+        if not EkanscryptProc.zero_copy or not hasattr(os, "splice"):
+            return None
 
-                # wrap the output file in a text reader
-                if isinstance(stream, EkanscryptProcTextNode):
-                    src[fd] = codecs.getreader("utf-8")(_fdfile(fd, "r"))
-                else:
-                    src[fd] = _fdfile(fd, "r")
+        try:
+            dst_fd = dst.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            return None
+
+        # data already written by python must come first
+        dst.flush()
+
+        copy = EkanscryptProc._copier(dst, bufsize)
+        spliced = True
+        def move(fd):
+            nonlocal spliced
+            if spliced:
+                try:
+                    return os.splice(fd, dst_fd, bufsize)
+                except OSError as e:
+                    if e.errno != errno.EINVAL:
+                        raise
+                    spliced = False
+            return copy(fd)
+        return move
 
-            while True:
-                rlist, _, _ = select.select(fds, [], [], 0.5)
+    @staticmethod
+    def _mover(dst, bufsize, text=False):
+        """ returns the fastest callable for _forward which writes to dst """
+        move = None
+        if not text:
+            move = EkanscryptProc._splicer(dst, bufsize)
+        return move or EkanscryptProc._copier(dst, bufsize, text)
 
-                if not rlist:
-                    continue
+    @staticmethod
+    def communicate(stream, stdout=None, stderr=None, bufsize=None):
+        """
+        run a pipeline to completion, copying the output of the last stage
 
-                success = False
-                for fd in rlist:
-                    #data = os.read(fd, 1024)
-                    data = src[fd].read(1024)
-                    if len(data) > 0:
-                        success = True
-                    dst[fd].write(data)
+        stdout: file to write the output to, defaults to sys.stdout
+        stderr: file to write the error output of a process to,
+            defaults to sys.stderr
+        bufsize: the number of bytes to read from a pipe at a time,
+            defaults to EkanscryptProc.buffer_size
 
-                # TODO: put a ~1minute, ~10 second warning for dev testing
-                if not success and stream.returncode is not None:
-                    break
+        returns the return code of the last stage
+        """
+
+        if bufsize is None:
+            bufsize = EkanscryptProc.buffer_size
+
+        if isinstance(stream, EkanscryptProcObjectNode):
+
+            if stdout is None:
+                stdout = sys.stdout
+            try:
+                for batch in stream.stdout.batches():
+                    stdout.write("".join([_objectline(obj) for obj in batch]))
+            finally:
+                stream.stdout.close()
+
+            nd = stream
+            while nd:
+                nd.wait()
+                nd = nd._parent
+
+            return stream.returncode
+
+        elif isinstance(stream, EkanscryptProcNode):
+
+            stream._begin()
+
+            files = {}
+            if hasattr(stream, 'stdout') and stream.stdout:
+                text = isinstance(stream, EkanscryptProcTextNode)
+                if stdout is None:
+                    stdout = sys.stdout if text else sys.stdout.buffer
+                files[stream.stdout.fileno()] = EkanscryptProc._mover(stdout, bufsize, text)
+
+            EkanscryptProc._forward(files)
+
+            if files:
+                stream.stdout.close()
 
             nd = stream
             while nd:
@@ -580,51 +1673,21 @@ class EkanscryptProc(object):
             if stream and stream.stdin:
                 stream.stdin.close()
 
-            fds = []
-            dst = {}
+            files = {}
             if hasattr(stream, 'stdout') and stream.stdout:
-                fd = stream.stdout.fileno()
-                fds.append(fd)
                 if stdout is None:
-                    dst[fd] = sys.stdout.buffer
-                else:
-                    dst[fd] = stdout
+                    stdout = sys.stdout.buffer
+                # TODO: support text mode output somehow...
+                # maybe the encoding argument should be an argument
+                # to this method
+                files[stream.stdout.fileno()] = EkanscryptProc._mover(stdout, bufsize)
             if hasattr(stream, 'stderr') and stream.stderr:
-                fd = stream.stderr.fileno()
-                fds.append(fd)
                 if stderr is None:
-                    dst[fd] = sys.stderr.buffer
-                else:
-                    dst[fd] = stderr
+                    stderr = sys.stderr.buffer
+                files[stream.stderr.fileno()] = EkanscryptProc._mover(stderr, bufsize)
 
             # its possible there are no files to read from
-            while fds:
-                try:
-                    rlist, _, _ = select.select(fds, [], [], 0.5)
-
-                    if not rlist:
-                        if stream.returncode is not None:
-                            break
-                        continue
-
-                    count = 0
-                    for fd in rlist:
-                        # TODO: support text mode output somehow...
-                        # maybe the encoding argument should be an argument
-                        # to this method
-                        data = os.read(fd, 1024)
-                        count += len(data)
-                        dst[fd].write(data)
-
-                    # TODO: put a ~1minute, ~10 second warning for dev testing
-                    if count == 0 or stream.returncode is not None:
-                        break
-                except KeyboardInterrupt:
-                    print(stream.stdin)
-                    print(stream.stdout)
-                    print(stream.stderr)
-                    print(stream.returncode)
-                    sys.exit(1)
+            EkanscryptProc._forward(files)
 
             # TODO: maybe this should wait in reverse
             nd = stream
@@ -633,6 +1696,14 @@ class EkanscryptProc(object):
                 nd = nd._parent
 
             return stream.returncode
+        elif _is_async(stream):
+            # already imported by the async stages
+            import asyncio
+
+            if stdout is None:
+                stdout = sys.stdout if stream.text else sys.stdout.buffer
+            returncode, _, _ = asyncio.run(stream.run(stdout=stdout, bufsize=bufsize))
+            return returncode
         elif hasattr(stream, '__call__'):
             stream()
         else:
@@ -86,6 +86,7 @@ from .exception import ParseError, TokenError
 import logging
 log = logging.getLogger("ekanscrypt.parser")
 from .util import prefix_count
+from .instrument import active_profile, phase
 
 keywords = [
         #"new",
@@ -1396,17 +1397,36 @@ precedence2 = [
 
 def group(tokens, precedence, parent=None):
 
-    for direction, callback, operators in precedence:
+    profile = active_profile()
 
-        i = 0
-        while i < len(tokens):
+    for index, rule in enumerate(precedence):
+        if profile is None:
+            _group_rule(parent, tokens, rule, precedence)
+        else:
+            with profile.phase(_rule_name(precedence, index)):
+                _group_rule(parent, tokens, rule, precedence)
 
-            if direction < 0:
-                j = len(tokens) - i - 1
-            else:
-                j = i
+def _group_rule(parent, tokens, rule, precedence):
 
-            i += callback(parent, tokens, j, operators, precedence)
+    direction, callback, operators = rule
+
+    i = 0
+    while i < len(tokens):
+
+        if direction < 0:
+            j = len(tokens) - i - 1
+        else:
+            j = i
+
+        i += callback(parent, tokens, j, operators, precedence)
+
+def _rule_name(precedence, index):
+    """ the name of a parser pass, as shown in a CompileProfile """
+    _, callback, operators = precedence[index]
+    label = "precedence1" if precedence is precedence1 else "precedence2"
+    if len(operators) > 4:
+        operators = operators[:4] + ["..."]
+    return "%s[%d] %s %s" % (label, index, callback.__name__, " ".join(operators))
 
 def walk(token, parent=None):
 
@@ -1800,6 +1820,15 @@ def treewalk_varscopes_impl(token, current_scope):
             treewalk_varscopes_impl(child, current_scope)
 
 def parser(tokens):
+    """
+    build the syntax tree from a sequence of tokens produced by the lexer
+
+    the parser modifies the tokens in place, a token must not be shared
+    between two parses. lex the text again to parse it a second time.
+    the given list is not modified, the returned list of tokens is new
+    """
+
+    tokens = list(tokens)
 
     # first pass transform node types, prepare for second phase
     group(tokens, precedence1)
@@ -1808,12 +1837,15 @@ def parser(tokens):
 
     mod = Token(Token.I_MOD)
     mod.children = tokens
-    walk(mod)
-    walk2(mod)
+    with phase("walk"):
+        walk(mod)
+    with phase("walk2"):
+        walk2(mod)
 
     # after all transformations perform one last walk of the full graph
     # discover variables defined in one scope and used in a child scope
-    treewalk_varscopes(mod)
+    with phase("treewalk_varscopes"):
+        treewalk_varscopes(mod)
 
     return tokens
 
@@ -1,17 +1,14 @@
 
 import os
 import sys
+import types
 import logging
-import argparse
 
-from .lexer import lexer
-from .parser import parser
-from .compiler import Expression
+from .cache import CompileCache, default_cache
+from .builtins import default_globals
 from .exception import TokenError, format_generic
 from .util import prefix_count, Namespace
 
-from .objects.proc import _textstream, EkanscryptProcTextNode
-
 def path_name(name):
 
     count = prefix_count(name, ".")
@@ -26,20 +23,57 @@ def path_name(name):
 
     return path
 
+class CompiledModule(object):
+    """
+    a module loaded from the compile cache
+
+    provides the same function_body as an Expression, without
+    importing the lexer, parser or compiler.
+    """
+    def __init__(self, name, code, globals=None):
+        super(CompiledModule, self).__init__()
+
+        self.globals = default_globals()
+        if globals:
+            self.globals.update(globals)
+
+        self.function_body = types.FunctionType(code, self.globals, name)
+
+    def execute(self):
+        rv = self.function_body()
+
 class Program(object):
-    def __init__(self):
+    def __init__(self, cache=None, cache_dir=None):
+        """
+        cache: the CompileCache used for scripts, defaults to a cache
+            shared by every Program in this process
+        cache_dir: an alternate root directory for both the script cache
+            and the cache of imported modules, for example when the
+            source tree is read only.
+        """
         super(Program, self).__init__()
 
         self.diag = False
 
-    def compile(self, path, globals=None, name=None):
+        if cache is None and cache_dir is not None:
+            cache = CompileCache(cache_dir)
+
+        if cache_dir is not None:
+            from . import loader
+            loader.set_cache_dir(cache_dir)
+
+        self.cache = cache if cache is not None else default_cache()
+
+    def compile(self, path, globals=None, name=None, profile=None):
 
         with open(path, "r") as src:
             text = src.read()
 
-        expr = self.compile_text(path, text, globals=globals, name=name)
+        # the cache key contains the path, the absolute path finds the
+        # entry written by compileall however the script is named
+        path = os.path.abspath(path)
 
-        #save_module(path, expr.function_body.__code__)
+        expr = self.compile_text(path, text, globals=globals, name=name, profile=profile)
 
         return expr
 
@@ -58,21 +92,68 @@ class Program(object):
 
         return globals
 
-    def compile_text(self, path, text, globals=None, name=None, flags=Expression.CF_MODULE):
-        asf = parser(list(lexer(text)))
+    def compile_text(self, path, text, globals=None, name=None, flags=None, profile=None):
+        """
+        compile text and return an Expression
+
+        flags default to Expression.CF_MODULE. only modules compiled with
+        the default flags are cached, repl input is rarely repeated
+        and diag needs the full pipeline.
+
+        profile: a CompileProfile to record the time spent in each phase
+            of the compiler. the cache is not used when profiling.
+            in diag mode a profile is always recorded and printed.
+        """
 
         if name is None:
             name = '__main__'
 
+        if profile is None and self.diag:
+            from .instrument import CompileProfile
+            profile = CompileProfile()
+            report = True
+        else:
+            report = False
+
+        key = None
+        if flags is None and self.cache.enabled and profile is None:
+            key = self.cache.key(text, path, name, "module", globals)
+            code = self.cache.get(key)
+            if code is not None:
+                return CompiledModule(name, code, globals)
+
+        # the compiler is only needed on a cache miss
+        from .lexer import lexer
+        from .parser import parser
+        from .compiler import Expression
+
+        if flags is None:
+            flags = Expression.CF_MODULE
+
+        if profile is None:
+            asf = parser(list(lexer(text)))
+            expr = Expression(name, path, globals=globals, flags=flags)
+            expr.compile(asf)
+        else:
+            with profile.activate():
+                with profile.phase("lex"):
+                    tokens = list(lexer(text))
+                with profile.phase("parse"):
+                    asf = parser(tokens)
+                expr = Expression(name, path, globals=globals, flags=flags)
+                with profile.phase("compile"):
+                    expr.compile(asf)
+
         if self.diag:
             for ast in asf:
                 print(ast.toString(True))
+            expr.dump()
 
-        expr = Expression(name, path, globals=globals, flags=flags)
-        expr.compile(asf)
+        if report:
+            profile.write(sys.stdout)
 
-        if self.diag:
-            expr.dump()
+        if key is not None:
+            self.cache.put(key, expr.function_body.__code__)
 
         return expr
 
@@ -80,6 +161,7 @@ class Program(object):
         pass
 
     def execute_text(self, text):
+        from .compiler import Expression
         unit = self.compile_text("<string>", text, flags=Expression.CF_REPL)
         return unit.function_body()
 
@@ -103,45 +185,47 @@ class Program(object):
         If no match is found for an *.es file, then the default
         python import is used as a fallback
 
-        return value is a namespce (or module) containing the exported names
-
-
+        return value is a module containing the exported names.
+        modules are registered by the absolute path of the source file,
+        importing the same file a second time returns the same module.
         """
 
-        module_name = name.replace(".", "/") + ".es"
+        from . import loader
+
+        path = name.replace(".", "/") + ".es"
         if level == 0:
             search_path = sys.path
-        elif level == 1:
-            path = "./" + module_name
-            search_path = [script_path]
-        elif level >= 2:
-            path = "../" * (level - 1) + module_name
+        else:
+            path = "../" * (level - 1) + path
             search_path = [script_path]
 
-        print(name, path)
-
         for dir_path in search_path:
-            abspath = os.path.abspath(os.path.join(dir_path, path))
-            if os.path.exists(abspath):
-                unit = self.compile(abspath)
-                mod = Namespace(**unit.function_body())
-                mod.__name__ = name
-                print(mod)
-                return mod
+            abspath = os.path.abspath(os.path.join(dir_path or os.getcwd(), path))
+            if os.path.isfile(abspath):
+                # only absolute names are added to sys.modules
+                return loader.import_path(abspath, name if level == 0 else None)
+
+        if level != 0:
+            raise ImportError("No module named %r" % path, name=name)
+
+        import importlib
+        return importlib.import_module(name)
 
     def es_import(self, name, globals=None, locals=None, fromlist=(), level=0):
 
-        path = path_name(name)
+        from . import loader
 
-        unit = self.compile(path, globals=globals)
-        mod = Namespace(**unit.function_body())
-        return mod
+        # relative names are not added to sys.modules
+        return loader.import_path(path_name(name),
+            None if name.startswith(".") else name)
 
     def py_import(self, name, globals=None, locals=None, fromlist=(), level=0):
         return __import__(name, globals, locals, fromlist, level)
 
     def execute_node(self, node, args):
         # python -m ekanscrypt -n nodelib.col -- --col=0 --del=,
+        import argparse
+        from .objects.proc import _textstream, EkanscryptProcTextNode
 
         module, function_name = node.rsplit('.')
 
@@ -1,8 +1,22 @@
 
+import threading
 
-class Token(object):
+class _Counter(threading.local):
     count = 0
 
+_counter = _Counter()
+
+def token_count():
+    """
+    the number of tokens created by the current thread
+
+    each thread has a separate count, so that a CompileProfile is not
+    affected by code compiled at the same time in another thread
+    """
+    return _counter.count
+
+class Token(object):
+
     # tokens as produced by the lexer
     T_UNKNOWN = "T_UNKNOWN"
     T_TEXT = "T_TEXT"
@@ -92,7 +106,7 @@ class Token(object):
     S_MCMP = "S_MCMP"
 
     def __init__(self, type, line=0, index=0, value="", children=None):
-        Token.count += 1
+        _counter.count += 1
         super(Token, self).__init__()
         self.type = type
         self.line = line
@@ -1,9 +1,8 @@
 #! python3 $this
 
 import os
+import sys
 import struct
-import glob
-import inspect
 import re
 from .exception import TokenError
 
@@ -242,18 +241,19 @@ def _format(string, _globals, _locals):
 
 def es_format(string):
 
-    frame = inspect.currentframe()
-    _globals = frame.f_back.f_globals
-    _locals = frame.f_back.f_locals
+    frame = sys._getframe(1)
+    _globals = frame.f_globals
+    _locals = frame.f_locals
     return _format(string, _globals, _locals)
 
 def es_glob(string):
     # TODO: implement bash substitutions
     # i.e.
     #  file{txt,md} -> [file.txt, file.md]
-    frame = inspect.currentframe()
-    _globals = frame.f_back.f_globals
-    _locals = frame.f_back.f_locals
+    import glob
+    frame = sys._getframe(1)
+    _globals = frame.f_globals
+    _locals = frame.f_locals
     string = _format(string, _globals, _locals)
     return glob.glob(string)
 
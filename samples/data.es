@@ -6,9 +6,8 @@
 
 col = (col=0,sep=null) => {
     return Proc.TextNode((stream)=>{
-        while (line = stream.stdin.readline2()) {
-            parts = line.strip().split(sep);
-            stream.stdout.writeline2(parts[col]);
+        for lines in stream.stdin.batches(1000) {
+            stream.stdout.writelines2([line.strip().split(sep)[col] for line in lines]);
         }
     })
 }
@@ -0,0 +1,52 @@
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import unittest
+
+# compiled scripts are cached in a directory which is removed after the
+# tests, not in the cache of the user. a cache which outlives a change
+# to the compiler would hide the change from the tests. imported modules
+# are still cached next to their source, as the loader tests expect.
+# child processes started by the tests reuse the directory of the parent
+if "EKANS_TEST_CACHE_HOME" not in os.environ:
+    _cache_home = tempfile.mkdtemp(prefix="ekanscrypt-test-")
+    os.environ["EKANS_TEST_CACHE_HOME"] = _cache_home
+    os.environ.pop("EKANS_CACHE_DIR", None)
+    os.environ["XDG_CACHE_HOME"] = _cache_home
+    atexit.register(shutil.rmtree, _cache_home, ignore_errors=True)
+
+class TempDirTestCase(unittest.TestCase):
+    """
+    a test case with a temporary directory, self.root, which is removed
+    after each test. when chdir is True the tests run inside it.
+    """
+
+    chdir = False
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        if self.chdir:
+            self.cwd = os.getcwd()
+            os.chdir(self.root)
+        # the loader honors PYTHONDONTWRITEBYTECODE
+        self.dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+
+    def tearDown(self):
+        sys.dont_write_bytecode = self.dont_write_bytecode
+        if self.chdir:
+            os.chdir(self.cwd)
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def _write(self, name, text):
+        """ write a file below root, creating its directory, returns the path """
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as wf:
+            wf.write(text)
+        return path
@@ -0,0 +1,110 @@
+import io
+import os
+import gzip
+import tempfile
+import unittest
+
+from ekanscrypt.bench.scaling import SHAPES, measure, growth, run_shape
+from ekanscrypt.bench.runtime import WORKLOADS, run_workload
+from ekanscrypt.bench.quality import code_metrics, compare, load_workload, \
+    write_changes
+from ekanscrypt.bench.pipeline import CASES, make_file, run_case
+from ekanscrypt.bench import text
+
+class BenchTestCase(unittest.TestCase):
+
+    def test_001_shapes_compile(self):
+
+        # every generated program must be valid
+        for name, (generator, sizes, quick_sizes) in SHAPES.items():
+            result = measure(generator(3), repeat=1)
+            self.assertTrue(result["peak"] > 0, name)
+
+    def test_002_growth(self):
+
+        sizes = [1, 2, 4, 8]
+        self.assertAlmostEqual(growth(sizes, [3 * n for n in sizes]), 1.0)
+        self.assertAlmostEqual(growth(sizes, [n * n for n in sizes]), 2.0)
+        self.assertEqual(growth([1], [1]), 0.0)
+
+    def test_003_run_shape(self):
+
+        result = run_shape("flat", [10, 20], repeat=1)
+        self.assertEqual([row["size"] for row in result["rows"]], [10, 20])
+        self.assertIsNone(result["limit"])
+        self.assertIn("compile", result["growth"])
+
+    def test_004_runtime_workloads(self):
+
+        # run_workload checks that both implementations agree
+        for name in WORKLOADS:
+            result = run_workload(name, repeat=1, warmup=0)
+            self.assertTrue(result["ratio"] > 0, name)
+
+    def test_005_bytecode_quality(self):
+
+        def f(a):
+            x = a
+            return x
+
+        metrics = code_metrics(f.__code__)
+        # STORE_FAST x; LOAD_FAST x
+        self.assertEqual(metrics["store_load"], 1)
+        self.assertEqual(metrics["varnames"], 2)
+        self.assertEqual(metrics["extended_args"], 0)
+
+        rows = compare(*load_workload("man_boy"))
+        self.assertEqual([row["name"] for row in rows], ["<root>", "B"])
+        for row in rows:
+            self.assertTrue(row["ekanscrypt"]["instrs"] > 0)
+            self.assertTrue(row["python"]["instrs"] > 0)
+
+        # anonymous functions are paired by the name they are assigned to
+        names = [row["name"] for row in compare(*load_workload("pipeline"))]
+        self.assertEqual(names, ["<root>",
+            "source", "source.body", "node", "node.body", "sink", "sink.body"])
+
+        # a function on one side only is an error
+        with self.assertRaisesRegex(ValueError, r"B \(ekanscrypt\)"):
+            compare(load_workload("man_boy")[0], load_workload("fib")[1])
+
+        # a baseline with fewer instructions is a regression
+        baseline = {"man_boy": [dict(row, ekanscrypt=dict(row["ekanscrypt"])) for row in rows]}
+        baseline["man_boy"][1]["ekanscrypt"]["instrs"] -= 1
+        stream = io.StringIO()
+        self.assertEqual(write_changes({"man_boy": rows}, baseline, stream), 1)
+        self.assertIn("man_boy B: instrs", stream.getvalue())
+
+    def test_006_pipeline(self):
+
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "data")
+            make_file(path, 100000)
+            self.assertEqual(os.path.getsize(path), 100000)
+
+            for name in CASES:
+                for output in [None, os.path.join(root, "output")]:
+                    result = run_case(name, path, 4096, output)
+                    if name != "cat|gzip>out":
+                        self.assertEqual(result["bytes"], 100000, name)
+
+            with open(path, "rb") as rf, gzip.open(path + ".gz", "rb") as gf:
+                self.assertEqual(gf.read(), rf.read())
+
+    def test_007_text(self):
+
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "words")
+            text.make_words(path, 1000)
+
+            results = {name: text.run_case(name, path, 1000, 4096) for name in text.CASES}
+            self.assertEqual(results["readline2"]["lines"], 1000)
+            self.assertEqual(results["codecs"]["lines"], 1000)
+            self.assertTrue(results["find"]["lines"] < 1000)
+            self.assertEqual(results["parallel"]["lines"], 1000)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+import sys
+import zipfile
+import subprocess
+import unittest
+
+from tests import TempDirTestCase
+from ekanscrypt.cache import CACHE_HEADER
+from ekanscrypt.imports import import_graph
+from ekanscrypt.bundle import build_bundle
+
+class BundleTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._write("src/app.es", "import util\nimport pkg.sub\nimport json\n"
+            "main = () => {\n    print(util.double(pkg.sub.value))\n}\n")
+        self._write("src/util.es", "double = (x) => x * 2\n")
+        self._write("src/pkg/__init__.es", "")
+        self._write("src/pkg/sub.es", "value = 21\n")
+        self.entry = os.path.join(self.root, "src", "app.es")
+
+    def _run(self, path):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.getcwd()
+        return subprocess.run([sys.executable, "-m", "ekanscrypt", path],
+            cwd=self.root, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def test_001_import_graph(self):
+
+        graph = import_graph(self.entry)
+        self.assertEqual(list(graph), ["__main__", "util", "pkg", "pkg.sub"])
+        # python modules are not part of the graph
+        self.assertEqual(graph["__main__"].imports, ["util", "pkg", "pkg.sub"])
+        self.assertTrue(graph["pkg"].is_package)
+
+    def test_002_run_bundle(self):
+
+        output = os.path.join(self.root, "app.ezip")
+        build_bundle(self.entry, output)
+
+        with zipfile.ZipFile(output) as zf:
+            names = set(zf.namelist())
+        self.assertIn("__main__.esc", names)
+        self.assertIn("util.esc", names)
+        self.assertIn("pkg/__init__.esc", names)
+        self.assertIn("pkg/sub.esc", names)
+
+        # the bundle does not depend on the original sources
+        os.rename(os.path.join(self.root, "src"), os.path.join(self.root, "moved"))
+
+        proc = self._run(output)
+        self.assertEqual(proc.stdout.strip(), b"42", proc.stderr)
+        self.assertFalse(os.path.exists(os.path.join(self.root, "__pycache__")))
+
+    def test_003_version_mismatch(self):
+
+        output = os.path.join(self.root, "app.ezip")
+        build_bundle(self.entry, output)
+
+        # replace the header of every code entry, forcing the
+        # modules to be compiled from the bundled source
+        rewritten = os.path.join(self.root, "old.ezip")
+        with zipfile.ZipFile(output) as src, zipfile.ZipFile(rewritten, "w") as dst:
+            for name in src.namelist():
+                data = src.read(name)
+                if name.endswith(".esc"):
+                    data = b"\x00" * len(CACHE_HEADER) + data[len(CACHE_HEADER):]
+                dst.writestr(name, data)
+
+        proc = self._run(rewritten)
+        self.assertEqual(proc.stdout.strip(), b"42", proc.stderr)
+
+    def test_004_relative_import(self):
+
+        self._write("src/pkg/rel.es", "from .sub import value\nfrom . import inner\n")
+        self._write("src/pkg/inner/__init__.es", "from ..sub import value as v\n"
+            "from .leaf import w\n")
+        self._write("src/pkg/inner/leaf.es", "w = 2\n")
+        self._write("src/app.es", "import pkg.rel\n"
+            "main = () => {\n    print(pkg.rel.value + pkg.rel.inner.v + pkg.rel.inner.w)\n}\n")
+
+        graph = import_graph(self.entry)
+        self.assertEqual(list(graph), ["__main__", "pkg", "pkg.rel", "pkg.sub",
+            "pkg.inner", "pkg.inner.leaf"])
+
+        output = os.path.join(self.root, "app.ezip")
+        build_bundle(self.entry, output)
+        os.rename(os.path.join(self.root, "src"), os.path.join(self.root, "moved"))
+
+        proc = self._run(output)
+        self.assertEqual(proc.stdout.strip(), b"44", proc.stderr)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import os
+import unittest
+
+from tests import TempDirTestCase
+from ekanscrypt.compileall import compile_paths, module_name, COMPILED, SKIPPED, FAILED
+from ekanscrypt.loader import load_module, CACHE_TIMESTAMP, CACHE_CHECKED_HASH, \
+    CACHE_UNCHECKED_HASH
+from ekanscrypt.program import Program
+from ekanscrypt.cache import CompileCache
+from importlib.util import cache_from_source
+
+class CompileAllTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.files = {
+            "a.es": "x = 1\n",
+            "b.es": "f = (x) => x + 1\n",
+            os.path.join("pkg", "__init__.es"): "y = 2\n",
+            os.path.join("pkg", "c.es"): "z = [1, 2, 3]\n",
+        }
+        for name, text in self.files.items():
+            self._write(name, text)
+
+    def test_001_compile_tree(self):
+
+        results = compile_paths([self.root], workers=2)
+        self.assertEqual(len(results), 4)
+        self.assertEqual({status for _, status, _, _ in results}, {COMPILED})
+
+        for name in self.files:
+            path = os.path.join(self.root, name)
+            self.assertIsNotNone(load_module(cache_from_source(path), path))
+
+        # up to date entries are skipped
+        results = compile_paths([self.root], workers=1)
+        self.assertEqual({status for _, status, _, _ in results}, {SKIPPED})
+
+        results = compile_paths([self.root], workers=1, force=True)
+        self.assertEqual({status for _, status, _, _ in results}, {COMPILED})
+
+    def test_002_compile_error(self):
+
+        path = os.path.join(self.root, "bad.es")
+        with open(path, "w") as wf:
+            wf.write("x = )\n")
+
+        results = compile_paths([path], workers=1)
+        (_, status, _, message), = results
+        self.assertEqual(status, FAILED)
+        self.assertTrue(message)
+
+    def test_003_invalidation_mode(self):
+
+        path = os.path.join(self.root, "pkg", "__init__.es")
+        def compile(mode):
+            (_, status, _, _), = compile_paths([path], workers=1, mode=mode)
+            return status
+
+        self.assertEqual(compile(CACHE_UNCHECKED_HASH), COMPILED)
+        self.assertEqual(compile(CACHE_UNCHECKED_HASH), SKIPPED)
+
+        # the loader never checks the source of an unchecked cache,
+        # compileall does
+        with open(path, "w") as wf:
+            wf.write("y = 101\n")
+        self.assertEqual(compile(CACHE_UNCHECKED_HASH), COMPILED)
+        self.assertIn(101, load_module(cache_from_source(path), path).co_consts)
+
+        # a different mode is written again
+        self.assertEqual(compile(CACHE_CHECKED_HASH), COMPILED)
+        self.assertEqual(compile(CACHE_TIMESTAMP), COMPILED)
+        self.assertEqual(compile(CACHE_TIMESTAMP), SKIPPED)
+
+    def test_004_module_name(self):
+
+        # the same names as the finder gives the modules
+        self.assertEqual(module_name(os.path.join(self.root, "a.es")), "a")
+        self.assertEqual(module_name(os.path.join(self.root, "pkg", "c.es")), "pkg.c")
+        self.assertEqual(module_name(os.path.join(self.root, "pkg", "__init__.es")), "pkg")
+
+        path = os.path.join(self.root, "pkg", "c.es")
+        compile_paths([path], workers=1)
+        code = load_module(cache_from_source(path), path)
+        self.assertEqual(code.co_name, "pkg.c")
+
+    def test_005_script_cache(self):
+
+        # 'ekans a.es' finds the script compiled by compileall
+        compile_paths([self.root], workers=1)
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            program = Program(cache=CompileCache())
+            program.compile("a.es").function_body()
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(program.cache.stats()["hits"], 1)
+        self.assertEqual(program.cache.stats()["misses"], 0)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import os
+import io
+import unittest
+
+from tests import TempDirTestCase
+from ekanscrypt.lexer import lexer
+from ekanscrypt.parser import parser
+from ekanscrypt.program import Program
+from ekanscrypt.imports import find_imports, code_imports, prefetch, \
+    CACHED, COMPILED, FAILED
+
+class ImportsTestCase(TempDirTestCase):
+
+    chdir = True
+
+    def test_001_code_imports(self):
+
+        text = "import a.b\nfrom c import d, e\nf = () => {\n    import g\n}\nimport ..h\n"
+        expected = [(0, "a.b", []), (0, "c", ["d", "e"]), (0, "g", []), (2, "h", [])]
+
+        self.assertEqual(sorted(find_imports(parser(list(lexer(text))))), sorted(expected))
+
+        code = Program().compile_text("<string>", text, flags=1).function_body.__code__
+        self.assertEqual(sorted(code_imports(code)), sorted(expected))
+
+    def test_002_prefetch(self):
+
+        self._write("util.es", "import pkg.sub\ndouble = (x) => x * 2\n")
+        self._write("pkg/__init__.es", "")
+        self._write("pkg/sub.es", "value = 21\n")
+        self._write("broken.es", "x = (\n")
+        path = self._write("app.es", "import util\nimport broken\nimport json\n")
+
+        code = Program().compile(path).function_body.__code__
+
+        report = prefetch(code, workers=2)
+        graph = report.graph
+        self.assertEqual(sorted(graph), ["__main__", "broken", "pkg", "pkg.sub", "util"])
+        self.assertEqual(graph["__main__"].imports, ["util", "broken"])
+        self.assertEqual(graph["util"].imports, ["pkg", "pkg.sub"])
+        self.assertEqual(graph["util"].status, COMPILED)
+        self.assertEqual(graph["broken"].status, FAILED)
+        self.assertTrue(os.path.exists(os.path.join(self.root, "pkg", "__pycache__")))
+
+        # the second run reads the imports from the cache
+        report = prefetch(code, workers=2)
+        self.assertEqual(len(report.modules(CACHED)), 3)
+        self.assertEqual(report.graph["util"].imports, ["pkg", "pkg.sub"])
+
+        stream = io.StringIO()
+        report.write(stream)
+        self.assertIn("  util (cached)", stream.getvalue())
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+import os
+import sys
+import shutil
+import struct
+import importlib
+import threading
+import unittest
+
+from tests import TempDirTestCase
+from ekanscrypt import loader, cache
+from ekanscrypt.loader import save_module, load_module, EkanscryptFinder, \
+    lazy_import, CACHE_TIMESTAMP, CACHE_CHECKED_HASH, CACHE_UNCHECKED_HASH
+
+class LoaderTestCase(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.source = os.path.join(self.root, "mod.es")
+        self.cache = os.path.join(self.root, "__pycache__", "mod.pyc")
+        self._write_source("x = 1\n")
+
+    def _write_source(self, text, mtime=None):
+        with open(self.source, "wb") as wb:
+            wb.write(text.encode("utf-8"))
+        if mtime is not None:
+            os.utime(self.source, (mtime, mtime))
+
+    def _save(self, mode):
+        co = compile("x = 1", self.source, "exec")
+        with open(self.source, "rb") as rb:
+            source_bytes = rb.read()
+        save_module(self.cache, co, source_bytes, os.stat(self.source), mode)
+        return co
+
+    def test_001_timestamp(self):
+
+        self._write_source("x = 1\n", 1000000)
+        co = self._save(CACHE_TIMESTAMP)
+        self.assertEqual(load_module(self.cache, self.source), co)
+
+        # same size, different mtime
+        self._write_source("x = 2\n", 1000001)
+        self.assertIsNone(load_module(self.cache, self.source))
+
+        # same mtime, different size
+        self._write_source("x = 10\n", 1000000)
+        self.assertIsNone(load_module(self.cache, self.source))
+
+    def test_002_checked_hash(self):
+
+        self._write_source("x = 1\n", 1000000)
+        co = self._save(CACHE_CHECKED_HASH)
+        # mtime is not used in hash mode
+        self._write_source("x = 1\n", 1000005)
+        self.assertEqual(load_module(self.cache, self.source), co)
+
+        self._write_source("x = 2\n", 1000000)
+        self.assertIsNone(load_module(self.cache, self.source))
+
+    def test_003_unchecked_hash(self):
+
+        co = self._save(CACHE_UNCHECKED_HASH)
+        # the source is never consulted
+        os.remove(self.source)
+        self.assertEqual(load_module(self.cache, self.source), co)
+
+    def test_004_invalid(self):
+
+        self.assertIsNone(load_module(self.cache, self.source))
+
+        self._save(CACHE_TIMESTAMP)
+        with open(self.cache, "rb") as rb:
+            data = rb.read()
+
+        # a different compiler version
+        taglen, = struct.unpack("<H", data[16:18])
+        with open(self.cache, "wb") as wb:
+            wb.write(data[:18] + b"x" * taglen + data[18 + taglen:])
+        self.assertIsNone(load_module(self.cache, self.source))
+
+        # a truncated file
+        with open(self.cache, "wb") as wb:
+            wb.write(data[:-4])
+        self.assertIsNone(load_module(self.cache, self.source))
+
+        # no temporary files are left behind
+        self.assertEqual(os.listdir(os.path.dirname(self.cache)), ["mod.pyc"])
+
+    def test_005_import(self):
+
+        name = "loader_test_module"
+        path = os.path.join(self.root, name + ".es")
+        with open(path, "w") as wf:
+            wf.write("value = 6 * 7\r\nadd = (a) => a + value\r\n")
+
+        cwd = os.getcwd()
+        try:
+            os.chdir(self.root)
+            for i in range(2):
+                mod = importlib.import_module(name)
+                self.assertEqual(mod.value, 42)
+                self.assertEqual(mod.add(1), 43)
+                del sys.modules[name]
+        finally:
+            os.chdir(cwd)
+
+        self.assertTrue(os.path.exists(mod.__cached__))
+
+    def test_006_finder_listing(self):
+
+        os.makedirs(os.path.join(self.root, "pkg"))
+        with open(os.path.join(self.root, "pkg", "__init__.es"), "w") as wf:
+            wf.write("")
+        os.makedirs(os.path.join(self.root, "data"))
+
+        finder = EkanscryptFinder()
+        path = [self.root]
+
+        spec = finder.find_spec("mod", path)
+        self.assertEqual(spec.origin, self.source)
+        self.assertIsNone(spec.submodule_search_locations)
+
+        spec = finder.find_spec("a.b.pkg", path)
+        self.assertEqual(spec.origin, os.path.join(self.root, "pkg", "__init__.es"))
+        self.assertEqual(spec.submodule_search_locations, [os.path.join(self.root, "pkg")])
+
+        # directories without an __init__.es are not packages
+        self.assertIsNone(finder.find_spec("data", path))
+        self.assertIsNone(finder.find_spec("json", path))
+
+        # new files are found once the cache is invalidated
+        with open(os.path.join(self.root, "new.es"), "w") as wf:
+            wf.write("")
+        self.assertIsNone(finder.find_spec("new", path))
+        finder.invalidate_caches()
+        self.assertIsNotNone(finder.find_spec("new", path))
+
+    def test_007_lazy_import(self):
+
+        name = "loader_test_lazy"
+        path = os.path.join(self.root, name + ".es")
+        with open(path, "w") as wf:
+            wf.write("import loader_test_lazy_marker\nvalue = 42\n")
+        with open(os.path.join(self.root, "loader_test_lazy_marker.es"), "w") as wf:
+            wf.write("")
+
+        cwd = os.getcwd()
+        try:
+            os.chdir(self.root)
+            mod = lazy_import(name)
+            # the module body has not run yet
+            self.assertNotIn("loader_test_lazy_marker", sys.modules)
+            # nor has it been compiled
+            self.assertFalse(os.path.exists(os.path.join(self.root, "__pycache__")))
+            self.assertEqual(mod.value, 42)
+            self.assertIn("loader_test_lazy_marker", sys.modules)
+        finally:
+            os.chdir(cwd)
+            sys.modules.pop(name, None)
+            sys.modules.pop("loader_test_lazy_marker", None)
+
+        self.assertFalse(EkanscryptFinder.is_lazy(name))
+
+    def _import(self, name):
+        cwd = os.getcwd()
+        try:
+            os.chdir(self.root)
+            return importlib.import_module(name)
+        finally:
+            os.chdir(cwd)
+            sys.modules.pop(name, None)
+
+    def test_008_cache_dir(self):
+
+        name = "loader_test_cache_dir"
+        path = os.path.join(self.root, name + ".es")
+        with open(path, "w") as wf:
+            wf.write("value = 42\n")
+
+        cache_root = os.path.join(self.root, "cache")
+        loader.set_cache_dir(cache_root)
+        try:
+            cpath = loader.cache_path(path)
+            self.assertTrue(cpath.startswith(cache_root))
+
+            mod = self._import(name)
+            self.assertEqual(mod.value, 42)
+            self.assertEqual(mod.__cached__, cpath)
+            self.assertTrue(os.path.exists(cpath))
+            self.assertFalse(os.path.exists(os.path.join(self.root, "__pycache__")))
+        finally:
+            loader.set_cache_dir(None)
+
+    def test_009_cache_not_writable(self):
+
+        name = "loader_test_read_only"
+        path = os.path.join(self.root, name + ".es")
+        with open(path, "w") as wf:
+            wf.write("value = 42\n")
+
+        # the cache directory can not be created below a regular file
+        loader.set_cache_dir(os.path.join(self.source, "cache"))
+        try:
+            mod = self._import(name)
+            self.assertEqual(mod.value, 42)
+        finally:
+            loader.set_cache_dir(None)
+
+        sys.dont_write_bytecode = True
+        mod = self._import(name)
+        self.assertEqual(mod.value, 42)
+        self.assertFalse(os.path.exists(os.path.join(self.root, "__pycache__")))
+
+    def test_010_relative_import(self):
+
+        name = "loader_test_pkg"
+        pkg = os.path.join(self.root, name)
+        os.makedirs(pkg)
+        for filename, text in [("__init__.es", ""), ("a.es", "value = 42\n"),
+                ("b.es", "from .a import value\ncopy = value\n")]:
+            with open(os.path.join(pkg, filename), "w") as wf:
+                wf.write(text)
+
+        try:
+            mod = self._import(name + ".b")
+            # resolved against the package of the module, not ekanscrypt
+            self.assertEqual(mod.__package__, name)
+            self.assertEqual(mod.copy, 42)
+            self.assertIn(name + ".a", sys.modules)
+        finally:
+            for key in [name, name + ".a"]:
+                sys.modules.pop(key, None)
+
+    def test_011_install_threads(self):
+
+        finders = [f for f in sys.meta_path if isinstance(f, EkanscryptFinder)]
+        for finder in finders:
+            sys.meta_path.remove(finder)
+
+        try:
+            threads = [threading.Thread(target=EkanscryptFinder.install) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            installed = [f for f in sys.meta_path if isinstance(f, EkanscryptFinder)]
+            self.assertEqual(len(installed), 1)
+        finally:
+            for finder in installed:
+                sys.meta_path.remove(finder)
+            sys.meta_path[0:0] = finders
+
+    def test_012_compiler_hash(self):
+
+        # editing a compiler module changes the tag of the cache
+        directory = os.path.dirname(cache.__file__)
+        self.assertIn(cache.compiler_hash().encode("utf-8"), cache.CACHE_TAG)
+        self.assertEqual(cache.compiler_hash(directory), cache.compiler_hash())
+
+        for name in cache.COMPILER_MODULES:
+            shutil.copy2(os.path.join(directory, name), self.root)
+        copied = cache.compiler_hash(self.root)
+        self.assertEqual(copied, cache.compiler_hash())
+
+        with open(os.path.join(self.root, "parser.py"), "a") as wf:
+            wf.write("#\n")
+        self.assertNotEqual(cache.compiler_hash(self.root), copied)
+
+    def test_013_reimport(self):
+
+        name = "loader_test_reimport"
+        path = os.path.join(self.root, name + ".es")
+        with open(path, "w") as wf:
+            wf.write("value = 1\n")
+
+        cwd = os.getcwd()
+        try:
+            os.chdir(self.root)
+            mod = importlib.import_module(name)
+            self.assertEqual(mod.value, 1)
+
+            # a module removed from sys.modules is imported again
+            del sys.modules[name]
+            with open(path, "w") as wf:
+                wf.write("value = 22\n")
+            importlib.invalidate_caches()
+            mod = importlib.import_module(name)
+            self.assertEqual(mod.value, 22)
+
+            # reload executes the module again, in place
+            with open(path, "w") as wf:
+                wf.write("value = 333\n")
+            self.assertIs(importlib.reload(mod), mod)
+            self.assertEqual(mod.value, 333)
+            self.assertTrue(loader.import_records[-1].executed)
+        finally:
+            os.chdir(cwd)
+            sys.modules.pop(name, None)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
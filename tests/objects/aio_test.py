@@ -0,0 +1,110 @@
+import io
+import asyncio
+import unittest
+
+from ekanscrypt.program import Program
+from ekanscrypt.objects.proc import EkanscryptProc
+from ekanscrypt.objects.aio import AsyncProc, AsyncNode, AsyncTextNode, \
+    gather, _AsyncPipe
+
+async def _upper(stream):
+    async for line in stream.stdin:
+        await stream.stdout.write(line.upper())
+
+async def _head(stream):
+    await stream.stdout.write(await stream.stdin.readline())
+
+ES_NODES = """
+node = () => {
+    return Proc.AsyncTextNode((stream) => {
+        while (line = stream.stdin.readline2()) {
+            stream.stdout.writeline2(line + "!");
+        }
+    })
+}
+pipelines = [Proc.AsyncProc("echo", str(i)) |> node() for i in range(20)]
+results = Proc.gather(pipelines, 5)
+"""
+
+class AioTestCase(unittest.TestCase):
+
+    def test_001_pipelines(self):
+
+        data = b"a\nb\nc\n"
+        expected = data.upper()
+
+        def mk():
+            return [
+                AsyncNode(_upper)(AsyncProc("printf", "a\\nb\\nc\\n")()),
+                AsyncProc("cat")(AsyncNode(_upper)(AsyncProc("cat")(AsyncProc("printf", "a\\nb\\nc\\n")()))),
+                AsyncProc("cat")(AsyncProc("tr", "a-z", "A-Z")(AsyncProc("printf", "a\\nb\\nc\\n")())),
+                AsyncNode(_upper)(AsyncNode(_upper)(AsyncProc("printf", "a\\nb\\nc\\n")())),
+            ]
+
+        for pipeline in mk():
+            returncode, stdout, stderr = asyncio.run(pipeline.run())
+            self.assertEqual(returncode, 0, pipeline)
+            self.assertEqual(stdout, expected, pipeline)
+
+        results = gather(mk() + mk(), jobs=3)
+        self.assertEqual([r[1] for r in results], [expected] * 8)
+
+    def test_002_backpressure(self):
+
+        async def run():
+            pipe = _AsyncPipe(8)
+            await pipe.write(b"0123456789")
+
+            # the buffer is full, the writer waits for the reader
+            write = asyncio.ensure_future(pipe.write(b"abc"))
+            await asyncio.sleep(0)
+            self.assertFalse(write.done())
+
+            self.assertEqual(await pipe.read(4), b"0123")
+            await write
+            pipe.write_eof()
+            self.assertEqual(await pipe.read(), b"456789abc")
+
+        asyncio.run(run())
+
+    def test_003_early_exit(self):
+
+        # the node stops reading, yes gets a broken pipe
+        pipeline = AsyncNode(_head)(AsyncProc("yes")())
+        returncode, stdout, stderr = asyncio.run(pipeline.run())
+        self.assertEqual(returncode, 0)
+        self.assertEqual(stdout, b"y\n")
+
+    def test_004_errors(self):
+
+        async def fail(stream):
+            raise ValueError()
+
+        returncode, stdout, stderr = asyncio.run(AsyncNode(fail)().run())
+        self.assertEqual(returncode, 1)
+
+        returncode, stdout, stderr = asyncio.run(AsyncProc("false")().run())
+        self.assertEqual(returncode, 1)
+
+        with self.assertRaises(TypeError):
+            AsyncNode(_upper)(EkanscryptProc("true")())
+
+    def test_005_es_nodes(self):
+
+        # ekanscrypt functions are not coroutines, they run on a thread
+        exports = Program().compile_text("<nodes>", ES_NODES).function_body()
+        results = exports['results']
+        self.assertEqual(results, [(0, "%d!\n" % i, "") for i in range(20)])
+
+    def test_006_communicate(self):
+
+        stdout = io.BytesIO()
+        pipeline = AsyncNode(_upper)(AsyncProc("echo", "hello")())
+        self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+        self.assertEqual(stdout.getvalue(), b"HELLO\n")
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,570 @@
+import io
+import os
+import sys
+import json
+import pickle
+import importlib
+import tempfile
+import unittest
+
+from ekanscrypt.program import Program
+from ekanscrypt.objects.proc import EkanscryptProc, EkanscryptProcNode, \
+    EkanscryptProcTextNode, EkanscryptProcObjectNode, EkanscryptProcLineNode, \
+    EkanscryptProcParallel, EkanscryptProcTee, EkanscryptProcMerge, _dumps
+
+def _source(data, chunk=4096):
+    def callback(stream):
+        for i in range(0, len(data), chunk):
+            stream.stdout.write(data[i:i + chunk])
+    return EkanscryptProcNode(callback)
+
+def _passthrough():
+    def callback(stream):
+        buf = stream.stdin.read(4096)
+        while buf:
+            stream.stdout.write(buf)
+            buf = stream.stdin.read(4096)
+    return EkanscryptProcNode(callback)
+
+def _cat():
+    return EkanscryptProc("cat", "-")
+
+def _upper(stream):
+    # a module level function, which can be pickled by name
+    buf = stream.stdin.read(4096)
+    while buf:
+        stream.stdout.write(buf.upper())
+        buf = stream.stdin.read(4096)
+
+def _number(line):
+    # a module level function, which can be run in a worker process
+    return "%06d" % int(line)
+
+ES_NODES = """
+suffix = "!"
+fact(n) => {
+    if (n < 2) {
+        return 1
+    }
+    return n * fact(n - 1)
+}
+shout = (line) => {
+    return line.upper() + suffix
+}
+work = (start_method) => {
+    return Proc.ProcessTextNode((stream) => {
+        while (line = stream.stdin.readline2()) {
+            stream.stdout.writeline2(shout(line) + str(fact(5)));
+        }
+    }, start_method)
+}
+"""
+
+ES_HELPER = """
+add = (a, b) => a + b
+"""
+
+ES_HELPER_NODES = """
+import proc_test_helper
+work = (start_method) => {
+    return Proc.ProcessTextNode((stream) => {
+        while (line = stream.stdin.readline2()) {
+            stream.stdout.writeline2(str(proc_test_helper.add(int(line), 10)))
+        }
+    }, start_method)
+}
+"""
+
+ES_HELPER_PARALLEL = """
+import proc_test_helper
+add10 = (line) => str(proc_test_helper.add(int(line), 10))
+"""
+
+class ProcTestCase(unittest.TestCase):
+
+    def _helper_exports(self, root, source):
+        """ run source, which imports a .es module written to root """
+        with open(os.path.join(root, "proc_test_helper.es"), "w") as wf:
+            wf.write(ES_HELPER)
+        # installs the finder, as ekans does
+        from ekanscrypt import loader
+        importlib.invalidate_caches()
+        cwd = os.getcwd()
+        try:
+            os.chdir(root)
+            return Program().compile_text("<helper>", source).function_body()
+        finally:
+            # the children do not find the module in the working directory
+            os.chdir(cwd)
+            sys.modules.pop("proc_test_helper", None)
+
+    def test_001_pipelines(self):
+
+        # all combinations of nodes and processes can be used
+        # as sources, intermediate stages and sinks
+        data = b"hello world\n"
+        sources = [lambda: EkanscryptProc("echo", "hello world")(), lambda: _source(data)()]
+        stages = [_cat, _passthrough]
+
+        for mk1 in sources:
+            for mk2 in stages:
+                for mk3 in stages:
+                    pipeline = mk3()(mk2()(mk1()))
+                    stdout = io.BytesIO()
+                    returncode = EkanscryptProc.communicate(pipeline, stdout=stdout)
+                    self.assertEqual(returncode, 0, pipeline)
+                    self.assertEqual(stdout.getvalue(), data, pipeline)
+
+    def test_002_large(self):
+
+        # larger than the buffer of a pipe and the read size
+        data = bytes(range(256)) * 4096
+        for bufsize in [1024, 65536, 1 << 20]:
+            pipeline = _cat()(_passthrough()(_source(data)()))
+            stdout = io.BytesIO()
+            returncode = EkanscryptProc.communicate(pipeline,
+                stdout=stdout, bufsize=bufsize)
+            self.assertEqual(returncode, 0)
+            self.assertEqual(stdout.getvalue(), data)
+
+    def test_003_text_node(self):
+
+        # a multi byte character split between two reads is decoded
+        text = "été\n" * 1000
+
+        def callback(stream):
+            stream.stdout.write(text)
+
+        stdout = io.StringIO()
+        pipeline = EkanscryptProcTextNode(callback)()
+        EkanscryptProc.communicate(pipeline, stdout=stdout, bufsize=3)
+        self.assertEqual(stdout.getvalue(), text)
+
+    def test_004_returncode(self):
+
+        returncode, stdout, stderr = EkanscryptProc("false").run()
+        self.assertEqual(returncode, 1)
+
+        def callback(stream):
+            raise ValueError()
+
+        # the node exits with an error before writing any output
+        pipeline = EkanscryptProcNode(callback)()
+        self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=io.BytesIO()), 1)
+
+    def test_005_file_output(self):
+
+        # the output is moved to a file inside the kernel where supported,
+        # a file opened for append cannot be spliced and is copied instead
+        data = bytes(range(256)) * 1024
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "out")
+            for mode in ["wb", "ab"]:
+                for zero_copy in [True, False]:
+                    with open(path, "wb") as wf:
+                        wf.write(b"header")
+                    default, EkanscryptProc.zero_copy = EkanscryptProc.zero_copy, zero_copy
+                    try:
+                        with open(path, mode) as wf:
+                            if mode == "wb":
+                                wf.write(b"header")
+                            pipeline = _cat()(_source(data)())
+                            returncode = EkanscryptProc.communicate(pipeline, stdout=wf)
+                    finally:
+                        EkanscryptProc.zero_copy = default
+                    self.assertEqual(returncode, 0)
+                    with open(path, "rb") as rf:
+                        self.assertEqual(rf.read(), b"header" + data, (mode, zero_copy))
+
+    def test_006_redirect(self):
+
+        # the output file is given to the process, nothing is copied
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "out")
+            redirect = EkanscryptProc.Redirect(1, 1, path)
+            pipeline = EkanscryptProc("cat", "-", redirect)(_source(b"hello\n")())
+            self.assertEqual(EkanscryptProc.communicate(pipeline), 0)
+            for f in pipeline._open_files:
+                f.close()
+            with open(path, "rb") as rf:
+                self.assertEqual(rf.read(), b"hello\n")
+
+    def test_007_process_node(self):
+
+        data = b"hello world\n" * 10000
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "data")
+            with open(path, "wb") as wf:
+                wf.write(data)
+
+            # a forked child copies the locks held by the threads of
+            # other stages, fork is only used between processes
+            for start_method, source in [
+                    ("fork", lambda: EkanscryptProc("cat", path)()),
+                    ("spawn", lambda: _passthrough()(_source(data)()))]:
+                node = EkanscryptProc.ProcessNode(_upper, start_method)
+                pipeline = _cat()(node(source()))
+                stdout = io.BytesIO()
+                returncode = EkanscryptProc.communicate(pipeline, stdout=stdout)
+                self.assertEqual(returncode, 0, start_method)
+                self.assertEqual(stdout.getvalue(), data.upper(), start_method)
+
+        # by default the child is not forked from the threads of the
+        # other stages
+        node = EkanscryptProc.ProcessNode(_upper)
+        self.assertNotEqual(node.context.get_start_method(), "fork")
+        pipeline = _passthrough()(node(_passthrough()(_source(data)())))
+        stdout = io.BytesIO()
+        self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+        self.assertEqual(stdout.getvalue(), data.upper())
+
+        def callback(stream):
+            raise ValueError()
+
+        pipeline = EkanscryptProc.ProcessNode(callback, "fork")()
+        self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=io.BytesIO()), 1)
+
+    def test_008_es_process_node(self):
+
+        # ekanscrypt functions are pickled by value, together with
+        # the globals and closures they use
+        exports = Program().compile_text("<nodes>", ES_NODES).function_body()
+
+        fact = pickle.loads(_dumps(exports['fact']))
+        self.assertEqual(fact(5), 120)
+
+        for start_method in ["fork", "spawn"]:
+            source = EkanscryptProc("printf", "a\\nb\\n")()
+            pipeline = exports['work'](start_method)(source)
+            stdout = io.StringIO()
+            returncode = EkanscryptProc.communicate(pipeline, stdout=stdout)
+            self.assertEqual(returncode, 0, start_method)
+            self.assertEqual(stdout.getvalue(), "A!120\nB!120\n", start_method)
+
+    def test_009_text_streams(self):
+
+        def source(stream):
+            stream.stdout.write("a\r\n\n")
+            stream.stdout.buffer.write(b"b\n")
+            stream.stdout.writeline2("c")
+
+        def node(stream):
+            lines = []
+            line = stream.stdin.readline2()
+            while line:
+                lines.append(line)
+                line = stream.stdin.readline2()
+            stream.stdout.write(repr(lines))
+
+        # line endings are unchanged by default, as with codecs readers
+        for options, expected in [({}, ['a\r', 'b', 'c']),
+                ({"newline": None, "buffer_size": 16}, ['a', 'b', 'c'])]:
+            pipeline = EkanscryptProcTextNode(node, **options)(
+                EkanscryptProcTextNode(source, **options)())
+            stdout = io.StringIO()
+            self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+            self.assertEqual(stdout.getvalue(), repr(expected))
+
+        with self.assertRaises(TypeError):
+            EkanscryptProcTextNode(node, encoding="latin-1")
+
+    def test_010_text_process(self):
+
+        def node(stream):
+            line = stream.stdin.readline2()
+            while line:
+                stream.stdout.writeline2(line.upper())
+                line = stream.stdin.readline2()
+
+        # a text node reading from a process and from a binary node
+        for source in [EkanscryptProc("printf", "a\\nb\\n"), _source(b"a\nb\n")]:
+            stdout = io.StringIO()
+            pipeline = EkanscryptProcTextNode(node)(source())
+            self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+            self.assertEqual(stdout.getvalue(), "A\nB\n")
+
+    def test_011_text_batches(self):
+
+        text = "".join("%d\n\n" % i for i in range(2500)) + "last"
+        expected = [str(i) for i in range(2500)] + ["last"]
+
+        def source(stream):
+            stream.stdout.writelines([text[i:i + 7] for i in range(0, len(text), 7)])
+
+        def node(stream):
+            batches = list(stream.stdin.batches(1000))
+            stream.stdout.writelines2([repr([len(b) for b in batches])])
+            stream.stdout.writelines2(sum(batches, []))
+            stream.stdout.writelines2([])
+
+        for buffer_size in [16, 65536]:
+            pipeline = EkanscryptProcTextNode(node, buffer_size=buffer_size)(
+                EkanscryptProcTextNode(source)())
+            stdout = io.StringIO()
+            self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+            lines = stdout.getvalue().split("\n")
+            self.assertEqual(lines[0], "[1000, 1000, 501]")
+            self.assertEqual(lines[1:], expected + [""])
+
+        def lines(stream):
+            stream.stdout.write(repr([line for line in stream.stdin]))
+
+        pipeline = EkanscryptProcTextNode(lines)(EkanscryptProc("printf", "a\nb\n")())
+        stdout = io.StringIO()
+        self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+        self.assertEqual(stdout.getvalue(), repr(["a\n", "b\n"]))
+
+    def test_012_object_nodes(self):
+
+        def source(stream):
+            for i in range(5000):
+                stream.stdout.put({"i": i})
+
+        def double(stream):
+            for obj in stream.stdin:
+                stream.stdout.put((obj["i"], obj["i"] * 2))
+
+        def parse(stream):
+            for lines in stream.stdin.batches():
+                stream.stdout.putmany([json.loads(line) for line in lines])
+
+        expected = "".join("[%d, %d]\n" % (i, i * 2) for i in range(5000))
+
+        # objects are passed in memory, or as lines through a process
+        for mk in [lambda: EkanscryptProcObjectNode(source)(),
+                lambda: EkanscryptProcObjectNode(parse)(_cat()(
+                    EkanscryptProcObjectNode(source, batch_size=7, queue_size=1)()))]:
+            stdout = io.StringIO()
+            pipeline = EkanscryptProcObjectNode(double)(mk())
+            self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+            self.assertEqual(stdout.getvalue(), expected)
+
+        # a node reading bytes
+        pipeline = _passthrough()(EkanscryptProcObjectNode(
+            lambda stream: stream.stdout.putmany(["a", [1], None]))())
+        stdout = io.BytesIO()
+        self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+        self.assertEqual(stdout.getvalue(), b"a\n[1]\nnull\n")
+
+    def test_013_object_early_exit(self):
+
+        def forever(stream):
+            while True:
+                stream.stdout.put("y")
+
+        def head(stream):
+            stream.stdout.put(stream.stdin.get())
+
+        for source in [EkanscryptProc("yes"), EkanscryptProcObjectNode(forever)]:
+            stdout = io.StringIO()
+            pipeline = EkanscryptProcObjectNode(head)(source())
+            self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+            self.assertEqual(stdout.getvalue(), "y\n")
+
+    def test_014_line_nodes(self):
+
+        def drop(line):
+            return None if line.startswith("B") else line
+
+        for fuse in [True, False]:
+            nodes = [EkanscryptProcLineNode(f, fuse=fuse)
+                for f in [str.upper, drop, lambda line: line + "!"]]
+            pipeline = EkanscryptProc("printf", "a\\n\\nb\\nc\\n")()
+            for node in nodes:
+                pipeline = node(pipeline)
+            stdout = io.StringIO()
+            self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+            self.assertEqual(stdout.getvalue(), "A!\nC!\n")
+
+            # fused nodes run on the thread of the last node
+            threads = [node.thread is not None for node in nodes]
+            self.assertEqual(threads, [False, False, True] if fuse else [True] * 3)
+            self.assertEqual([node.returncode for node in nodes], [0] * 3)
+
+        # a node which does not fuse keeps its thread, whatever the
+        # setting of the next node
+        nodes = [EkanscryptProcLineNode(str.upper, fuse=False),
+            EkanscryptProcLineNode(drop), EkanscryptProcLineNode(lambda line: line + "!")]
+        pipeline = EkanscryptProc("printf", "a\\n\\nb\\nc\\n")()
+        for node in nodes:
+            pipeline = node(pipeline)
+        stdout = io.StringIO()
+        self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+        self.assertEqual(stdout.getvalue(), "A!\nC!\n")
+        self.assertIsNone(nodes[0]._fused)
+        self.assertEqual([node.thread is not None for node in nodes], [True, False, True])
+
+        # a line node is started before it is read by other stages
+        pipeline = _cat()(EkanscryptProcTextNode(lambda stream:
+            stream.stdout.write(stream.stdin.read()))(
+            EkanscryptProcLineNode(str.upper)(_source(b"a\n")())))
+        stdout = io.BytesIO()
+        self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+        self.assertEqual(stdout.getvalue(), b"A\n")
+
+    def test_015_parallel(self):
+
+        data = "".join("%d\n" % i for i in range(5000)).encode()
+        expected = "".join("%06d\n" % i for i in range(5000))
+
+        # the output is in the order of the input, unless unordered
+        for options in [{}, {"processes": True}, {"processes": True, "start_method": "spawn"},
+                {"ordered": False}]:
+            node = EkanscryptProcParallel(EkanscryptProcLineNode(_number),
+                workers=3, batch_size=100, **options)
+            stdout = io.StringIO()
+            pipeline = node(_source(data)())
+            self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+            if node.ordered:
+                self.assertEqual(stdout.getvalue(), expected, options)
+            else:
+                self.assertEqual(sorted(stdout.getvalue().splitlines()),
+                    expected.splitlines(), options)
+
+        def fail(line):
+            raise ValueError(line)
+
+        pipeline = EkanscryptProcParallel(fail, workers=2)(_source(b"a\n")())
+        self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=io.StringIO()), 1)
+
+        with self.assertRaises(TypeError):
+            EkanscryptProcParallel(EkanscryptProcTextNode(fail))
+        with self.assertRaises(ValueError):
+            EkanscryptProcParallel(fail, processes=True, start_method="fork")
+
+    def test_016_tee_merge(self):
+
+        data = bytes(range(256)) * 1024
+        lines = b"".join(b"line %d\n" % i for i in range(20000))
+
+        # concat reads the second output after the first, the tee must
+        # buffer all of it
+        tee = EkanscryptProcTee(2, queue_size=0)(_source(data)())
+        pipeline = EkanscryptProcMerge([_cat()(tee[0]), _passthrough()(tee[1])], "concat")()
+        stdout = io.BytesIO()
+        self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+        self.assertEqual(stdout.getvalue(), data + data)
+        self.assertEqual([b.returncode for b in tee.branches], [0, 0])
+
+        # interleave writes whole lines, with bounded buffers
+        tee = EkanscryptProcTee(3, buffer_size=1000, queue_size=1)(_source(lines, 777)())
+        pipeline = EkanscryptProcMerge([tee[0], EkanscryptProcLineNode(str.upper)(tee[1]),
+            EkanscryptProc("tr", "l", "L")(tee[2]), EkanscryptProc("printf", "x")])()
+        stdout = io.BytesIO()
+        self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+        expected = lines + lines.upper() + lines.replace(b"l", b"L") + b"x\n"
+        self.assertEqual(sorted(stdout.getvalue().splitlines()),
+            sorted(expected.splitlines()))
+
+        with self.assertRaises(ValueError):
+            EkanscryptProcMerge([], "zip")
+
+    def test_017_tee_early_exit(self):
+
+        def head(stream):
+            stream.stdout.write(stream.stdin.read(2))
+
+        # the tee stops reading once every output is closed
+        tee = EkanscryptProcTee(2)(EkanscryptProc("yes")())
+        pipeline = EkanscryptProcMerge([EkanscryptProcNode(head)(tee[0]),
+            EkanscryptProcNode(head)(tee[1])], "concat")()
+        stdout = io.BytesIO()
+        self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+        self.assertEqual(stdout.getvalue(), b"y\ny\n")
+
+        # a closed output does not stop the others
+        data = b"hello\n" * 100000
+        tee = EkanscryptProcTee(2, queue_size=1)(_source(data)())
+        pipeline = EkanscryptProcMerge([EkanscryptProcNode(head)(tee[0]), tee[1]])()
+        stdout = io.BytesIO()
+        self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+        self.assertEqual(len(stdout.getvalue()), len(data) + 3)
+
+    def test_018_broken_pipe(self):
+
+        def forever(stream):
+            while True:
+                stream.stdout.write(b"y\n" * 1000)
+
+        def text_forever(stream):
+            while True:
+                stream.stdout.write("y\n" * 1000)
+
+        def head(stream):
+            stream.stdout.write(stream.stdin.read(4))
+
+        # the source stops with a broken pipe once the next stage exits,
+        # without reporting an error
+        stderr, sys.stderr = sys.stderr, io.StringIO()
+        try:
+            for node, source, stdout, expected in [
+                    (EkanscryptProcNode, forever, io.BytesIO(), b"y\ny\n"),
+                    (EkanscryptProcTextNode, text_forever, io.StringIO(), "y\ny\n")]:
+                upstream = node(source)()
+                pipeline = node(head)(upstream)
+                self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+                self.assertEqual(stdout.getvalue(), expected)
+                self.assertEqual(upstream.returncode, 1)
+            errors = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(errors, "")
+
+    def test_019_tee_output(self):
+
+        data = b"hello\n" * 10
+
+        # the tee itself has no output, only tee[i] can be read
+        tee = EkanscryptProcTee(2)(_source(data)())
+        with self.assertRaises(TypeError):
+            _passthrough()(tee)
+        with self.assertRaises(TypeError):
+            _cat()(tee)
+        with self.assertRaises(TypeError):
+            EkanscryptProcMerge([tee])()
+        with self.assertRaises(TypeError):
+            EkanscryptProc.communicate(tee)
+        # 'tee |> sink' calls the tee again, without an input
+        with self.assertRaises(TypeError):
+            tee()
+
+        # the outputs can still be read
+        pipeline = EkanscryptProcMerge([tee[0], tee[1]], "concat")()
+        stdout = io.BytesIO()
+        self.assertEqual(EkanscryptProc.communicate(pipeline, stdout=stdout), 0)
+        self.assertEqual(stdout.getvalue(), data + data)
+
+    def test_020_process_node_es_import(self):
+
+        # the modules used by the callback are imported in the child,
+        # .es modules from their source file
+        with tempfile.TemporaryDirectory() as root:
+            exports = self._helper_exports(root, ES_HELPER_NODES)
+            for start_method in [None, "spawn"]:
+                source = EkanscryptProc("printf", "1\\n2\\n")()
+                pipeline = exports['work'](start_method)(source)
+                stdout = io.StringIO()
+                returncode = EkanscryptProc.communicate(pipeline, stdout=stdout)
+                self.assertEqual(returncode, 0, start_method)
+                self.assertEqual(stdout.getvalue(), "11\n12\n", start_method)
+
+    def test_021_parallel_es_import(self):
+
+        # the transforms are unpickled in the workers before any
+        # line is read, .es modules are imported from their source file
+        with tempfile.TemporaryDirectory() as root:
+            exports = self._helper_exports(root, ES_HELPER_PARALLEL)
+            for start_method in [None, "spawn"]:
+                node = EkanscryptProcParallel(exports['add10'], workers=2,
+                    processes=True, start_method=start_method)
+                pipeline = node(_source(b"1\n2\n3\n")())
+                stdout = io.StringIO()
+                returncode = EkanscryptProc.communicate(pipeline, stdout=stdout)
+                self.assertEqual(returncode, 0, start_method)
+                self.assertEqual(stdout.getvalue(), "11\n12\n13\n", start_method)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+    main()
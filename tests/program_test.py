@@ -1,5 +1,15 @@
+import os
+import sys
+import tempfile
+import importlib
+import threading
+import subprocess
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from ekanscrypt.program import Program
+from ekanscrypt.cache import CompileCache
+from ekanscrypt.instrument import CompileProfile
+from ekanscrypt.bench.runtime import WORKLOADS
 
 class ParserTestCase(unittest.TestCase):
 
@@ -197,6 +207,199 @@ class ParserTestCase(unittest.TestCase):
                 if e is not None:
                     self.assertEqual(a, e, "%d: %s != %s" % (i, a ,e))
 
+    def test_007_compile_cache(self):
+
+        with tempfile.TemporaryDirectory() as root:
+            cache = CompileCache(os.path.join(root, "cache"))
+            prog = Program(cache=cache)
+
+            text = "f = (x) => x * 2; y = f(21)"
+            rv = prog.compile_text("<string>", text).function_body()
+            self.assertEqual(rv['y'], 42)
+            self.assertEqual(cache.stats(), {"hits": 0, "misses": 1, "errors": 0})
+
+            rv = prog.compile_text("<string>", text).function_body()
+            self.assertEqual(rv['y'], 42)
+            self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "errors": 0})
+
+            # any change to the source is a different entry
+            rv = prog.compile_text("<string>", text + " + 1").function_body()
+            self.assertEqual(rv['y'], 43)
+            self.assertEqual(cache.misses, 2)
+
+            # a second program shares the entries written by the first
+            path = os.path.join(root, "script.es")
+            with open(path, "w") as wf:
+                wf.write(text)
+            Program(cache=cache).compile(path)
+            self.assertEqual(Program(cache=cache).compile(path).function_body()['y'], 42)
+            self.assertEqual(cache.hits, 2)
+
+    def test_008_cache_hit_imports(self):
+
+        # a cache hit should not import the compiler or process machinery
+        script = (
+            "import sys\n"
+            "from ekanscrypt.program import Program\n"
+            "from ekanscrypt.cache import CompileCache\n"
+            "prog = Program(cache=CompileCache(sys.argv[1]))\n"
+            "prog.compile_text('<string>', 'x = 1').function_body()\n"
+            "print(' '.join(name for name in ['ekanscrypt.compiler', "
+            "'ekanscrypt.objects.proc', 'bytecode'] if name in sys.modules))\n"
+        )
+
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=root)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            argv = [sys.executable, "-c", script, cache_dir]
+            first = subprocess.run(argv, env=env, stdout=subprocess.PIPE, check=True)
+            second = subprocess.run(argv, env=env, stdout=subprocess.PIPE, check=True)
+
+        self.assertIn(b"ekanscrypt.compiler", first.stdout)
+        self.assertEqual(second.stdout.strip(), b"")
+
+    def test_009_import_registry(self):
+
+        name = "program_test_registry"
+        with tempfile.TemporaryDirectory() as root:
+            with open(os.path.join(root, name + ".es"), "w") as wf:
+                wf.write("items = []\n")
+
+            prog = Program()
+            cwd = os.getcwd()
+            try:
+                os.chdir(root)
+                mod = prog.import_(1, name, root)
+                mod.items.append(1)
+                # every path to the same file shares one module
+                self.assertIs(prog.import_(1, name, root), mod)
+                self.assertIs(prog.es_import(name), mod)
+                self.assertIs(prog.import_(0, name, root), mod)
+                self.assertIs(importlib.import_module(name), mod)
+                self.assertEqual(mod.items, [1])
+            finally:
+                os.chdir(cwd)
+                sys.modules.pop(name, None)
+
+            # python modules are imported as usual
+            self.assertIs(prog.import_(0, "json", root), sys.modules["json"])
+
+    def test_010_profile_compile(self):
+
+        with tempfile.TemporaryDirectory() as root:
+            cache = CompileCache(root)
+            prog = Program(cache=cache)
+            profile = CompileProfile()
+
+            text = "f = (x) => {\n    g = (y) => y + 1\n    return g(x)\n}\ny = f(41)\n"
+            rv = prog.compile_text("<string>", text, profile=profile).function_body()
+            self.assertEqual(rv['y'], 42)
+            # profiling always compiles
+            self.assertEqual(cache.stats(), {"hits": 0, "misses": 0, "errors": 0})
+
+        report = {phase["name"]: phase for phase in profile.report()}
+        for name in ["lex", "parse", "walk", "walk2", "treewalk_varscopes",
+                     "compile", "codegen", "_finalize", "calcsize", "to_code",
+                     "lambda <anonymous> line 1", "lambda <anonymous> line 2"]:
+            self.assertIn(name, report)
+
+        passes = [name for name in report if name.startswith("precedence2[")]
+        self.assertTrue(len(passes) > 20)
+
+        # one for each function, and one for the module
+        self.assertEqual(report["to_code"]["count"], 3)
+        self.assertEqual(report["lambda <anonymous> line 2"]["depth"],
+            report["lambda <anonymous> line 1"]["depth"] + 1)
+        self.assertTrue(report["lex"]["tokens"] > 0)
+
+        for phase in report.values():
+            self.assertTrue(phase["self"] <= phase["total"] + 1e-9)
+        self.assertAlmostEqual(profile.total(),
+            report["lex"]["total"] + report["parse"]["total"] + report["compile"]["total"])
+
+    def test_011_concurrent_compile(self):
+
+        # the lexer, parser and compiler share no state between
+        # compilations, compiling in many threads at the same time
+        # must produce the same code as compiling one at a time
+        sources = {name: workload[0] for name, workload in WORKLOADS.items()}
+
+        with tempfile.TemporaryDirectory() as root:
+            cache = CompileCache(root)
+            cache.enabled = False
+            prog = Program(cache=cache)
+
+            def compile(name, profile=None):
+                unit = prog.compile_text("<%s>" % name, sources[name], profile=profile)
+                # marshal output depends on reference counts, compare the code
+                return unit.function_body.__code__
+
+            expected = {name: compile(name) for name in sources}
+
+            serial = CompileProfile()
+            compile("mergesort", serial)
+            tokens = {p["name"]: p["tokens"] for p in serial.report()}
+
+            barrier = threading.Barrier(4)
+
+            def task(args):
+                index, name = args
+                if index < 4:
+                    # start the first compilations together
+                    barrier.wait()
+                profile = CompileProfile() if name == "mergesort" else None
+                result = compile(name, profile)
+                if profile is not None:
+                    # other threads do not change the count of tokens
+                    result = (result, {p["name"]: p["tokens"] for p in profile.report()})
+                return name, result
+
+            jobs = list(enumerate(list(sources) * 8))
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(task, jobs))
+
+        for name, result in results:
+            if name == "mergesort":
+                result, counts = result
+                self.assertEqual(counts, tokens)
+            self.assertEqual(result, expected[name], name)
+
+    def test_012_drill_index(self):
+
+        # x->y with an integer y indexes a list, None when out of range
+        prog = Program()
+
+        tests = [
+            ("x = [10, 20]\ny = x->1", 20),
+            ("x = [10, 20]\ny = x->0", 10),
+            ("x = [10, 20]\ny = x->2", None),
+            ("x = {\"a\": [10, {\"b\": 20}]}\ny = x->a->1->b", 20),
+            ("x = {\"a\": []}\ny = x->a->0->b", None),
+        ]
+
+        for text, expected in tests:
+            rv = prog.execute_text(text)
+            self.assertEqual(rv['y'], expected, text)
+
+    def test_013_cache_read_only(self):
+
+        with tempfile.TemporaryDirectory() as root:
+            # the cache root is below a file, it can not be created
+            path = os.path.join(root, "file")
+            with open(path, "w") as wf:
+                wf.write("")
+            cache = CompileCache(os.path.join(path, "cache"))
+            prog = Program(cache=cache)
+
+            # the failure is not a warning, and is only reported once
+            with self.assertLogs("ekanscrypt.cache", "DEBUG") as logs:
+                for i in range(3):
+                    rv = prog.compile_text("<string>", "y = %d" % i).function_body()
+                    self.assertEqual(rv['y'], i)
+            self.assertEqual([r.levelname for r in logs.records], ["INFO"])
+            self.assertFalse(cache.writable)
+            self.assertEqual(cache.stats(), {"hits": 0, "misses": 3, "errors": 1})
+
     # with(f:io.open('./tmp', 'w')){f.write('test');}
 
     # TODO: (a,b,(c,(d,e)),f)=(1,2,(3,(4,5)),6); print(a,b,c,d,e,f)